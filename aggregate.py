@@ -0,0 +1,303 @@
+"""Streaming uptime and RTT percentiles per target.
+
+Raw results are written line by line, so SLOs (availability, p99 of RTT)
+could be computed only by scanning whole history. Aggregator is fed by
+results and keeps for every (host, ip, port) and every window (e.g. last 5
+minutes and last hour):
+    1) number of checks and number of successful ones;
+    2) RTT sketch - log-bucketed histogram with fixed relative accuracy
+       (like DDSketch). Its memory doesn't depend on number of values and
+       two sketches are merged exactly by adding bucket counts.
+
+Window is a ring of `slices` time slices aligned to epoch, so windows slide
+by slice, old slices are reused and memory of target is fixed. Slices are
+aligned by result time, so aggregators of different processes (or hosts) are
+merged by `merge` or from saved states:
+
+    python aggregate.py shard1.json.state shard2.json.state
+"""
+import json
+import math
+import os
+import sys
+import time
+import typing
+
+import network
+
+# Percentiles in summary.
+QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+class Sketch:
+    """Mergeable quantile sketch of non-negative values.
+
+    Value v > 0 is counted in bucket ceil(log(v, gamma)), where
+    gamma = (1 + accuracy) / (1 - accuracy), so any quantile is returned with
+    relative error not more than `accuracy`. When there are more than
+    `max_buckets` buckets, lowest ones are collapsed (low quantiles lose
+    accuracy first).
+
+    Args:
+        accuracy (float): relative accuracy of quantiles.
+        max_buckets (int): max number of buckets.
+
+    """
+    __slots__ = ('accuracy', 'max_buckets', 'gamma', '_log_gamma', 'buckets',
+                 'zeros', 'count')
+
+    def __init__(self, accuracy: float = 0.01, max_buckets: int = 512):
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        self.count += count
+        if value <= 0:
+            self.zeros += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        indexes = sorted(self.buckets)
+        lowest = indexes[:len(indexes) - self.max_buckets + 1]
+        self.buckets[lowest[-1]] += sum(self.buckets.pop(index)
+                                        for index in lowest[:-1])
+
+    def merge(self, other: 'Sketch'):
+        """Adds values of `other` sketch (with same accuracy)."""
+        if other.gamma != self.gamma:
+            raise ValueError('Sketches with different accuracy.')
+        self.count += other.count
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, q: float) -> float | None:
+        """Returns q-quantile (0 <= q <= 1) or None if sketch is empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Middle of bucket (gamma^(i-1), gamma^i] by relative error.
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_state(self) -> list:
+        return [self.zeros, self.count, sorted(self.buckets.items())]
+
+    def load_state(self, state: list) -> 'Sketch':
+        self.zeros, self.count, buckets = state
+        self.buckets = {int(index): count for index, count in buckets}
+        return self
+
+
+class Slice:
+    """Checks of target in one time slice of window."""
+    __slots__ = ('id', 'up', 'total', 'rtt')
+
+    def __init__(self, slice_id: int, rtt: Sketch):
+        self.id = slice_id
+        self.up = 0
+        self.total = 0
+        self.rtt = rtt
+
+
+class Aggregator:
+    """Uptime counters and RTT sketches of targets over sliding windows.
+
+    Args:
+        windows (tuple[int, ...]): window lengths in seconds.
+        slices (int): number of slices of every window. Window slides by
+          1/slices of its length.
+        accuracy (float): relative accuracy of RTT percentiles.
+        max_buckets (int): max buckets of RTT sketch of every slice.
+
+    """
+
+    def __init__(self, windows: tuple[int, ...] = (300, 3600),
+                 slices: int = 10, accuracy: float = 0.01,
+                 max_buckets: int = 512):
+        self.windows = tuple(windows)
+        self.slices = slices
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        # Slice length of every window in ns.
+        self._lengths = [int(window * 10 ** 9) // slices
+                         for window in self.windows]
+        # (host, ip, port) -> ring of slices of every window.
+        self._targets: dict[tuple, list[list[Slice | None]]] = {}
+
+    def __len__(self):
+        return len(self._targets)
+
+    def _sketch(self) -> Sketch:
+        return Sketch(self.accuracy, self.max_buckets)
+
+    def _rings(self, key: tuple) -> list[list[Slice | None]]:
+        rings = self._targets.get(key)
+        if rings is None:
+            rings = self._targets[key] = [[None] * self.slices
+                                          for _ in self.windows]
+        return rings
+
+    def add(self, result: network.CheckResult):
+        """Counts check result. Pingable address is up."""
+        result = network.Result.from_dict(result)
+        up = result.status != 0
+        rtt = result.rtt if up else None
+        for length, ring in zip(self._lengths,
+                                self._rings((result.host, result.ip,
+                                             result.port))):
+            slice_id = result.time_ns // length
+            entry = ring[slice_id % self.slices]
+            if entry is None or entry.id < slice_id:
+                entry = ring[slice_id % self.slices] = \
+                    Slice(slice_id, self._sketch())
+            elif entry.id > slice_id:
+                continue  # Too old result, its slice is already reused.
+            entry.total += 1
+            entry.up += up
+            if rtt is not None:
+                entry.rtt.add(rtt)
+
+    def _current(self, ring: list[Slice | None],
+                 slice_id: int) -> typing.Generator[Slice, None, None]:
+        """Yields slices of ring which are in window ending at slice_id."""
+        for entry in ring:
+            if entry is not None and slice_id - self.slices < entry.id <= \
+                    slice_id:
+                yield entry
+
+    def prune(self, now_ns: int | None = None):
+        """Forgets targets without checks in any window."""
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        for key, rings in list(self._targets.items()):
+            if not any(any(self._current(ring, now_ns // length))
+                       for length, ring in zip(self._lengths, rings)):
+                del self._targets[key]
+
+    def summary(self, now_ns: int | None = None) -> \
+            typing.Generator[dict, None, None]:
+        """Yields uptime and RTT percentiles of every target and window.
+
+        Args:
+            now_ns (int | None): end of windows in epoch ns. Default - now.
+
+        Yields:
+            dict: `host`, `ip`, `port`, `window` (seconds), `checks`, `up`,
+              `uptime` (0..1) and RTT (ms) percentiles of QUANTILES.
+        """
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        for (host, ip, port), rings in self._targets.items():
+            for window, length, ring in zip(self.windows, self._lengths,
+                                            rings):
+                rtt = self._sketch()
+                checks = up = 0
+                for entry in self._current(ring, now_ns // length):
+                    checks += entry.total
+                    up += entry.up
+                    rtt.merge(entry.rtt)
+                if not checks:
+                    continue
+                row = {'host': host, 'ip': ip, 'port': port,
+                       'window': window, 'checks': checks, 'up': up,
+                       'uptime': up / checks}
+                for name, q in QUANTILES:
+                    row[name] = rtt.quantile(q)
+                yield row
+
+    def merge(self, other: 'Aggregator'):
+        """Adds checks of `other` aggregator (with same settings)."""
+        if (other.windows, other.slices, other.accuracy) != \
+                (self.windows, self.slices, self.accuracy):
+            raise ValueError('Aggregators with different settings.')
+        for key, other_rings in other._targets.items():
+            for ring, other_ring in zip(self._rings(key), other_rings):
+                for idx, other_entry in enumerate(other_ring):
+                    if other_entry is None:
+                        continue
+                    entry = ring[idx]
+                    if entry is None or entry.id < other_entry.id:
+                        entry = ring[idx] = Slice(other_entry.id,
+                                                  self._sketch())
+                    elif entry.id > other_entry.id:
+                        continue
+                    entry.total += other_entry.total
+                    entry.up += other_entry.up
+                    entry.rtt.merge(other_entry.rtt)
+
+    def to_state(self) -> dict:
+        """Returns JSON serializable state (see `from_state`)."""
+        return {
+            'windows': self.windows,
+            'slices': self.slices,
+            'accuracy': self.accuracy,
+            'max_buckets': self.max_buckets,
+            'targets': [
+                [*key, [[[entry.id, entry.up, entry.total,
+                          entry.rtt.to_state()]
+                         for entry in ring if entry is not None]
+                        for ring in rings]]
+                for key, rings in self._targets.items()
+            ]
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'Aggregator':
+        """Makes aggregator from `to_state` result."""
+        res = cls(state['windows'], state['slices'], state['accuracy'],
+                  state['max_buckets'])
+        for host, ip, port, rings in state['targets']:
+            target_rings = res._rings((host, ip, port))
+            for ring, entries in zip(target_rings, rings):
+                for slice_id, up, total, rtt in entries:
+                    entry = ring[slice_id % res.slices] = \
+                        Slice(slice_id, res._sketch().load_state(rtt))
+                    entry.up, entry.total = up, total
+        return res
+
+    def dump(self, path: str):
+        """Writes summary (json lines) to `path` and state to `path`.state.
+
+        Both files are replaced atomically.
+        """
+        now_ns = time.time_ns()
+        self.prune(now_ns)
+        for file_path, lines in (
+                (path, (json.dumps(row) for row in self.summary(now_ns))),
+                (path + '.state', (json.dumps(self.to_state()),))):
+            tmp_path = file_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.writelines(line + '\n' for line in lines)
+            os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, state_path: str) -> 'Aggregator':
+        """Reads aggregator from state file written by `dump`."""
+        with open(state_path, encoding='utf-8') as file:
+            return cls.from_state(json.load(file))
+
+
+if __name__ == '__main__':
+    # Merges state files and prints summary:
+    # python aggregate.py a.json.state b.json.state
+    merged = Aggregator.load(sys.argv[1])
+    for state_file in sys.argv[2:]:
+        merged.merge(Aggregator.load(state_file))
+    for summary_row in merged.summary():
+        print(json.dumps(summary_row))
@@ -1,12 +1,28 @@
 """Main file."""
+import asyncio
+import functools
+import os
 import sys
 import time
+import typing
 import argparse
 
+import aggregate
+import breaker
+import certcache
+import changes
+import cluster
 import data_input
 import data_output
+import engine
+import httppool
+import metrics
 import network
-import utils
+import resolver
+import results_store
+import scheduler
+import synscan
+import workers
 
 
 def main(args: argparse.Namespace):
@@ -16,55 +32,335 @@ def main(args: argparse.Namespace):
     It's big only because of prints in fact :)
     """
 
-    data = data_input.Reader.read(args.connection_string)
-    invalid = list(filter(lambda value: not value.get('valid'), data.values()))
-    valid = list(filter(lambda value: value.get('valid'), data.values()))
+    if args.agent:
+        host, port = cluster.parse_address(args.agent, '127.0.0.1')
+        asyncio.run(cluster.Agent(host, port,
+                                  functools.partial(make_engine, args),
+                                  token=args.cluster_token).run())
+        return
+    watcher = None
+    if args.watch:
+        watcher = data_input.SourceWatcher(args.connection_string)
+        invalid = watcher.poll().invalid
+        targets = functools.partial(watched_targets, watcher)
+    elif args.stream:
+        targets = stream_valid(args)
+        invalid = [] if args.force else [
+            value for value in data_input.Reader.stream(args.connection_string)
+            if not value.get('valid')
+        ]
+    else:
+        data = data_input.Reader.read(args.connection_string)
+        invalid = list(filter(lambda value: not value.get('valid'),
+                              data.values()))
+        valid = list(filter(lambda value: value.get('valid'), data.values()))
+        targets = functools.partial(iter, valid)
     if len(invalid) and not args.force:
         print('Program input contains invalid values, that unable to parse.')
         print('Use --skip_invalid parameter to skip it, or fix your input file')
         print('invalid values (first index = 1): ')
         for val in invalid:
-            print(f'element #{val.get("idx") + 1} ', end='')
-            print(f'host={val.get("host") or "``"} | ', end='')
-            print(f'ports={",".join(val.get("ports"))}')
+            print_invalid(val)
         exit(0)
-    writer = data_output.StdPrintWriter()
-    plug = '???'
-    while True:
-        writer.write('Check results' +
-                     (' for new iteration:' if args.infinite else ':'))
-        for host_settings in valid:
-            for result in network.check(**host_settings):
-                if ip := result.get('ip'):
-                    host = result.get('host')
-                    host = host if not utils.is_ip(host) else plug
-                    status = result.get('status')
-                    cert_info = result.get('ssl_cert')
-                    match status:
-                        case 1:
-                            status = 'opened'
-                        case 0:
-                            status = 'Closed'
-                        case None:
-                            status = 'Address pingable.'
-                    writer.write(
-                        f"{result.get('time')} |"
-                        f" {host} |"
-                        f" {ip} | {result.get('rtt')} ms "
-                        f"| {result.get('port') or plug} | "
-                        f"{status} |"
-                        f" {cert_info[-1]}"
-                    )
-                else:
-                    writer.write(
-                        f"{result.get('time')} |"
-                        f" {result.get('host')} |"
-                        f" {plug}  | 0 ms | {result.get('port') or plug} | "
-                        f"Hostname not resolved."
-                    )
-        if not args.infinite:
-            break
-        time.sleep(int(args.period))
+    output = Output(
+        data_output.BatchWriter([
+            (data_output.Writer.get_writer(connection_string),
+             data_output.Serializer.get_serializer(
+                 'ndjson' if connection_string.startswith('unix:') and
+                 args.format == 'text' else args.format
+             ))
+            for connection_string in args.outputs or ['stdout']
+        ]),
+        results_store.ResultStore(args.store) if args.store else None,
+        changes.ChangeTracker(
+            float(args.rtt_band), int(args.snapshot_every)
+        ) if args.changes_only else None,
+        args.metrics_file,
+        aggregate.Aggregator(
+            tuple(int(window) for window in args.windows.split(','))
+        ) if args.aggregate else None,
+        args.aggregate
+    )
+    if args.metrics_file or args.metrics_port:
+        metrics.enable()
+    try:
+        if args.schedule:
+            asyncio.run(run_scheduled(args, targets, make_engine(args),
+                                      output, watcher))
+        elif args.coordinator:
+            asyncio.run(run_coordinator(args, list(targets()), output))
+        elif int(args.workers) > 1:
+            asyncio.run(run_workers(args, list(targets()), output))
+        else:
+            asyncio.run(run(args, targets, make_engine(args), output))
+    finally:
+        output.close()
+        if watcher is not None:
+            watcher.close()
+
+
+class Output:
+    """Sends results everywhere they are needed.
+
+    Args:
+        writer (data_output.BatchWriter): writer of results. Results are
+          formatted by its sinks in background.
+        store (results_store.ResultStore | None): results history.
+        tracker (changes.ChangeTracker | None): if provided, only changed
+          results are written by `writer` (but all are stored).
+        metrics_file (str | None): file to dump metrics to after every
+          iteration.
+        aggregator (aggregate.Aggregator | None): uptime and RTT percentiles
+          of all results.
+        aggregate_file (str | None): file to write `aggregator` summary to
+          after every iteration.
+
+    """
+
+    def __init__(self, writer: data_output.BatchWriter,
+                 store: results_store.ResultStore | None = None,
+                 tracker: changes.ChangeTracker | None = None,
+                 metrics_file: str | None = None,
+                 aggregator: aggregate.Aggregator | None = None,
+                 aggregate_file: str | None = None):
+        self.writer = writer
+        self.store = store
+        self.tracker = tracker
+        self.metrics_file = metrics_file
+        self.aggregator = aggregator
+        self.aggregate_file = aggregate_file
+
+    def start_iteration(self, infinite: bool):
+        if self.tracker is not None:
+            self.tracker.start_iteration()
+        self.writer.write('Check results' +
+                          (' for new iteration:' if infinite else ':'))
+
+    def add(self, result: network.CheckResult):
+        with metrics.stage_timer('write'):
+            if self.tracker is None or self.tracker.changed(result):
+                self.writer.write(result)
+            if self.store is not None:
+                self.store.add(result)
+            if self.aggregator is not None:
+                self.aggregator.add(result)
+
+    async def drain(self):
+        """Waits if writer falls behind."""
+        await self.writer.drain()
+
+    async def add_async(self, result: network.CheckResult):
+        """Same as `add`, but waits if writer falls behind."""
+        self.add(result)
+        await self.drain()
+
+    def finish_iteration(self):
+        with metrics.stage_timer('write'):
+            if self.store is not None:
+                self.store.flush()
+        if self.metrics_file:
+            metrics.dump(self.metrics_file)
+        if self.aggregator is not None:
+            self.aggregator.dump(self.aggregate_file)
+
+    def close(self):
+        """Writes everything left."""
+        self.writer.close()
+
+
+def print_invalid(value: dict):
+    """Prints invalid input element."""
+    print(f'element #{value.get("idx") + 1} ', end='')
+    print(f'host={value.get("host") or "``"} | ', end='')
+    print(f'ports={",".join(map(str, value.get("ports") or []))}')
+
+
+def stream_valid(args: argparse.Namespace) -> \
+        typing.Callable[[], typing.Generator[dict, None, None]]:
+    """Returns function, which reads input lazily and yields valid elements.
+
+    Invalid elements are reported as they are read (only once, not on every
+    iteration of --inf).
+    """
+    reported = False
+
+    def read() -> typing.Generator[dict, None, None]:
+        nonlocal reported
+        report = not reported
+        for value in data_input.Reader.stream(args.connection_string):
+            if value.get('valid'):
+                yield value
+            elif report:
+                print('Skipped invalid value: ', end='')
+                print_invalid(value)
+        reported = True
+
+    return read
+
+
+def poll_watcher(watcher: data_input.SourceWatcher) -> \
+        data_input.Delta | None:
+    """Applies changes of watched input. Reports invalid rows and errors."""
+    try:
+        delta = watcher.poll()
+    except data_input.InputReadError as exc:
+        print(f'Input is not reloaded: {exc}', file=sys.stderr)
+        return None
+    if delta is None:
+        return None
+    for value in delta.invalid:
+        print('Skipped invalid value: ', end='')
+        print_invalid(value)
+    print(f'Input reloaded: {len(delta.added)} added, '
+          f'{len(delta.removed)} removed, {len(delta.modified)} modified.',
+          file=sys.stderr)
+    return delta
+
+
+def watched_targets(watcher: data_input.SourceWatcher) -> list[dict]:
+    """Returns valid hosts of watched input, applying its changes first."""
+    poll_watcher(watcher)
+    return list(watcher.targets.values())
+
+
+def make_engine(args: argparse.Namespace) -> engine.Engine:
+    """Creates check engine configured by command line arguments."""
+    return engine.Engine(
+        concurrency=int(args.concurrency),
+        per_ip_limit=int(args.per_ip_limit),
+        host_resolver=resolver.Resolver(ttl=int(args.dns_ttl)),
+        combined=args.combined,
+        http=args.http,
+        cert_cache=certcache.CertCache(revalidate=int(args.cert_revalidate)),
+        first_success=args.first_success,
+        scanner=synscan.SynScanner() if args.syn_scan else None,
+        http_pool=httppool.HttpPool(
+            expect_status={int(code) for code in args.http_status.split(',')}
+            if args.http_status else None,
+            expect_body=args.http_body.encode()
+        ) if args.http_keepalive else None,
+        circuit_breaker=breaker.CircuitBreaker(
+            threshold=int(args.breaker_threshold)
+        ) if int(args.breaker_threshold) else None,
+        dedupe=args.dedupe
+    )
+
+
+async def run_workers(args: argparse.Namespace, valid: list[dict],
+                      output: Output):
+    """Same as `run`, but hosts are checked by `--workers` processes."""
+    metrics_server = await metrics.serve(port=int(args.metrics_port)) \
+        if args.metrics_port else None
+    with workers.WorkerPool(valid, int(args.workers),
+                            functools.partial(make_engine, args)) as pool:
+        while True:
+            start = time.perf_counter_ns()
+            output.start_iteration(args.infinite)
+            async for result in pool.sweep():
+                await output.add_async(result)
+            metrics.sweep(time.perf_counter_ns() - start)
+            output.finish_iteration()
+            if not args.infinite:
+                break
+            await asyncio.sleep(int(args.period))
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+async def run_coordinator(args: argparse.Namespace, valid: list[dict],
+                          output: Output):
+    """Same as `run`, but hosts are checked by agents (see `cluster`)."""
+    host, port = cluster.parse_address(args.coordinator)
+    metrics_server = await metrics.serve(port=int(args.metrics_port)) \
+        if args.metrics_port else None
+    async with cluster.Coordinator(
+            valid, host, port, shards=int(args.shards),
+            lease_timeout=float(args.lease_timeout),
+            token=args.cluster_token) as coordinator:
+        while True:
+            start = time.perf_counter_ns()
+            output.start_iteration(args.infinite)
+            async for result in coordinator.sweep():
+                await output.add_async(result)
+            metrics.sweep(time.perf_counter_ns() - start)
+            output.finish_iteration()
+            if not args.infinite:
+                break
+            await asyncio.sleep(int(args.period))
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+async def run(args: argparse.Namespace,
+              targets: typing.Callable[[], typing.Iterable[dict]],
+              check_engine: engine.Engine, output: Output):
+    """Check loop. Runs sweeps of all valid hosts and writes results.
+
+    `targets` is called on every iteration and returns valid hosts.
+    """
+    metrics_server = await metrics.serve(port=int(args.metrics_port)) \
+        if args.metrics_port else None
+    try:
+        while True:
+            start = time.perf_counter_ns()
+            output.start_iteration(args.infinite)
+            async for result in check_engine.sweep(targets()):
+                await output.add_async(result)
+            metrics.sweep(time.perf_counter_ns() - start)
+            output.finish_iteration()
+            if not args.infinite:
+                break
+            await asyncio.sleep(int(args.period))
+    finally:
+        check_engine.close()
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+async def run_scheduled(args: argparse.Namespace,
+                        targets: typing.Callable[[], typing.Iterable[dict]],
+                        check_engine: engine.Engine, output: Output,
+                        watcher: data_input.SourceWatcher | None = None):
+    """Checks every host by its own adaptive schedule forever.
+
+    Results are written as soon as they are ready. Every --period seconds
+    new iteration of output is started. If `watcher` is provided, changes of
+    input are applied to schedule every --watch_interval seconds: state of
+    unchanged hosts is kept.
+    """
+    if args.metrics_port:
+        await metrics.serve(port=int(args.metrics_port))
+    schedule = scheduler.Scheduler(int(args.period))
+    for target in targets():
+        schedule.add(target)
+
+    async def rounds():
+        while True:
+            await asyncio.sleep(int(args.period))
+            output.finish_iteration()
+            output.start_iteration(True)
+
+    async def watch():
+        while True:
+            await asyncio.sleep(float(args.watch_interval))
+            delta = poll_watcher(watcher)
+            if delta is None:
+                continue
+            for key in delta.removed:
+                schedule.remove(key)
+            for target in delta.added + delta.modified:
+                schedule.add(target)
+
+    output.start_iteration(True)
+    tasks = [asyncio.ensure_future(rounds())]
+    if watcher is not None:
+        tasks.append(asyncio.ensure_future(watch()))
+    try:
+        await schedule.run(check_engine, output.add_async)
+    finally:
+        for task in tasks:
+            task.cancel()
+        check_engine.close()
 
 
 if __name__ == '__main__':
@@ -82,6 +378,24 @@ if __name__ == '__main__':
              '\n E.G csv:input.csv or json:files/inp.json '
              '(DEFAULT: csv:input.csv)'
     )
+    arg_parser.add_argument(
+        '--out',
+        dest='outputs',
+        action='append',
+        help='Output string. looks like "con_type:path". May be repeated to '
+             'write to several outputs. Default: stdout.'
+             '\nCurrently available protocols are: ' +
+             ', '.join(data_output.Writer.get_all_protocols()) +
+             '.'
+    )
+    arg_parser.add_argument(
+        '--format',
+        dest='format',
+        default='text',
+        choices=data_output.Serializer.get_all_formats(),
+        help='Output format. Machine-readable formats have time in epoch '
+             'nanoseconds. unix outputs use ndjson instead of text.'
+    )
     arg_parser.add_argument(
         '--inf',
         dest='infinite',
@@ -102,6 +416,250 @@ if __name__ == '__main__':
         help='Skip invalid input. If provided, invalid values in input'
              ' will be ignored'
     )
+    arg_parser.add_argument(
+        '--concurrency',
+        dest='concurrency',
+        default=500,
+        action='store',
+        help='Maximum number of probes running at the same time.'
+    )
+    arg_parser.add_argument(
+        '--per_ip_limit',
+        dest='per_ip_limit',
+        default=10,
+        action='store',
+        help='Maximum number of probes running at the same time to one ip.'
+    )
+    arg_parser.add_argument(
+        '--dns_ttl',
+        dest='dns_ttl',
+        default=300,
+        action='store',
+        help='Max time in seconds to keep resolved hostnames in cache.'
+    )
+    arg_parser.add_argument(
+        '--combined',
+        dest='combined',
+        action='store_true',
+        help='Check port, certificate and HTTP (with --http) in one connection.'
+    )
+    arg_parser.add_argument(
+        '--http',
+        dest='http',
+        action='store_true',
+        help='Port is considered opened only if it responds to HTTP request.'
+    )
+    arg_parser.add_argument(
+        '--http_keepalive',
+        dest='http_keepalive',
+        action='store_true',
+        help='With --http (without --combined): send HTTP/1.1 requests '
+             'through kept-alive connections, so RTT of next checks is '
+             'server response time without handshake.'
+    )
+    arg_parser.add_argument(
+        '--http_status',
+        dest='http_status',
+        default=None,
+        action='store',
+        help='With --http_keepalive: comma separated allowed status codes. '
+             'By default any response means port is opened.'
+    )
+    arg_parser.add_argument(
+        '--http_body',
+        dest='http_body',
+        default='',
+        action='store',
+        help='With --http_keepalive: required prefix of response body.'
+    )
+    arg_parser.add_argument(
+        '--breaker_threshold',
+        dest='breaker_threshold',
+        default=0,
+        action='store',
+        help='Failures in a row after which port is considered down: it is '
+             'rechecked rarely (with growing backoff) and with short '
+             'timeout. Also timeouts of alive ports are based on their RTT. '
+             '0 - disabled.'
+    )
+    arg_parser.add_argument(
+        '--dedupe',
+        dest='dedupe',
+        action='store_true',
+        help='Resolve all hosts before checks and probe every ip/port once, '
+             'even if many hosts need it (results are copied to every '
+             'host). Input is read completely.'
+    )
+    arg_parser.add_argument(
+        '--first_success',
+        dest='first_success',
+        action='store_true',
+        help='Check every port once per host: addresses are tried one by one '
+             'with small delay (IPv6 and IPv4 in turn) and the first '
+             'reachable is reported. Ignored with --combined and --http.'
+    )
+    arg_parser.add_argument(
+        '--syn_scan',
+        dest='syn_scan',
+        action='store_true',
+        help='Check ports by SYN packets from one raw socket instead of full '
+             'connect (needs root or CAP_NET_RAW, IPv4 only).'
+    )
+    arg_parser.add_argument(
+        '--cert_revalidate',
+        dest='cert_revalidate',
+        default=3600,
+        action='store',
+        help='Period of full certificate verification in seconds. Between '
+             'full checks certificate is only compared with verified one.'
+    )
+    arg_parser.add_argument(
+        '--workers',
+        dest='workers',
+        default=1,
+        action='store',
+        help='Number of processes to check hosts. Hosts are split between '
+             'processes by hash of hostname.'
+    )
+    arg_parser.add_argument(
+        '--coordinator',
+        dest='coordinator',
+        default=None,
+        action='store',
+        help='Listen on [HOST:]PORT (HOST is 127.0.0.1 by default) for '
+             'agents (started with --agent) and let them check hosts. Hosts '
+             'are split into --shards by hash of hostname, shards are leased '
+             'to agents, results are written by coordinator.'
+    )
+    arg_parser.add_argument(
+        '--agent',
+        dest='agent',
+        default=None,
+        action='store',
+        help='Check hosts leased by coordinator at HOST:PORT and send '
+             'results to it. Input and output options are ignored, check '
+             'options (--concurrency, --http, ...) are used.'
+    )
+    arg_parser.add_argument(
+        '--shards',
+        dest='shards',
+        default=16,
+        action='store',
+        help='Number of shards of --coordinator. Should be more than number '
+             'of agents, so load is spread evenly.'
+    )
+    arg_parser.add_argument(
+        '--lease_timeout',
+        dest='lease_timeout',
+        default=10,
+        action='store',
+        help='Seconds without messages from agent after which its shards '
+             'are leased to other agents.'
+    )
+    arg_parser.add_argument(
+        '--cluster_token',
+        dest='cluster_token',
+        default=os.environ.get('AVASITE_CLUSTER_TOKEN'),
+        action='store',
+        help='Shared token of --coordinator and its agents, agents with '
+             'other token are rejected. Use it when coordinator listens '
+             'on non-loopback address. Default: AVASITE_CLUSTER_TOKEN '
+             'environment variable (it isn\'t seen in process list).'
+    )
+    arg_parser.add_argument(
+        '--stream',
+        dest='stream',
+        action='store_true',
+        help='Read input lazily on every iteration instead of keeping it in '
+             'memory. Useful for huge inputs.'
+    )
+    arg_parser.add_argument(
+        '--watch',
+        dest='watch',
+        action='store_true',
+        help='Reload input when its file is changed: with --schedule every '
+             '--watch_interval seconds, with --inf before every iteration. '
+             'Only changed rows are validated, state of unchanged hosts is '
+             'kept. Input is kept in memory (--stream is ignored). sqlite '
+             'input gets change tracking installed (triggers and tables, '
+             'see README), without --watch it is only read.'
+    )
+    arg_parser.add_argument(
+        '--watch_interval',
+        dest='watch_interval',
+        default=1,
+        action='store',
+        help='Seconds between checks of input file for --watch --schedule.'
+    )
+    arg_parser.add_argument(
+        '--store',
+        dest='store',
+        default=None,
+        action='store',
+        help='Path of binary file to save results history in.'
+    )
+    arg_parser.add_argument(
+        '--changes_only',
+        dest='changes_only',
+        action='store_true',
+        help='Write only results, which changed since last iteration '
+             '(status, certificate validity or RTT out of --rtt_band).'
+    )
+    arg_parser.add_argument(
+        '--rtt_band',
+        dest='rtt_band',
+        default=0.5,
+        action='store',
+        help='Allowed relative RTT change for --changes_only. E.g. 0.5 means '
+             '50%% of last written RTT.'
+    )
+    arg_parser.add_argument(
+        '--snapshot_every',
+        dest='snapshot_every',
+        default=0,
+        action='store',
+        help='Write all results every N iterations in --changes_only mode. '
+             '0 - only first iteration.'
+    )
+    arg_parser.add_argument(
+        '--aggregate',
+        dest='aggregate',
+        default=None,
+        action='store',
+        help='File to write uptime and RTT percentiles (p50, p95, p99) of '
+             'every host/ip/port to after every iteration (json lines). '
+             'Mergeable state is written to FILE.state.'
+    )
+    arg_parser.add_argument(
+        '--windows',
+        dest='windows',
+        default='300,3600',
+        action='store',
+        help='Comma separated windows of --aggregate in seconds.'
+    )
+    arg_parser.add_argument(
+        '--schedule',
+        dest='schedule',
+        action='store_true',
+        help='Check every host by its own schedule (interval from input or '
+             '--period). Failed hosts are checked more often, stable ones - '
+             'less often. Runs infinitely.'
+    )
+    arg_parser.add_argument(
+        '--metrics_file',
+        dest='metrics_file',
+        default=None,
+        action='store',
+        help='File to write checker metrics (Prometheus text format) to '
+             'after every iteration.'
+    )
+    arg_parser.add_argument(
+        '--metrics_port',
+        dest='metrics_port',
+        default=None,
+        action='store',
+        help='Serve checker metrics on http://127.0.0.1:PORT/metrics.'
+    )
     parsed_args = arg_parser.parse_args()
     try:
         if int(parsed_args.period) <= 0:
@@ -109,6 +667,21 @@ if __name__ == '__main__':
     except ValueError:
         print('Provided `--period` parameter is not valid. please pass valid'
               'positive integer value')
+    if parsed_args.schedule and int(parsed_args.workers) > 1:
+        print('--schedule can\'t be used with --workers.')
+        sys.exit(1)
+    if parsed_args.watch and int(parsed_args.workers) > 1:
+        print('--watch can\'t be used with --workers.')
+        sys.exit(1)
+    if parsed_args.coordinator and (parsed_args.schedule or
+                                    parsed_args.watch or
+                                    int(parsed_args.workers) > 1):
+        print('--coordinator can\'t be used with --schedule, --watch and '
+              '--workers.')
+        sys.exit(1)
+    if parsed_args.syn_scan and not synscan.SynScanner.available():
+        print('Raw sockets are not permitted, --syn_scan is ignored.')
+        parsed_args.syn_scan = False
     try:
         main(parsed_args)
     except KeyboardInterrupt:
@@ -0,0 +1,329 @@
+"""Benchmark of check engine on local fake targets.
+
+Starts fake servers on loopback and checks them by `engine.Engine`:
+    accept          - accepts connection and closes it
+    http            - minimal HTTP responder
+    delay           - HTTP responder, which answers after `--delay` seconds
+    drop            - accepts connection and never answers
+    refuse          - nobody listens, connection is refused
+    tls-valid       - TLS server with certificate signed by bench CA
+    tls-self-signed - TLS server with self-signed certificate
+    tls-expired     - TLS server with expired certificate
+    tls-wrong-host  - TLS server with certificate for another hostname
+
+TLS servers listen on 127.0.0.10-13:8443 (8443 is in `network.TLS_PORTS`, so
+certificates are checked with --combined). Certificates are made by `openssl`
+command. If it's not available, TLS targets are skipped.
+
+For every number of targets one JSON line is written (to stdout and to --out
+file), so results of different runs may be compared:
+    python bench.py --sizes 100,1000,10000 --out bench_output.txt
+With `--rounds N` targets are checked N times by the same engine, so later
+rounds show checks with warm caches (e.g. verified certificates).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import engine
+import network
+import resolver
+import synscan
+
+TLS_PORT = 8443
+TLS_KINDS = {
+    'tls-valid': '127.0.0.10',
+    'tls-self-signed': '127.0.0.11',
+    'tls-expired': '127.0.0.12',
+    'tls-wrong-host': '127.0.0.13',
+}
+PLAIN_KINDS = ('accept', 'http', 'delay', 'drop', 'refuse')
+# Validity of bench certificates. Longer than `CertCache.expiry_margin`, so
+# valid certificates are taken from cache instead of being rechecked.
+CERT_DAYS = '30'
+
+_CA_CONFIG = '''[ca]
+default_ca = bench
+[bench]
+database = index.txt
+new_certs_dir = .
+serial = serial
+default_md = sha256
+policy = any
+copy_extensions = copy
+[any]
+commonName = supplied
+'''
+
+
+def _openssl(*args: str, cwd: str):
+    subprocess.run(['openssl', *args], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_certificates(directory: str) -> dict[str, tuple[str, str]] | None:
+    """Makes bench CA and certificates of TLS servers.
+
+    Returns:
+        dict: kind -> (certificate path, key path). `ca` kind is bench CA.
+          None if `openssl` is not available.
+    """
+    if shutil.which('openssl') is None:
+        return None
+    with open(os.path.join(directory, 'ca.cnf'), 'w') as file:
+        file.write(_CA_CONFIG)
+    open(os.path.join(directory, 'index.txt'), 'w').close()
+    with open(os.path.join(directory, 'serial'), 'w') as file:
+        file.write('01\n')
+    _openssl('req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-days', CERT_DAYS, '-keyout', 'ca.key', '-out', 'ca.pem',
+             '-subj', '/CN=bench CA', cwd=directory)
+    res = {'ca': (os.path.join(directory, 'ca.pem'),
+                  os.path.join(directory, 'ca.key'))}
+    for kind, ip in TLS_KINDS.items():
+        name = 'wrong.example' if kind == 'tls-wrong-host' else ip
+        san = f'DNS:{name}' if kind == 'tls-wrong-host' else f'IP:{name}'
+        key, cert = f'{kind}.key', f'{kind}.pem'
+        if kind == 'tls-self-signed':
+            _openssl('req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                     '-days', CERT_DAYS, '-keyout', key, '-out', cert,
+                     '-subj', f'/CN={name}', '-addext',
+                     f'subjectAltName={san}', cwd=directory)
+        else:
+            _openssl('req', '-new', '-newkey', 'rsa:2048', '-nodes',
+                     '-keyout', key, '-out', f'{kind}.csr',
+                     '-subj', f'/CN={name}', '-addext',
+                     f'subjectAltName={san}', cwd=directory)
+            dates = ['-startdate', '20200101000000Z',
+                     '-enddate', '20200102000000Z'] \
+                if kind == 'tls-expired' else ['-days', CERT_DAYS]
+            _openssl('ca', '-batch', '-config', 'ca.cnf', '-cert', 'ca.pem',
+                     '-keyfile', 'ca.key', '-in', f'{kind}.csr',
+                     '-out', cert, *dates, cwd=directory)
+        res[kind] = (os.path.join(directory, cert),
+                     os.path.join(directory, key))
+    return res
+
+
+class FakeFarm:
+    """Fake target servers on loopback.
+
+    Args:
+        delay (float): answer delay of `delay` servers in seconds.
+        tls (bool): start TLS servers (if certificates can be made).
+
+    """
+
+    def __init__(self, delay: float = 0.05, tls: bool = True):
+        self.delay = delay
+        self.tls = tls
+        self.addresses: dict[str, tuple[str, int]] = {}
+        self._servers: list[asyncio.AbstractServer] = []
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._directory = tempfile.TemporaryDirectory()
+
+    async def _handle(self, kind: str, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            if kind == 'drop':
+                await reader.read()  # Until client closes connection.
+                return
+            if kind != 'accept':
+                await reader.readuntil(b'\r\n\r\n')
+                if kind == 'delay':
+                    await asyncio.sleep(self.delay)
+                writer.write(b'HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+        except (OSError, ssl.SSLError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _serve(self, kind: str, host: str, port: int = 0,
+                     ssl_context: ssl.SSLContext | None = None):
+        server = await asyncio.start_server(
+            lambda reader, writer: self._handle(kind, reader, writer),
+            host, port, ssl=ssl_context, backlog=4096, reuse_address=True
+        )
+        self._servers.append(server)
+        self.addresses[kind] = server.sockets[0].getsockname()[:2]
+
+    async def start(self):
+        """Starts all servers."""
+        for kind in PLAIN_KINDS:
+            if kind == 'refuse':
+                # Take free port and close it: connections will be refused.
+                with socket.socket() as sock:
+                    sock.bind(('127.0.0.1', 0))
+                    self.addresses[kind] = sock.getsockname()[:2]
+                continue
+            await self._serve(kind, '127.0.0.1')
+        if not self.tls:
+            return
+        certificates = make_certificates(self._directory.name)
+        if certificates is None:
+            return
+        # Trust bench CA, so `tls-valid` certificate is valid for checks.
+        network.context.load_verify_locations(certificates['ca'][0])
+        for kind, ip in TLS_KINDS.items():
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(*certificates[kind])
+            try:
+                await self._serve(kind, ip, TLS_PORT, ssl_context)
+            except OSError:
+                pass  # No such loopback address or port is busy.
+
+    async def stop(self):
+        """Stops all servers."""
+        for server in self._servers:
+            server.close()
+        for writer in list(self._connections):
+            writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._directory.cleanup()
+
+    def targets(self, count: int) -> list[dict]:
+        """Returns `count` targets, evenly split between servers."""
+        kinds = list(self.addresses)
+        res = []
+        for idx in range(count):
+            host, port = self.addresses[kinds[idx % len(kinds)]]
+            res.append({'host': host, 'ports': [port], 'idx': idx})
+        return res
+
+
+async def measure(check_engine: engine.Engine, targets: list[dict]) -> dict:
+    """Checks all targets and returns measurements."""
+    peak_fds = 0
+    latencies = []
+
+    async def watch_fds():
+        nonlocal peak_fds
+        while True:
+            peak_fds = max(peak_fds, len(os.listdir('/proc/self/fd')))
+            await asyncio.sleep(0.01)
+
+    async def check(target: dict):
+        start = time.perf_counter()
+        async for _ in check_engine.check(**target):
+            pass
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    watcher = asyncio.ensure_future(watch_fds()) \
+        if os.path.isdir('/proc/self/fd') else None
+    start = time.perf_counter()
+    await asyncio.gather(*(check(target) for target in targets))
+    duration = time.perf_counter() - start
+    if watcher is not None:
+        watcher.cancel()
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') \
+        if len(latencies) > 1 else latencies * 99
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'targets': len(targets),
+        'duration_s': round(duration, 4),
+        'targets_per_second': round(len(targets) / duration, 2),
+        'latency_ms': {
+            'p50': round(percentiles[49], 3),
+            'p99': round(percentiles[98], 3),
+            'max': round(max(latencies), 3),
+        },
+        'peak_rss_bytes': rss if sys.platform == 'darwin' else rss * 1024,
+        'peak_open_fds': peak_fds or None,
+    }
+
+
+async def run(args: argparse.Namespace):
+    farm = FakeFarm(delay=float(args.delay), tls=not args.no_tls)
+    await farm.start()
+    scanner = synscan.SynScanner() if args.syn_scan else None
+    try:
+        for size in map(int, args.sizes.split(',')):
+            check_engine = engine.Engine(
+                concurrency=int(args.concurrency),
+                per_ip_limit=int(args.concurrency),
+                timeout=float(args.timeout),
+                host_resolver=resolver.Resolver(),
+                combined=args.combined,
+                http=args.http,
+                scanner=scanner
+            )
+            for round_idx in range(1, int(args.rounds) + 1):
+                result = {
+                    'time': time.time(),
+                    'python': platform.python_version(),
+                    'mode': {
+                        'combined': args.combined,
+                        'http': args.http,
+                        'syn_scan': args.syn_scan,
+                        'concurrency': int(args.concurrency),
+                        'timeout': float(args.timeout),
+                    },
+                    'servers': sorted(farm.addresses),
+                    'round': round_idx,
+                    **await measure(check_engine, farm.targets(size)),
+                }
+                line = json.dumps(result)
+                print(line)
+                if args.out:
+                    with open(args.out, 'a') as file:
+                        file.write(line + '\n')
+    finally:
+        if scanner is not None:
+            scanner.close()
+        await farm.stop()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        prog='bench',
+        description='Benchmark of site availability checker'
+    )
+    arg_parser.add_argument('--sizes', dest='sizes', default='100,1000',
+                            help='Comma separated numbers of targets.')
+    arg_parser.add_argument('--concurrency', dest='concurrency', default=500,
+                            help='Engine concurrency limit.')
+    arg_parser.add_argument('--timeout', dest='timeout', default=2,
+                            help='Probe timeout in seconds.')
+    arg_parser.add_argument('--delay', dest='delay', default=0.05,
+                            help='Answer delay of `delay` servers.')
+    arg_parser.add_argument('--combined', dest='combined',
+                            action='store_true',
+                            help='Use combined probe (checks certificates).')
+    arg_parser.add_argument('--http', dest='http', action='store_true',
+                            help='Check HTTP liveness.')
+    arg_parser.add_argument('--syn_scan', dest='syn_scan',
+                            action='store_true',
+                            help='Check ports by SYN packets (needs root).')
+    arg_parser.add_argument('--no_tls', dest='no_tls', action='store_true',
+                            help='Don\'t start TLS servers.')
+    arg_parser.add_argument('--rounds', dest='rounds', default=1,
+                            help='Number of checks of every size by the '
+                                 'same engine.')
+    arg_parser.add_argument('--out', dest='out', default=None,
+                            help='File to append JSON results to.')
+    parsed_args = arg_parser.parse_args()
+    # Servers and probes are in the same process: allow more files.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    try:
+        asyncio.run(run(parsed_args))
+    except KeyboardInterrupt:
+        print('Benchmark stopped by user')
+        sys.exit(1)
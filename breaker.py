@@ -0,0 +1,103 @@
+"""Circuit breaker for dead targets.
+
+Dead target costs full timeout on every check of every its port, so few dead
+hosts may take most of sweep time. CircuitBreaker tracks failures of every
+(ip, port):
+    1) after `threshold` failures in a row circuit "opens": target isn't
+       probed for `backoff` seconds, which doubles after every failed
+       recheck (up to `max_backoff`). Results are still reported as closed
+       with `circuit` = 'open';
+    2) when backoff is over, target is rechecked with short
+       `recheck_timeout` (`circuit` = 'recheck'). Success closes circuit.
+
+Timeout of healthy targets is based on their own RTT history: p99 of last
+`history` RTTs multiplied by `rtt_factor`, but not less than `min_timeout`
+and not more than default timeout.
+"""
+import collections
+import math
+import time
+
+OPEN = 'open'
+RECHECK = 'recheck'
+
+
+class TargetState:
+    """Failures and RTT history of (ip, port)."""
+
+    def __init__(self, history: int):
+        self.failures = 0
+        self.open_until = 0.0  # time.monotonic() of next recheck.
+        self.rtts: collections.deque[float] = collections.deque(
+            maxlen=history
+        )
+
+
+class CircuitBreaker:
+    """Tracks failures and RTTs of targets.
+
+    Args:
+        threshold (int): failures in a row to open circuit.
+        backoff (float): seconds to skip target after circuit is opened.
+        max_backoff (float): max seconds to skip target.
+        recheck_timeout (float): timeout of probes of down target.
+        rtt_factor (float): timeout is p99 of RTT multiplied by this.
+        min_timeout (float): timeout never becomes less than this.
+        history (int): number of last RTTs to keep.
+        min_samples (int): RTTs needed to use RTT based timeout.
+
+    """
+
+    def __init__(self, threshold: int = 3, backoff: float = 30,
+                 max_backoff: float = 900, recheck_timeout: float = 2,
+                 rtt_factor: float = 4, min_timeout: float = 1,
+                 history: int = 100, min_samples: int = 10):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.recheck_timeout = recheck_timeout
+        self.rtt_factor = rtt_factor
+        self.min_timeout = min_timeout
+        self.history = history
+        self.min_samples = min_samples
+        self._states: dict[tuple, TargetState] = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def state(self, key: tuple) -> str | None:
+        """Returns OPEN (don't probe), RECHECK (probe shortly) or None."""
+        state = self._states.get(key)
+        if state is None or state.failures < self.threshold:
+            return None
+        return OPEN if time.monotonic() < state.open_until else RECHECK
+
+    def timeout(self, key: tuple, default: float) -> float:
+        """Returns timeout for next probe of target."""
+        state = self._states.get(key)
+        if state is None:
+            return default
+        if state.failures >= self.threshold:
+            return min(self.recheck_timeout, default)
+        if len(state.rtts) < self.min_samples:
+            return default
+        rtts = sorted(state.rtts)
+        p99 = rtts[min(math.ceil(len(rtts) * 0.99), len(rtts)) - 1]
+        return max(min(p99 / 1000 * self.rtt_factor, default),
+                   self.min_timeout)
+
+    def record(self, key: tuple, ok: bool, rtt: float = 0):
+        """Remembers probe result (RTT in ms)."""
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = TargetState(self.history)
+        if ok:
+            state.failures = 0
+            state.rtts.append(rtt)
+            return
+        state.failures += 1
+        if state.failures >= self.threshold:
+            backoff = self.backoff * 2 ** min(state.failures - self.threshold,
+                                              32)
+            state.open_until = time.monotonic() + min(backoff,
+                                                      self.max_backoff)
@@ -0,0 +1,130 @@
+"""TLS certificates cache.
+
+Certificates change few times a year, but full TLS handshake with chain
+verification is made on every check. CertCache keeps verified certificates
+and between full checks only confirms that server still has the same
+certificate (by comparing fingerprints after cheap handshake without
+verification).
+"""
+import asyncio
+import collections
+import hashlib
+import socket
+import ssl
+import time
+import typing
+
+import network
+
+
+class CertEntry(typing.TypedDict):
+    """Cached result of full certificate check."""
+    fingerprint: bytes
+    not_after: float  # epoch seconds.
+    verified: tuple[bool, str]
+    checked_at: float  # time.monotonic() of full check.
+
+
+class CertCache:
+    """Cache of verified certificates keyed by (host, port, ip).
+
+    Full check is repeated if:
+        1) `revalidate` seconds passed since last full check;
+        2) certificate expires in less than `expiry_margin` seconds
+           (so expiration is noticed in time);
+        3) server presented another certificate.
+
+    Only valid certificates are cached. Invalid ones are checked fully every
+    time, so they become valid as soon as they are fixed.
+
+    """
+
+    def __init__(self, revalidate: float = 3600,
+                 expiry_margin: float = 7 * 24 * 3600,
+                 max_entries: int = 10000):
+        self.revalidate = revalidate
+        self.expiry_margin = expiry_margin
+        self.max_entries = max_entries
+        self._cache: collections.OrderedDict[tuple, CertEntry] = \
+            collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def fingerprint(der: bytes) -> bytes:
+        """Returns fingerprint of certificate in DER form."""
+        return hashlib.sha256(der).digest()
+
+    def lookup(self, host: str, port: int,
+               ip_address: str) -> CertEntry | None:
+        """Returns entry if it doesn't need full check yet, otherwise None."""
+        key = (host, port, ip_address)
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if (time.monotonic() - entry['checked_at'] > self.revalidate or
+                entry['not_after'] - time.time() < self.expiry_margin):
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def confirm(self, host: str, port: int, ip_address: str,
+                der: bytes) -> tuple[bool, str] | None:
+        """Returns cached check result if `der` is the cached certificate.
+
+        Returns None if full check is needed.
+        """
+        entry = self.lookup(host, port, ip_address)
+        if entry is None or entry['fingerprint'] != self.fingerprint(der):
+            return None
+        return entry['verified']
+
+    def store(self, host: str, port: int, ip_address: str, der: bytes,
+              peer_cert: dict):
+        """Stores certificate which passed full check."""
+        key = (host, port, ip_address)
+        self._cache[key] = {
+            'fingerprint': self.fingerprint(der),
+            'not_after': ssl.cert_time_to_seconds(peer_cert['notAfter']),
+            'verified': (True, network.VALID_CERT_STRING),
+            'checked_at': time.monotonic()
+        }
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def check(self, host: str, port: int, ip_address: str,
+                    timeout: float = 15) -> tuple[bool, str]:
+        """Async `network.check_ssl_certificate` with cache.
+
+        Unlike `network.check_ssl_certificate`, any port is checked.
+
+        Args:
+            host (str): hostname, which certificate must be valid for.
+            port (int): port to check.
+            ip_address (str): resolved ip address of `host` to connect to.
+            timeout (float): seconds to wait for connection and handshake.
+
+        Returns:
+            tuple: first argument - is certificate is valid, second - message
+        """
+        try:
+            if self.lookup(host, port, ip_address) is not None:
+                der, _ = await network.async_get_certificate(
+                    host, ip_address, port, verify=False, timeout=timeout
+                )
+                if verified := self.confirm(host, port, ip_address, der):
+                    return verified
+            der, peer_cert = await network.async_get_certificate(
+                host, ip_address, port, timeout=timeout
+            )
+        except ssl.SSLCertVerificationError as exc:
+            return False, exc.verify_message or network.INVALID_CERT_STRING
+        except socket.gaierror:
+            return False, 'cert INVALID, unable connect to server'
+        except (asyncio.TimeoutError, ssl.SSLError, OSError):
+            return False, network.INVALID_CERT_STRING
+        self.store(host, port, ip_address, der, peer_cert)
+        return True, network.VALID_CERT_STRING
@@ -0,0 +1,62 @@
+"""Change-only output for infinite runs.
+
+In --inf mode every target is printed every period, even if nothing changed.
+ChangeTracker remembers last reported state of every (host, ip, port) and
+lets through only results which differ from it:
+    1) status changed (opened/closed/pingable);
+    2) certificate validity changed;
+    3) RTT moved out of band around last reported RTT.
+Every `snapshot_every` iterations all results are let through.
+"""
+import network
+
+
+class ChangeTracker:
+    """Remembers last reported state of targets.
+
+    Args:
+        rtt_band (float): allowed relative RTT change. E.g. 0.5 means result
+          is reported if RTT is less than 50% or more than 150% of last
+          reported RTT.
+        snapshot_every (int): report all results every N iterations.
+          0 - only first iteration is reported fully.
+
+    """
+
+    def __init__(self, rtt_band: float = 0.5, snapshot_every: int = 0):
+        self.rtt_band = rtt_band
+        self.snapshot_every = snapshot_every
+        self.iteration = -1
+        # (host, ip, port) -> (status, certificate validity, rtt)
+        self._state: dict[tuple, tuple[int | None, bool | None, float]] = {}
+
+    @property
+    def snapshot(self) -> bool:
+        """Is current iteration reported fully."""
+        if self.iteration <= 0:
+            return True
+        return bool(self.snapshot_every and
+                    not self.iteration % self.snapshot_every)
+
+    def start_iteration(self):
+        """Must be called before results of every iteration."""
+        self.iteration += 1
+
+    def changed(self, result: network.CheckResult) -> bool:
+        """Remembers state of result. Returns True if it must be reported."""
+        result = network.Result.from_dict(result)
+        key = (result.host, result.ip, result.port)
+        rtt = result.rtt or 0
+        state = (result.status, None if result.cert is None else
+                 result.cert == network.CERT_VALID, rtt)
+        last = self._state.get(key)
+        if last is not None and not self.snapshot and \
+                last[:2] == state[:2] and self._rtt_in_band(last[2], rtt):
+            return False
+        self._state[key] = state
+        return True
+
+    def _rtt_in_band(self, last: float, rtt: float) -> bool:
+        if not last:
+            return not rtt
+        return abs(rtt - last) <= last * self.rtt_band
@@ -0,0 +1,468 @@
+"""Distributed checks: coordinator and agents on several machines.
+
+Coordinator keeps validated targets and splits them into `shards` by hash of
+host (like `workers`). Agents connect to it by TCP and get shards leased;
+every iteration coordinator asks agents to check their shards, and agents
+stream results back, so all results are written in one place.
+
+Protocol is JSON lines. Agent -> coordinator:
+    {"type": "hello", "agent": name, "token": token}
+        coordinator with token rejects agents with other one.
+    {"type": "heartbeat"}
+    {"type": "results", "iteration": n, "shard": id, "results": [...],
+     "metrics": {...}}
+        results are `network.Result.to_tuple` values, metrics are
+        `metrics.take` values (collected since previous message).
+    {"type": "done", "iteration": n, "shard": id, "metrics": {...}}
+Coordinator -> agent:
+    {"type": "lease", "shard": id, "targets": [...]}
+    {"type": "revoke", "shards": [id, ...]}
+    {"type": "sweep", "iteration": n, "shards": [id, ...], "metrics": bool}
+        metrics - should agent collect metrics.
+    {"type": "error", "message": text}
+        agent is rejected, connection is closed.
+
+Agent which sent nothing for `lease_timeout` seconds (heartbeats are sent
+every `heartbeat` seconds) is dropped and its shards are leased to other
+agents; unfinished shards of current iteration are checked by new owners
+(so some of their results may be written twice). Shards stay with their
+agents between iterations (DNS and TLS caches stay warm), only when agents
+join or leave shards are moved to even the load.
+
+Agents get whole inventory of targets and their results are trusted, so
+coordinator listens on loopback by default. When it listens on other
+addresses, it should be given a shared token (connection isn't encrypted, so
+it's meant for trusted networks).
+
+Try with several agents on localhost:
+    python avasite.py --coordinator 127.0.0.1:7300 --inf --period 10
+    python avasite.py --agent 127.0.0.1:7300  # As many as needed.
+"""
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import sys
+import time
+import typing
+
+import metrics
+import network
+import workers
+
+# Max length of one message line.
+LINE_LIMIT = 2 ** 26
+
+
+def parse_address(address: str, default_host: str = '127.0.0.1') -> \
+        tuple[str, int]:
+    """Parses `host:port` (or `port`)."""
+    host, _, port = address.rpartition(':')
+    return host.strip('[]') or default_host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    """Checks if `host` is loopback address (or localhost)."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+class AgentConnection:
+    """Agent connected to coordinator."""
+
+    def __init__(self, name: str, writer: asyncio.StreamWriter):
+        self.name = name
+        self.writer = writer
+        self.shards: set[int] = set()
+        self.last_seen = time.monotonic()
+        # Reader waits for results queue, so silence isn't agent's fault.
+        self.blocked = False
+        self.alive = True
+
+    def send(self, message: dict):
+        if self.alive and not self.writer.is_closing():
+            self.writer.write(_encode(message))
+
+    def close(self):
+        self.alive = False
+        self.writer.close()
+
+
+class Coordinator:
+    """Leases shards of targets to agents and collects their results.
+
+    Args:
+        targets: valid host settings, same as accepted by `network.check`.
+        host (str): address to listen on.
+        port (int): port to listen on.
+        shards (int): number of shards. More shards than agents let load be
+          spread evenly.
+        lease_timeout (float): seconds of agent silence before its shards
+          are leased to other agents.
+        max_queue (int): max received messages waiting to be handled.
+          Agents are not read while queue is full.
+        token (str | None): shared token agents must send in `hello`.
+          None - any agent is accepted.
+
+    Usage:
+        async with Coordinator(targets, '127.0.0.1', 7300) as coordinator:
+            async for result in coordinator.sweep():
+                ...
+
+    """
+
+    def __init__(self, targets: typing.Iterable[dict],
+                 host: str = '127.0.0.1', port: int = 7300, shards: int = 16,
+                 lease_timeout: float = 10, max_queue: int = 1000,
+                 token: str | None = None):
+        self.shards = {shard_id: shard for shard_id, shard in
+                       enumerate(workers.split(targets, shards)) if shard}
+        self.host = host
+        self.port = port
+        self.lease_timeout = lease_timeout
+        self.max_queue = max_queue
+        self.token = token
+        self.iteration = 0
+        self.agents: list[AgentConnection] = []
+        self._owners: dict[int, AgentConnection] = {}
+        self._events: asyncio.Queue | None = None
+        self._joined: asyncio.Event | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._handlers: set[asyncio.Task] = set()
+
+    async def start(self):
+        if self.token is None and not is_loopback(self.host):
+            print(f'Coordinator listens on {self.host} without token, any '
+                  f'peer may get targets and send results.', file=sys.stderr)
+        self._events = asyncio.Queue(self.max_queue)
+        self._joined = asyncio.Event()
+        self._server = await asyncio.start_server(
+            self._serve, self.host, self.port, limit=LINE_LIMIT
+        )
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for agent in self.agents:
+            agent.close()
+        self.agents.clear()
+        # Closed connections are read till end, so handlers finish.
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    async def _serve(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        agent = None
+        self._handlers.add(asyncio.current_task())
+        try:
+            hello = json.loads(await reader.readline() or 'null')
+            if not isinstance(hello, dict) or hello.get('type') != 'hello':
+                return
+            if self.token is not None and not hmac.compare_digest(
+                    str(hello.get('token')).encode(), self.token.encode()):
+                peer = writer.get_extra_info('peername')
+                print(f'Agent {hello.get("agent")} ({peer}) rejected: wrong '
+                      f'token.', file=sys.stderr)
+                writer.write(_encode({'type': 'error',
+                                      'message': 'wrong token'}))
+                return
+            agent = AgentConnection(str(hello.get('agent')), writer)
+            self.agents.append(agent)
+            print(f'Agent {agent.name} joined.', file=sys.stderr)
+            self._joined.set()
+            while agent.alive and (line := await reader.readline()):
+                agent.last_seen = time.monotonic()
+                message = json.loads(line)
+                if message.get('type') in ('results', 'done'):
+                    # Probes were made even if results are late.
+                    metrics.merge(message.get('metrics') or {})
+                    agent.blocked = True
+                    await self._events.put((agent, message))
+                    agent.blocked = False
+                    agent.last_seen = time.monotonic()
+        except (OSError, ValueError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+        finally:
+            if agent is not None and agent.alive:
+                self._drop(agent, 'disconnected')
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
+
+    def _drop(self, agent: AgentConnection, reason: str):
+        """Forgets agent. Its shards are leased again by `_rebalance`."""
+        agent.close()
+        if agent in self.agents:
+            self.agents.remove(agent)
+        for shard_id in agent.shards:
+            if self._owners.get(shard_id) is agent:
+                del self._owners[shard_id]
+        print(f'Agent {agent.name} {reason}, its {len(agent.shards)} '
+              f'shards are moved.', file=sys.stderr)
+        agent.shards = set()
+
+    def _expire(self):
+        """Drops agents silent for more than `lease_timeout` seconds."""
+        now = time.monotonic()
+        for agent in list(self.agents):
+            if not agent.blocked and \
+                    now - agent.last_seen > self.lease_timeout:
+                self._drop(agent, 'is silent')
+
+    def _lease(self, shard_id: int, agent: AgentConnection):
+        old = self._owners.get(shard_id)
+        if old is agent:
+            return
+        if old is not None:
+            old.shards.discard(shard_id)
+            old.send({'type': 'revoke', 'shards': [shard_id]})
+        self._owners[shard_id] = agent
+        agent.shards.add(shard_id)
+        agent.send({'type': 'lease', 'shard': shard_id,
+                    'targets': self.shards[shard_id]})
+
+    def _rebalance(self, move: bool = True) -> list[int]:
+        """Leases shards without owner and (if `move`) evens load.
+
+        Returns:
+            list: ids of shards which got new owner.
+        """
+        moved = []
+        for shard_id in self.shards:
+            if shard_id not in self._owners:
+                agent = min(self.agents, key=lambda item: len(item.shards))
+                self._lease(shard_id, agent)
+                moved.append(shard_id)
+        while move:
+            most = max(self.agents, key=lambda item: len(item.shards))
+            least = min(self.agents, key=lambda item: len(item.shards))
+            if len(most.shards) - len(least.shards) <= 1:
+                break
+            shard_id = max(most.shards)
+            self._lease(shard_id, least)
+            moved.append(shard_id)
+        return moved
+
+    async def _wait_agents(self):
+        while not self.agents:
+            print('Waiting for agents...', file=sys.stderr)
+            self._joined.clear()
+            await self._joined.wait()
+
+    def _start_shards(self, shard_ids: typing.Iterable[int]):
+        by_agent: dict[AgentConnection, list[int]] = {}
+        for shard_id in shard_ids:
+            by_agent.setdefault(self._owners[shard_id], []).append(shard_id)
+        for agent, ids in by_agent.items():
+            agent.send({'type': 'sweep', 'iteration': self.iteration,
+                        'shards': ids, 'metrics': metrics.enabled})
+
+    async def sweep(self) -> typing.AsyncGenerator[network.Result, None]:
+        """Runs one iteration on agents.
+
+        Waits for at least one agent. Agents joined or left since previous
+        iteration get shards before iteration starts.
+
+        Yields:
+            Result: results of all shards, in order they are received.
+        """
+        self.iteration += 1
+        await self._wait_agents()
+        self._expire()
+        await self._wait_agents()
+        self._rebalance()
+        pending = set(self.shards)
+        self._start_shards(pending)
+        while pending:
+            try:
+                agent, message = await asyncio.wait_for(self._events.get(),
+                                                        1)
+            except asyncio.TimeoutError:
+                agent = message = None
+            self._expire()
+            orphans = pending - set(self._owners)
+            if orphans:
+                await self._wait_agents()
+                self._rebalance(move=False)
+                self._start_shards(orphans)
+            if message is None or message.get('iteration') != \
+                    self.iteration:
+                continue  # Late message of previous iteration.
+            shard_id = message.get('shard')
+            if self._owners.get(shard_id) is not agent:
+                continue  # Shard was moved to other agent.
+            if message['type'] == 'done':
+                pending.discard(shard_id)
+                continue
+            for values in message['results']:
+                yield network.Result.from_tuple(values)
+
+
+class Agent:
+    """Checks shards leased by coordinator and sends results to it.
+
+    Reconnects (every `reconnect` seconds) if coordinator is not available.
+
+    Args:
+        host (str): coordinator address.
+        port (int): coordinator port.
+        engine_factory: callable without arguments, which returns
+          `engine.Engine`. Called once, engine is used for all shards.
+        name (str | None): agent name for coordinator logs.
+        heartbeat (float): seconds between heartbeats.
+        batch_size (int): max results sent at once.
+        batch_delay (float): max seconds result may wait in batch.
+        reconnect (float): seconds between connection attempts.
+        token (str | None): shared token of coordinator.
+
+    """
+
+    def __init__(self, host: str, port: int, engine_factory: typing.Callable,
+                 name: str | None = None, heartbeat: float = 2,
+                 batch_size: int = 256, batch_delay: float = 0.2,
+                 reconnect: float = 5, token: str | None = None):
+        self.host = host
+        self.port = port
+        self.engine_factory = engine_factory
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self.heartbeat = heartbeat
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.reconnect = reconnect
+        self.token = token
+        self.shards: dict[int, list[dict]] = {}
+        self._engine = None
+        self._running: dict[int, asyncio.Task] = {}
+
+    async def run(self):
+        """Serves coordinator forever."""
+        self._engine = self.engine_factory()
+        try:
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection(
+                        self.host, self.port, limit=LINE_LIMIT
+                    )
+                except OSError as exc:
+                    print(f'Coordinator is not available: {exc}',
+                          file=sys.stderr)
+                    await asyncio.sleep(self.reconnect)
+                    continue
+                try:
+                    await self._serve(reader, writer)
+                except (OSError, ValueError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError) as exc:
+                    print(f'Connection to coordinator lost: {exc!r}',
+                          file=sys.stderr)
+                finally:
+                    for task in self._running.values():
+                        task.cancel()
+                    self._running.clear()
+                    self.shards.clear()
+                    writer.close()
+                await asyncio.sleep(self.reconnect)
+        finally:
+            self._engine.close()
+
+    async def _serve(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        hello = {'type': 'hello', 'agent': self.name}
+        if self.token is not None:
+            hello['token'] = self.token
+        writer.write(_encode(hello))
+        heartbeats = asyncio.ensure_future(self._heartbeats(writer))
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                match message.get('type'):
+                    case 'lease':
+                        self.shards[message['shard']] = message['targets']
+                    case 'revoke':
+                        for shard_id in message['shards']:
+                            self.shards.pop(shard_id, None)
+                            task = self._running.pop(shard_id, None)
+                            if task is not None:
+                                task.cancel()
+                    case 'error':
+                        print(f'Coordinator rejected agent: '
+                              f'{message.get("message")}', file=sys.stderr)
+                    case 'sweep':
+                        if message.get('metrics'):
+                            metrics.enable()
+                        for shard_id in message['shards']:
+                            self._start(shard_id, message['iteration'],
+                                        writer)
+        finally:
+            heartbeats.cancel()
+
+    async def _heartbeats(self, writer: asyncio.StreamWriter):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            writer.write(_encode({'type': 'heartbeat'}))
+
+    def _start(self, shard_id: int, iteration: int,
+               writer: asyncio.StreamWriter):
+        old = self._running.pop(shard_id, None)
+        if old is not None:
+            old.cancel()
+        task = self._running[shard_id] = asyncio.ensure_future(
+            self._sweep(shard_id, iteration, writer)
+        )
+
+        def forget(done: asyncio.Task):
+            if not done.cancelled():
+                done.exception()  # Lost connection is handled by `run`.
+            if self._running.get(shard_id) is done:
+                del self._running[shard_id]
+
+        task.add_done_callback(forget)
+
+    async def _sweep(self, shard_id: int, iteration: int,
+                     writer: asyncio.StreamWriter):
+        batch = []
+        sent = time.monotonic()
+
+        async def send():
+            nonlocal batch, sent
+            writer.write(_encode({
+                'type': 'results', 'iteration': iteration,
+                'shard': shard_id, 'results': batch,
+                'metrics': metrics.take()
+            }))
+            batch = []
+            sent = time.monotonic()
+            await writer.drain()
+
+        try:
+            async for result in self._engine.sweep(
+                    self.shards.get(shard_id, [])):
+                batch.append(result.to_tuple())
+                if (len(batch) >= self.batch_size or
+                        time.monotonic() - sent >= self.batch_delay):
+                    await send()
+        except OSError:
+            raise
+        except Exception as exc:
+            # Coordinator shouldn't wait for shard forever.
+            print(f'Shard {shard_id} failed: {exc!r}', file=sys.stderr)
+        if batch:
+            await send()
+        writer.write(_encode({'type': 'done', 'iteration': iteration,
+                              'shard': shard_id,
+                              'metrics': metrics.take()}))
+        await writer.drain()
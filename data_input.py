@@ -1,9 +1,14 @@
 import abc
 import copy
 import csv
+import hashlib
+import itertools
 import json
+import os
+import sqlite3
+import typing
 
-from utils import check_host
+from utils import BulkValidator, check_host
 
 
 class InputReadError(Exception):
@@ -18,6 +23,11 @@ class Reader(abc.ABC):
 
     """
     _connection_string: str = ''
+    # Reader has `version` and `changed_since`, so changes of source may be
+    # read without reading whole source.
+    incremental = False
+    # Rows validated at once by `iter_validated_data`.
+    batch_size = 4096
 
     def __init__(self, *args):
         """Init for reader class.
@@ -27,15 +37,69 @@ class Reader(abc.ABC):
 
     def get_validated_data(self) -> dict[int, dict]:
         """Function to separate valid and invalid data"""
+        return {item['idx']: item for item in self.iter_validated_data()}
+
+    def iter_validated_data(self) -> typing.Generator[dict, None, None]:
+        """Same as `get_validated_data`, but yields items one by one.
+
+        Source is read lazily, so memory usage doesn't depend on its size.
+        Every item has `valid` key. Rows are validated by batches of
+        `batch_size`.
+        """
+        rows = self._iter_raw_rows()
+        validator = BulkValidator()
+        idx = 0
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            yield from filter(None,
+                              self._validate_batch(idx, batch, validator))
+            idx += len(batch)
+
+    def _iter_raw_rows(self) -> typing.Generator[typing.Any, None, None]:
+        """Yields not validated rows of source."""
         raise NotImplementedError
 
+    def _validate_batch(self, first_idx: int, batch: list,
+                        validator: BulkValidator) -> \
+            typing.Generator[dict | None, None, None]:
+        """Yields validated item for every row of batch (None if row must be
+        skipped). Hosts and ports are validated by `validator` at once."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _row_key(row) -> typing.Hashable:
+        """Returns key of row content, same for equal rows."""
+        return hashlib.blake2b(repr(row).encode(), digest_size=16).digest()
+
+    def close(self):
+        """Closes source."""
+        pass
+
+    @staticmethod
+    def _add_interval(item: dict, interval) -> dict:
+        """Adds check interval of host (in seconds) to validated item.
+
+        Empty interval means default one (--period). Item with invalid
+        interval is invalid.
+        """
+        item['interval'] = None
+        if interval is None or interval == '':
+            return item
+        try:
+            item['interval'] = float(interval)
+            if item['interval'] <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            item['interval'] = interval
+            item['valid'] = False
+        return item
+
     def _read_all(self) -> list[dict]:
         """Function to read all data to process inside class"""
         raise NotImplementedError
 
     @classmethod
-    def get_reader(cls, connection_string):
-        """Returns reader for provided connection_string"""
+    def get_reader_class(cls, connection_string) -> tuple[type, str]:
+        """Returns reader class and source for provided connection_string"""
         classes = cls.__subclasses__()
         try:
             con_type, source, *_ = connection_string.split(':')
@@ -47,11 +111,17 @@ class Reader(abc.ABC):
         connector = [class_ for class_ in classes if
                      class_._connection_string == con_type]
         if len(connector) and con_type != '':
-            return connector[0](source)
+            return connector[0], source
         else:
             raise InputReadError(f'Can\'t find datasource for '
                                  f'connection type {con_type}')
 
+    @classmethod
+    def get_reader(cls, connection_string):
+        """Returns reader for provided connection_string"""
+        reader_class, source = cls.get_reader_class(connection_string)
+        return reader_class(source)
+
     @classmethod
     def get_all_protocols(cls):
         """Returns all available connection types"""
@@ -65,57 +135,115 @@ class Reader(abc.ABC):
         reader = cls.get_reader(connection_string)
         return reader.get_validated_data()
 
+    @classmethod
+    def stream(cls, connection_string: str) -> \
+            typing.Generator[dict, None, None]:
+        """Streaming version of `read`: yields validated items one by one."""
+        reader = cls.get_reader(connection_string)
+        try:
+            yield from reader.iter_validated_data()
+        finally:
+            reader.close()
+
 
 class CsvReader(Reader):
-    """Reads data from csv file. takes filename as input."""
+    """Reads data from csv file. takes filename as input.
+
+    Columns: host, ports (comma separated) and optional check interval of
+    host in seconds.
+    """
     _connection_string = 'csv'
 
-    def get_validated_data(self) -> dict[int, dict]:
-        valid = []
-        invalid = []
-        if self._data is None:
-            self._read_all()
-        data = self._data[:]
+    def _iter_raw_rows(self) -> typing.Generator[list, None, None]:
+        if self._data is not None:
+            rows = iter(self._data)
+        else:
+            self.file.seek(0)
+            rows = csv.reader(
+                self.file,
+                delimiter=self._delimiter,
+                quotechar=self._quotechar
+            )
         if self._title:
-            data = self._data[1:]
-        for idx, row in enumerate(data):  # type: int, list
-            if not check_host(row[0]):
-                invalid.append({
+            next(rows, None)
+        yield from rows
+
+    @staticmethod
+    def _row_key(row: list) -> tuple:
+        return tuple(row)
+
+    def _validate_batch(self, first_idx: int, batch: list[list],
+                        validator: BulkValidator) -> \
+            typing.Generator[dict, None, None]:
+        """Same as `_validate_row` for every row of batch, but hosts and
+        ports are validated by `validator` at once."""
+        hosts = validator.hosts(row[0] if row else None for row in batch)
+        ports = validator.ports(row[1] if len(row) > 1 else ''
+                                for row in batch)
+        for idx, row, host_valid, row_ports in zip(
+                itertools.count(first_idx), batch, hosts, ports):
+            if len(row) < 2:
+                item = self._validate_row(idx, row)  # Raises proper error.
+            elif not host_valid:
+                item = {
                     'host': row[0],
                     'ports': row[1].split(','),
-                    'idx': idx
-                })
-                continue
+                    'idx': idx,
+                    'valid': False
+                }
+            elif row_ports is None:
+                item = {
+                    'host': row[0],
+                    'ports': [row[1]],
+                    'idx': idx,
+                    'valid': False
+                }
+            else:
+                item = {
+                    'host': row[0],
+                    'ports': row_ports,
+                    'idx': idx,
+                    'valid': True
+                }
+            yield self._add_interval(item, row[2].strip() if len(row) > 2
+                                     else None)
+
+    @staticmethod
+    def _validate_row(idx: int, row: list) -> dict:
+        """Returns validated item of one csv row."""
+        if not check_host(row[0]):
+            return {
+                'host': row[0],
+                'ports': row[1].split(','),
+                'idx': idx,
+                'valid': False
+            }
+        try:
+            if row[1] == '':
+                return {
+                    'host': row[0],
+                    'ports': [],
+                    'idx': idx,
+                    'valid': True
+                }
+            ports = [int(port.strip()) for port in
+                     row[1].strip().split(',')]
+            return {
+                'host': row[0],
+                'ports': ports,
+                'idx': idx,
+                'valid': True
+            }
+        except (ValueError, IndexError):
             try:
-                if row[1] == '':
-                    valid.append({
-                        'host': row[0],
-                        'ports': [],
-                        'idx': idx
-                    })
-                    continue
-                ports = [int(port.strip()) for port in
-                         row[1].strip().split(',')]
-                valid.append({
+                return {
                     'host': row[0],
-                    'ports': ports,
-                    'idx': idx
-                })
-            except (ValueError, IndexError):
-                try:
-                    invalid.append({
-                        'host': row[0],
-                        'ports': [row[1]],
-                        'idx': idx
-                    })
-                except IndexError:
-                    raise InputReadError('Csv is absolutely invalid.')
-        res = {}
-        for item in valid:
-            res.update({item['idx']: {**item, 'valid': True}})
-        for item in invalid:
-            res.update({item['idx']: {**item, 'valid': False}})
-        return res
+                    'ports': [row[1]],
+                    'idx': idx,
+                    'valid': False
+                }
+            except IndexError:
+                raise InputReadError('Csv is absolutely invalid.')
 
     def _read_all(self, force_update: bool = False):
         """Reads data from csv file or returns already read if it already was"""
@@ -142,6 +270,13 @@ class CsvReader(Reader):
         except (FileNotFoundError, OSError) as exc:
             raise exc
 
+    def close(self):
+        try:
+            if self.file and not self.file.closed:
+                self.file.close()
+        except AttributeError:
+            pass
+
     def __del__(self):
         """To be sure that file is closed.
 
@@ -150,11 +285,7 @@ class CsvReader(Reader):
         is True.
 
         """
-        try:
-            if self.file and not self.file.closed:
-                self.file.close()
-        except AttributeError:
-            pass
+        self.close()
 
 
 class JsonReader(Reader):
@@ -168,54 +299,132 @@ class JsonReader(Reader):
     """
     _connection_string = 'json'
 
-    def get_validated_data(self) -> dict[int, dict]:
-        """Separate valid and invalid data."""
-        if self._data is None:
-            self._read_all()
-        valid = []
-        invalid = []
-        for idx, row in enumerate(self._data):  # type: int, dict
-            if host := (row.get('host')):
-                if not check_host(host):
-                    invalid.append({
-                        'host': host,
-                        'ports': row.get('ports'),
-                        'idx': idx
-                    })
-                    continue
-                if ports := row.get('ports', []):
-                    try:
-                        ports = [int(port) for port in ports]
-                        if len(ports) < 1:
-                            invalid.append({
-                                'host': host,
-                                'ports': row.get('ports'),
-                                'idx': idx
-                            })
-                            continue
-                        valid.append({
-                            'host': host,
-                            'ports': ports,
-                            'idx': idx
-                        })
-                    except ValueError:
-                        invalid.append({
+    def _iter_raw_rows(self) -> typing.Generator[typing.Any, None, None]:
+        if self._data is not None:
+            yield from self._data
+        else:
+            yield from self._iter_rows()
+
+    def _validate_batch(self, first_idx: int, batch: list,
+                        validator: BulkValidator) -> \
+            typing.Generator[dict | None, None, None]:
+        """Same as `_validate_row` for every row of batch, but hosts are
+        validated by `validator` at once."""
+        hosts = validator.hosts(row.get('host') if isinstance(row, dict)
+                                else None for row in batch)
+        for idx, row, host_valid in zip(itertools.count(first_idx), batch,
+                                        hosts):  # type: int, dict, bool
+            item = self._validate_row(idx, row, host_valid)
+            yield item and self._add_interval(
+                item, row.get('interval') if isinstance(row, dict) else None
+            )
+
+    @staticmethod
+    def _validate_row(idx: int, row: dict,
+                      host_valid: bool | None = None) -> dict | None:
+        """Returns validated item of one json row.
+
+        Rows with valid host and without ports are skipped (returns None).
+        `host_valid` is result of `check_host` if it's already known.
+        """
+        if not isinstance(row, dict):
+            return {'host': '', 'ports': [], 'idx': idx, 'valid': False}
+        if host := (row.get('host')):
+            if host_valid is None:
+                host_valid = check_host(host)
+            if not host_valid:
+                return {
+                    'host': host,
+                    'ports': row.get('ports'),
+                    'idx': idx,
+                    'valid': False
+                }
+            if ports := row.get('ports', []):
+                try:
+                    ports = [int(port) for port in ports]
+                    if len(ports) < 1:
+                        return {
                             'host': host,
                             'ports': row.get('ports'),
-                            'idx': idx
-                        })
-            else:
-                invalid.append({
-                    'host': '',
-                    'ports': row.get('ports'),
-                    'idx': idx
-                })
-        res = {}
-        for item in valid:
-            res.update({item['idx']: {**item, 'valid': True}})
-        for item in invalid:
-            res.update({item['idx']: {**item, 'valid': False}})
-        return res
+                            'idx': idx,
+                            'valid': False
+                        }
+                    return {
+                        'host': host,
+                        'ports': ports,
+                        'idx': idx,
+                        'valid': True
+                    }
+                except ValueError:
+                    return {
+                        'host': host,
+                        'ports': row.get('ports'),
+                        'idx': idx,
+                        'valid': False
+                    }
+            return None
+        return {
+            'host': '',
+            'ports': row.get('ports'),
+            'idx': idx,
+            'valid': False
+        }
+
+    def _iter_rows(self, chunk_size: int = 65536) -> \
+            typing.Generator[typing.Any, None, None]:
+        """Yields elements of json list one by one, without reading whole
+        file into memory."""
+        decoder = json.JSONDecoder()
+        self.file.seek(0)
+        buffer = ''
+        eof = False
+        pos = 0
+
+        def skip_spaces():
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                buffer, pos = self.file.read(chunk_size), 0
+                eof = not buffer
+
+        def expect(chars: str) -> str:
+            skip_spaces()
+            if pos >= len(buffer) or buffer[pos] not in chars:
+                raise InputReadError(
+                    'Ошибка при считывании файла, json не валиден'
+                )
+            return buffer[pos]
+
+        expect('[')
+        pos += 1
+        skip_spaces()
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        while True:
+            skip_spaces()
+            while True:
+                try:
+                    row, end = decoder.raw_decode(buffer, pos)
+                    # Value at the end of buffer (number for example)
+                    # may be not read completely.
+                    if end < len(buffer) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise InputReadError(
+                            'Ошибка при считывании файла, json не валиден'
+                        )
+                chunk = self.file.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+            pos = end
+            yield row
+            if expect(',]') == ']':
+                return
+            pos += 1
 
     def _read_all(self):
         pass
@@ -238,13 +447,384 @@ class JsonReader(Reader):
         except (FileNotFoundError, OSError, json.JSONDecodeError) as exc:
             raise InputReadError('Ошибка при считывании файла, файл недоступен')
 
-    def __del__(self):
+    def close(self):
         try:
             if self.file and not self.file.closed:
                 self.file.close()
         except AttributeError:
             pass
 
+    def __del__(self):
+        self.close()
+
+
+class SqliteReader(Reader):
+    """Reads targets from table `targets` of sqlite database.
+
+    Columns are same as of csv: host, ports (comma separated, empty - ping
+    only) and optional interval. Validation is the same as of csv rows.
+    `idx` of item is row id - 1.
+
+    By default database is only read. With `track` (used by `SourceWatcher`)
+    schema of database is changed to track changes: database is switched to
+    WAL mode, table `targets` is created if it doesn't exist and gets
+    `version` column, tables `targets_deleted`, `targets_version` and
+    `targets_readers` and triggers are added. Triggers mark every inserted
+    or updated row by next `version` (and every deleted one in
+    `targets_deleted`), so rows changed since known version are read by
+    index (`changed_since`), without reading whole table. Readers save
+    versions they have read (`save_version`) only so that deleted rows older
+    than all saved versions are forgotten: after restart reader has no
+    targets in memory and reads all rows again.
+    """
+    _connection_string = 'sqlite'
+    incremental = True
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS targets (
+            id INTEGER PRIMARY KEY,
+            host TEXT NOT NULL,
+            ports TEXT NOT NULL DEFAULT '',
+            interval REAL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS targets_readers (
+            reader TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS targets_by_version ON targets(version);
+        CREATE TABLE IF NOT EXISTS targets_deleted (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS targets_deleted_by_version
+            ON targets_deleted(version);
+        CREATE TABLE IF NOT EXISTS targets_version (value INTEGER NOT NULL);
+        INSERT INTO targets_version
+            SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM targets_version);
+        CREATE TRIGGER IF NOT EXISTS targets_insert AFTER INSERT ON targets
+        BEGIN
+            UPDATE targets_version SET value = value + 1;
+            UPDATE targets SET version = (SELECT value FROM targets_version)
+                WHERE id = NEW.id;
+            DELETE FROM targets_deleted WHERE id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS targets_update
+            AFTER UPDATE OF id, host, ports, interval ON targets
+        BEGIN
+            UPDATE targets_version SET value = value + 1;
+            UPDATE targets SET version = (SELECT value FROM targets_version)
+                WHERE id = NEW.id;
+            INSERT OR REPLACE INTO targets_deleted
+                SELECT OLD.id, (SELECT value FROM targets_version)
+                WHERE OLD.id != NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS targets_delete AFTER DELETE ON targets
+        BEGIN
+            UPDATE targets_version SET value = value + 1;
+            INSERT OR REPLACE INTO targets_deleted
+                VALUES (OLD.id, (SELECT value FROM targets_version));
+        END;
+    '''
+
+    _validate_batch = CsvReader._validate_batch
+    _validate_row = staticmethod(CsvReader._validate_row)
+
+    def __init__(self, filename: str, track: bool = False):
+        super().__init__()
+        self.filename = filename
+        self.track = track
+        if not os.path.exists(filename):
+            raise InputReadError('Ошибка при считывании файла, файл недоступен')
+        try:
+            self.connection = sqlite3.connect(filename, isolation_level=None,
+                                              check_same_thread=False)
+            if track:
+                self._install_tracking()
+        except sqlite3.Error as exc:
+            raise InputReadError(f'Ошибка при считывании базы: {exc}')
+
+    def _install_tracking(self):
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        columns = {row[1] for row in self.connection.execute(
+            'PRAGMA table_info(targets)'
+        )}
+        if columns and 'version' not in columns:
+            # Table made by user: all its rows are older than any version.
+            self.connection.execute('ALTER TABLE targets ADD COLUMN version '
+                                    'INTEGER NOT NULL DEFAULT 0')
+        self.connection.executescript(self.SCHEMA)
+
+    # Rows are selected like csv rows (strings), with id at the end.
+    SELECT = ("SELECT host, COALESCE(ports, ''), "
+              "COALESCE(CAST(interval AS TEXT), ''), id FROM targets")
+
+    def _validate_rows(self, cursor: sqlite3.Cursor) -> \
+            typing.Generator[tuple[int, dict], None, None]:
+        """Yields (row id, validated item) of `SELECT` rows of cursor."""
+        validator = BulkValidator()
+        while rows := cursor.fetchmany(self.batch_size):
+            for row, item in zip(rows,
+                                 self._validate_batch(0, rows, validator)):
+                item['idx'] = row[3] - 1
+                yield row[3], item
+
+    def iter_validated_data(self) -> typing.Generator[dict, None, None]:
+        try:
+            cursor = self.connection.execute(self.SELECT + ' ORDER BY id')
+            for _, item in self._validate_rows(cursor):
+                yield item
+        except sqlite3.Error as exc:
+            raise InputReadError(f'Ошибка при считывании базы: {exc}')
+
+    def version(self) -> int:
+        """Returns version of last change of targets."""
+        return self.connection.execute(
+            'SELECT value FROM targets_version'
+        ).fetchone()[0]
+
+    def changed_since(self, version: int) -> \
+            tuple[int, list[tuple[int, dict | None]]]:
+        """Reads rows changed after `version` (negative - all rows).
+
+        Returns:
+            tuple: current version and (row id, validated item) of changed
+              rows. Item is None if row was deleted.
+        """
+        try:
+            self.connection.execute('BEGIN')
+            current = self.version()
+            changes = [] if version < 0 else [
+                (row_id, None) for row_id, in self.connection.execute(
+                    'SELECT id FROM targets_deleted WHERE version > ?',
+                    (version,)
+                )
+            ]
+            changes.extend(self._validate_rows(self.connection.execute(
+                self.SELECT + ' WHERE version > ? ORDER BY id', (version,)
+            )))
+        except sqlite3.Error as exc:
+            raise InputReadError(f'Ошибка при считывании базы: {exc}')
+        finally:
+            if self.connection.in_transaction:
+                self.connection.execute('COMMIT')
+        return current, changes
+
+    def save_version(self, reader: str, version: int):
+        """Saves version read by `reader`.
+
+        Deleted rows, which are older than versions of all readers, are
+        forgotten.
+        """
+        try:
+            self.connection.execute('BEGIN')
+            self.connection.execute(
+                'INSERT OR REPLACE INTO targets_readers VALUES (?, ?)',
+                (reader, version)
+            )
+            self.connection.execute(
+                'DELETE FROM targets_deleted WHERE version <= '
+                '(SELECT MIN(version) FROM targets_readers)'
+            )
+            self.connection.execute('COMMIT')
+        except sqlite3.Error as exc:
+            if self.connection.in_transaction:
+                self.connection.execute('ROLLBACK')
+            raise InputReadError(f'Ошибка при записи в базу: {exc}')
+
+    def close(self):
+        try:
+            self.connection.close()
+        except AttributeError:
+            pass
+
+
+class Delta(typing.NamedTuple):
+    """Changes of watched input.
+
+    Targets are identified by (host, tuple of ports), same as
+    `scheduler.target_key`.
+    """
+    added: list[dict]  # New valid targets.
+    removed: list[tuple]  # Keys of targets which are not in input anymore.
+    modified: list[dict]  # Targets with changed settings (interval).
+    invalid: list[dict]  # Invalid rows which weren't in input before.
+
+
+class SourceWatcher:
+    """Keeps validated input up to date with its source.
+
+    Source file is polled by `poll` (mtime, size and inode, there is no
+    inotify in stdlib). When file is changed, it's read again, but only rows
+    which weren't in it before are validated: every row is identified by its
+    content (`Reader._row_key`), so items of unchanged rows are taken from
+    previous read, even if they moved.
+
+    Incremental readers (sqlite) are polled by their version instead, and
+    only rows changed since previous poll are read. Their change tracking is
+    installed to source (see `SqliteReader`), and read version is saved to
+    source after every poll, so deleted rows are kept only as long as
+    somebody may need them. Saved version isn't used to resume: targets are
+    kept only in memory, so first poll after start reads all rows.
+
+    Args:
+        connection_string (str): input, same as for `Reader.get_reader`.
+        name (str): name of watcher to save read version of source under.
+
+    Attributes:
+        targets (dict): key -> valid item. If target is in input several
+          times, the last one is used.
+
+    """
+
+    def __init__(self, connection_string: str, name: str = 'avasite'):
+        self.connection_string = connection_string
+        self.name = name
+        reader_class, self.path = Reader.get_reader_class(connection_string)
+        self.targets: dict[tuple, dict] = {}
+        self._stat = None
+        # Row key -> (item, target key). Item is None for skipped rows,
+        # target key is None for invalid ones.
+        self._rows: dict[typing.Hashable, tuple] = {}
+        self._validator = BulkValidator()
+        # Incremental reader is kept open. Its rows are tracked by id:
+        # row id -> item, target key -> number of rows with it.
+        self._reader = reader_class(self.path, track=True) \
+            if reader_class.incremental else None
+        self._ids: dict[int, dict] = {}
+        self._refs: dict[tuple, int] = {}
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+
+    def _get_stat(self) -> tuple | int | None:
+        if self._reader is not None:
+            try:
+                return self._reader.version()
+            except sqlite3.Error:
+                return None
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None  # File is being replaced, will be seen next time.
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def poll(self) -> Delta | None:
+        """Applies changes of source.
+
+        Returns:
+            Delta | None: changes or None if source wasn't changed. First
+              poll returns all input as added.
+
+        Raises:
+            InputReadError: if source can't be read. Previous state is kept,
+              next poll reads source only if it's changed again.
+        """
+        stat = self._get_stat()
+        if stat is None or stat == self._stat:
+            return None
+        if self._reader is not None:
+            return self._poll_changes()
+        self._stat = stat
+        reader = Reader.get_reader(self.connection_string)
+        try:
+            order = []
+            rows = {}
+            new = []  # (idx, row) of rows which weren't read before.
+            for idx, row in enumerate(reader._iter_raw_rows()):
+                row_key = reader._row_key(row)
+                order.append(row_key)
+                if row_key in rows:
+                    continue
+                known = rows[row_key] = self._rows.get(row_key)
+                if known is None:
+                    new.append((idx, row))
+        finally:
+            reader.close()
+        invalid = []
+        for first in range(0, len(new), reader.batch_size):
+            batch = new[first:first + reader.batch_size]
+            validated = reader._validate_batch(
+                0, [row for _, row in batch], self._validator
+            )
+            for (idx, _), item in zip(batch, validated):
+                target_key = None
+                if item is not None:
+                    item['idx'] = idx
+                    if item['valid']:
+                        target_key = item['host'], tuple(item['ports'])
+                    else:
+                        invalid.append(item)
+                rows[order[idx]] = (item, target_key)
+        targets = {}
+        # Ordered by last occurrence, so the last row of target wins.
+        for row_key in reversed(dict.fromkeys(reversed(order))):
+            item, target_key = rows[row_key]
+            if target_key is not None:
+                targets[target_key] = item
+        old = self.targets
+        delta = Delta(
+            added=[item for key, item in targets.items() if key not in old],
+            removed=[key for key in old if key not in targets],
+            modified=[item for key, item in targets.items()
+                      if key in old and
+                      old[key].get('interval') != item.get('interval')],
+            invalid=invalid
+        )
+        self.targets, self._rows = targets, rows
+        return delta
+
+    def _poll_changes(self) -> Delta:
+        """Applies rows of incremental reader changed since last poll."""
+        self._stat, changes = self._reader.changed_since(
+            -1 if self._stat is None else self._stat
+        )
+        self._reader.save_version(self.name, self._stat)
+        targets, refs = self.targets, self._refs
+        invalid = []
+        if not self._ids:
+            # First poll: everything is added.
+            for row_id, item in changes:
+                if item is None:
+                    continue
+                self._ids[row_id] = item
+                if item['valid']:
+                    key = item['host'], tuple(item['ports'])
+                    refs[key] = refs.get(key, 0) + 1
+                    targets[key] = item
+                else:
+                    invalid.append(item)
+            return Delta(list(targets.values()), [], [], invalid)
+        touched = {}  # Target key -> its item before changes.
+        for row_id, item in changes:
+            old = self._ids.pop(row_id, None)
+            if old is not None and old['valid']:
+                key = old['host'], tuple(old['ports'])
+                touched.setdefault(key, targets.get(key))
+                refs[key] -= 1
+                if not refs[key]:
+                    del refs[key], targets[key]
+            if item is None:
+                continue
+            self._ids[row_id] = item
+            if not item['valid']:
+                invalid.append(item)
+                continue
+            key = item['host'], tuple(item['ports'])
+            touched.setdefault(key, targets.get(key))
+            refs[key] = refs.get(key, 0) + 1
+            targets[key] = item
+        return Delta(
+            added=[targets[key] for key, old in touched.items()
+                   if old is None and key in targets],
+            removed=[key for key, old in touched.items()
+                     if old is not None and key not in targets],
+            modified=[targets[key] for key, old in touched.items()
+                      if old is not None and key in targets and
+                      old.get('interval') != targets[key].get('interval')],
+            invalid=invalid
+        )
+
 
 if __name__ == '__main__':
     # Just simple tests.
@@ -1,10 +1,31 @@
 """Data output manager module."""
 import abc
+import asyncio
+import io
+import json
+import queue
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import traceback
 import typing
 
+import breaker
+import network
+import results_store
+import utils
+
+
+class OutputWriteError(Exception):
+    pass
+
 
 class Writer(abc.ABC):
     """Abstract class for output manager"""
+    _connection_string: str = ''
 
     def __call__(self, *args, **kwargs):
         raise NotImplementedError
@@ -12,17 +33,79 @@ class Writer(abc.ABC):
     def write(self, *args, **kwargs):
         self(*args, **kwargs)
 
+    def write_bytes(self, data: bytes):
+        """Writes encoded data (see `Serializer`) by one call."""
+        self.write(data.decode())
+
+    def write_batch(self, items: list, serializer: 'Serializer',
+                    buffer: bytearray):
+        """Writes batch of items encoded by `serializer` to `buffer`.
+
+        Writers which store results themselves (not bytes) override this.
+        """
+        del buffer[:]
+        serializer.encode_batch(items, buffer)
+        if buffer:
+            self.write_bytes(buffer)
+
+    def close(self):
+        pass
+
+    @classmethod
+    def get_writer(cls, connection_string: str) -> 'Writer':
+        """Returns writer for connection string like `file:./output.txt`.
+
+        `stdout` doesn't need source.
+        """
+        con_type, _, source = connection_string.partition(':')
+        for class_ in cls.__subclasses__():
+            if class_._connection_string and \
+                    class_._connection_string == con_type:
+                return class_.from_source(source)
+        raise OutputWriteError(f'Can\'t find output for connection type '
+                               f'{con_type}')
+
+    @classmethod
+    def get_all_protocols(cls) -> list[str]:
+        """Returns all available connection types"""
+        return [class_._connection_string for class_ in cls.__subclasses__()
+                if class_._connection_string]
+
+    @classmethod
+    def from_source(cls, source: str) -> 'Writer':
+        raise NotImplementedError
+
 
 class FileWriter(Writer):
     """Writes data into file. (Or file-like object)"""
+    _connection_string = 'file'
 
     def __init__(self, file: typing.IO):
         self.file = file
 
+    @classmethod
+    def from_source(cls, source: str) -> 'FileWriter':
+        return cls(open(source, 'ab'))
+
     def __call__(self, *args, **kwargs):
         if self.file and not self.file.closed:
             self.file.write(*args, **kwargs)
 
+    def write_bytes(self, data: bytes):
+        if not self.file or self.file.closed:
+            return
+        if isinstance(self.file, io.TextIOBase):
+            self.file.flush()
+            self.file.buffer.write(data)
+            self.file.buffer.flush()
+        else:
+            self.file.write(data)
+            self.file.flush()
+
+    def close(self):
+        if self.file and not self.file.closed:
+            self.file.close()
+
     def __enter__(self):
         return self.file
 
@@ -43,6 +126,444 @@ class FileWriter(Writer):
 
 class StdPrintWriter(Writer):
     """Prints data into default stdout or stream by print function"""
+    _connection_string = 'stdout'
+
+    @classmethod
+    def from_source(cls, source: str) -> 'StdPrintWriter':
+        return cls()
 
     def __call__(self, *args, **kwargs):
         print(*args, **kwargs)
+
+    def write_bytes(self, data: bytes):
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+
+class UnixSocketWriter(Writer):
+    """Sends data to UNIX stream socket.
+
+    If nobody listens on socket (or listener is gone), lines are dropped and
+    connection is retried on next write.
+    """
+    _connection_string = 'unix'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._sock: socket.socket | None = None
+
+    @classmethod
+    def from_source(cls, source: str) -> 'UnixSocketWriter':
+        return cls(source)
+
+    def __call__(self, data: str):
+        self.write_bytes(f'{data}\n'.encode())
+
+    def write_bytes(self, data: bytes):
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.connect(self.path)
+            self._sock.sendall(data)
+        except OSError:
+            self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class SqliteWriter(Writer):
+    """Stores results in table `results` of sqlite database.
+
+    Database is in WAL mode, so it may be read (e.g. by history queries or
+    by `SqliteReader` of same file) while results are written. Every batch
+    is inserted by one prepared statement in one transaction. Text lines
+    are skipped.
+
+    Columns: time (epoch ns), host, ip, port, status (NULL - pingable), rtt
+    (ms), cert (network.CERT_* code, NULL - not resolved), cert_message and
+    circuit (state of circuit breaker, NULL - closed). Results are indexed
+    by time and by host and time.
+    """
+    _connection_string = 'sqlite'
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS results (
+            time INTEGER NOT NULL,
+            host TEXT NOT NULL,
+            ip TEXT,
+            port INTEGER,
+            status INTEGER,
+            rtt REAL,
+            cert INTEGER,
+            cert_message TEXT,
+            circuit TEXT
+        );
+        CREATE INDEX IF NOT EXISTS results_time ON results(time);
+        CREATE INDEX IF NOT EXISTS results_host_time ON results(host, time);
+    '''
+    INSERT = ('INSERT INTO results (time, host, ip, port, status, rtt, cert, '
+              'cert_message, circuit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+    def __init__(self, path: str):
+        self.path = path
+        # Used by background thread of BatchWriter, but never concurrently.
+        self.connection = sqlite3.connect(path, timeout=30,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.connection.execute(
+            'PRAGMA table_info(results)'
+        )}
+        if 'circuit' not in columns:
+            # Database was made before circuit was stored.
+            self.connection.execute(
+                'ALTER TABLE results ADD COLUMN circuit TEXT'
+            )
+
+    @classmethod
+    def from_source(cls, source: str) -> 'SqliteWriter':
+        return cls(source)
+
+    def __call__(self, item):
+        self.write_batch([item], None, bytearray())
+
+    def write_batch(self, items: list, serializer: 'Serializer',
+                    buffer: bytearray):
+        compact = network.Result.from_dict
+        rows = [
+            (item.time_ns, item.host, item.ip, item.port, item.status,
+             item.rtt, item.cert, item.cert_message, item.circuit)
+            for item in map(compact, (item for item in items
+                                      if not isinstance(item, str)))
+        ]
+        if rows:
+            with self.connection:
+                self.connection.executemany(self.INSERT, rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class Serializer(abc.ABC):
+    """Encodes output items (check results and text lines) to bytes.
+
+    Items are encoded by batches and appended to buffer, which is reused by
+    caller for every batch. Format plan of every serializer is made once:
+    record templates are precomputed and strings (hosts, ips, certificate
+    messages) are encoded once and taken from cache later.
+    Text lines (like "Check results:") are written only in text format.
+    """
+    name: str = ''
+
+    def __init__(self, cache_size: int = 100000):
+        self.cache_size = cache_size
+        self._strings: dict[str | None, bytes] = {}
+
+    def _string(self, value: str | None) -> bytes:
+        """Returns encoded string from cache."""
+        encoded = self._strings.get(value)
+        if encoded is None:
+            encoded = self._encode_string(value)
+            if len(self._strings) < self.cache_size:
+                self._strings[value] = encoded
+        return encoded
+
+    @staticmethod
+    def _encode_string(value: str | None) -> bytes:
+        return (value or '').encode()
+
+    @abc.abstractmethod
+    def encode_batch(self, items: list, buffer: bytearray):
+        """Appends encoded `items` to `buffer`."""
+        raise NotImplementedError
+
+    @classmethod
+    def get_serializer(cls, name: str) -> 'Serializer':
+        """Returns new serializer of format `name`."""
+        for class_ in cls.__subclasses__():
+            if class_.name == name:
+                return class_()
+        raise OutputWriteError(f'Unknown output format {name}')
+
+    @classmethod
+    def get_all_formats(cls) -> list[str]:
+        """Returns all available format names."""
+        return [class_.name for class_ in cls.__subclasses__()]
+
+
+class TextSerializer(Serializer):
+    """Human-readable lines, same as were printed always."""
+    name = 'text'
+    PLUG = '???'
+    STATUSES = {1: 'opened', 0: 'Closed', None: 'Address pingable.'}
+
+    @classmethod
+    def format_result(cls, result: network.CheckResult) -> str:
+        """Makes human-readable line from check result."""
+        ip = result.get('ip')
+        if not ip:
+            return (f"{result.get('time')} | {result.get('host')} | "
+                    f"{cls.PLUG}  | 0 ms | {result.get('port') or cls.PLUG} "
+                    f"| Hostname not resolved.")
+        host = result.get('host')
+        status = cls.STATUSES.get(result.get('status'), result.get('status'))
+        if result.get('circuit') == breaker.OPEN:
+            status = f'{status} (down, not probed)'
+        return (f"{result.get('time')} | "
+                f"{cls.PLUG if utils.is_ip(host) else host} | "
+                f"{ip} | {result.get('rtt')} ms | "
+                f"{result.get('port') or cls.PLUG} | {status} | "
+                f"{result.get('ssl_cert')[-1]}")
+
+    def encode_batch(self, items: list, buffer: bytearray):
+        for item in items:
+            if isinstance(item, str):
+                buffer += item.encode()
+            else:
+                buffer += self.format_result(item).encode()
+            buffer += b'\n'
+
+
+class NdjsonSerializer(Serializer):
+    """One JSON object per line. Time is in epoch nanoseconds."""
+    name = 'ndjson'
+    TEMPLATE = (b'{"time":%d,"host":%b,"ip":%b,"port":%b,"status":%b,'
+                b'"rtt":%a,"cert_valid":%b,"cert":%b,"circuit":%b}\n')
+    # Certificate validity by CERT_* code.
+    CERTS = {network.CERT_VALID: b'true', network.CERT_INVALID: b'false',
+             network.CERT_NOT_CHECKED: b'false', None: b'null'}
+
+    @staticmethod
+    def _encode_string(value: str | None) -> bytes:
+        if value is None:
+            return b'null'
+        return json.dumps(value, ensure_ascii=False).encode()
+
+    def encode_batch(self, items: list, buffer: bytearray):
+        template = self.TEMPLATE
+        string = self._string
+        compact = network.Result.from_dict
+        for item in items:
+            if isinstance(item, str):
+                continue
+            item = compact(item)
+            port, status = item.port, item.status
+            buffer += template % (
+                item.time_ns,
+                string(item.host),
+                string(item.ip),
+                b'null' if port is None else b'%d' % port,
+                b'null' if status is None else b'%d' % status,
+                float(item.rtt or 0),
+                self.CERTS[item.cert],
+                string(item.cert_message),
+                string(item.circuit),
+            )
+
+
+class CsvSerializer(Serializer):
+    """CSV with header. Time is in epoch nanoseconds, empty means null."""
+    name = 'csv'
+    HEADER = b'time,host,ip,port,status,rtt,cert_valid,cert,circuit\n'
+    TEMPLATE = b'%d,%b,%b,%b,%b,%a,%b,%b,%b\n'
+    CERTS = {network.CERT_VALID: b'1', network.CERT_INVALID: b'0',
+             network.CERT_NOT_CHECKED: b'0', None: b''}
+
+    def __init__(self, cache_size: int = 100000):
+        super().__init__(cache_size)
+        self.header_written = False
+
+    @staticmethod
+    def _encode_string(value: str | None) -> bytes:
+        value = value or ''
+        if any(char in value for char in ',"\r\n'):
+            value = '"' + value.replace('"', '""') + '"'
+        return value.encode()
+
+    def encode_batch(self, items: list, buffer: bytearray):
+        if not self.header_written:
+            buffer += self.HEADER
+            self.header_written = True
+        template = self.TEMPLATE
+        string = self._string
+        compact = network.Result.from_dict
+        for item in items:
+            if isinstance(item, str):
+                continue
+            item = compact(item)
+            port, status = item.port, item.status
+            buffer += template % (
+                item.time_ns,
+                string(item.host),
+                string(item.ip),
+                b'' if port is None else b'%d' % port,
+                b'' if status is None else b'%d' % status,
+                float(item.rtt or 0),
+                self.CERTS[item.cert],
+                string(item.cert_message),
+                string(item.circuit),
+            )
+
+
+class BinarySerializer(Serializer):
+    """Length-prefixed binary records.
+
+    Every record is `RECORD` header (length of the rest of record, epoch ns,
+    rtt, port, status, cert and circuit codes of `results_store`, ip and
+    host lengths), then packed ip (4 or 16 bytes) and utf-8 host.
+    """
+    name = 'binary'
+    RECORD = struct.Struct('<IqfHbbbBH')
+
+    def __init__(self, cache_size: int = 100000):
+        super().__init__(cache_size)
+        self._ips: dict[str | None, bytes] = {}
+
+    def _ip(self, ip: str | None) -> bytes:
+        packed = self._ips.get(ip)
+        if packed is None:
+            packed = b'' if not ip else \
+                socket.inet_pton(network.address_family(ip), ip)
+            if len(self._ips) < self.cache_size:
+                self._ips[ip] = packed
+        return packed
+
+    def encode_batch(self, items: list, buffer: bytearray):
+        pack = self.RECORD.pack
+        size = self.RECORD.size - 4
+        compact = network.Result.from_dict
+        for item in items:
+            if isinstance(item, str):
+                continue
+            item = compact(item)
+            ip = self._ip(item.ip)
+            host = self._string(item.host)
+            port = item.port or 0
+            buffer += pack(
+                size + len(ip) + len(host),
+                item.time_ns,
+                item.rtt or 0,
+                port if 0 <= port <= 65535 else 0,
+                results_store.status_code(item.status),
+                item.cert or results_store.CERT_NOT_CHECKED,
+                results_store.circuit_code(item.circuit),
+                len(ip), len(host)
+            )
+            buffer += ip
+            buffer += host
+
+    @classmethod
+    def decode(cls, data: bytes) -> typing.Generator[dict, None, None]:
+        """Yields records of encoded data."""
+        offset = 0
+        while offset + cls.RECORD.size <= len(data):
+            length, stamp, rtt, port, status, cert, circuit, ip_len, \
+                host_len = cls.RECORD.unpack_from(data, offset)
+            offset += cls.RECORD.size
+            ip = data[offset:offset + ip_len]
+            offset += ip_len
+            host = data[offset:offset + host_len].decode()
+            offset += host_len
+            yield {
+                'time': stamp,
+                'host': host,
+                'ip': socket.inet_ntop(
+                    socket.AF_INET if ip_len == 4 else socket.AF_INET6, ip
+                ) if ip else None,
+                'port': port or None,
+                'status': status,
+                'cert': cert,
+                'circuit': circuit,
+                'rtt': rtt,
+            }
+
+
+class BatchWriter(Writer):
+    """Writes items to several sinks by background thread.
+
+    Items are put to bounded queue. Thread takes them by batches (up to
+    `batch_size` items or everything collected in `flush_interval` seconds),
+    encodes and writes every batch to every sink by one `write_bytes` call.
+    So slow output doesn't stop the caller until queue is full.
+
+    Args:
+        sinks (list): (writer, serializer) pairs.
+        max_queue (int): max items waiting to be written. `write` blocks when
+          queue is full, `drain` waits when it's half full.
+        batch_size (int): max items in batch.
+        flush_interval (float): max seconds item waits for batch.
+
+    """
+
+    def __init__(self, sinks: list[tuple[Writer, Serializer]],
+                 max_queue: int = 10000, batch_size: int = 1000,
+                 flush_interval: float = 0.2):
+        self.sinks = sinks
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._thread: threading.Thread | None = None
+        self._stop = object()
+
+    def __call__(self, item):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='batch-writer')
+            self._thread.start()
+        self._queue.put(item)
+
+    async def drain(self):
+        """Waits until writer catches up (queue is less than half full)."""
+        while self._queue.qsize() >= self.max_queue // 2:
+            await asyncio.sleep(self.flush_interval / 4)
+
+    def flush(self):
+        """Waits until all written items are written by sinks."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Writes everything and closes sinks."""
+        if self._thread is not None:
+            self._queue.put(self._stop)
+            self._thread.join()
+            self._thread = None
+        for writer, _ in self.sinks:
+            writer.close()
+
+    def _run(self):
+        stop = False
+        buffer = bytearray()  # Reused by all batches.
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._stop:
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    ))
+                except queue.Empty:
+                    break
+            if batch[-1] is self._stop:
+                stop = True
+                batch.pop()
+            for sink in list(self.sinks):
+                writer, serializer = sink
+                try:
+                    writer.write_batch(batch, serializer, buffer)
+                except (OSError, sqlite3.DatabaseError) as exc:
+                    # Closed pipe, full disk or broken database: sink is not
+                    # used anymore.
+                    self.sinks.remove(sink)
+                    print(f'Output {type(writer).__name__} is disabled: '
+                          f'{exc}', file=sys.stderr)
+                except Exception:
+                    # Broken sink mustn't stop other sinks and producers.
+                    traceback.print_exc()
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
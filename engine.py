@@ -0,0 +1,380 @@
+"""Asynchronous check engine.
+
+`network.check` checks hosts one by one, so one dead host holds up the whole
+sweep. Engine runs all checks at once (with limits, to not flood network or
+single server) so sweep takes about as long as the slowest probe.
+"""
+import asyncio
+import contextlib
+import time
+import typing
+
+import icmplib
+
+import breaker
+import certcache
+import httppool
+import metrics
+import network
+import planner
+import resolver
+import synscan
+
+
+class PingBatcher:
+    """Collects ips to ping and pings them together by one multiping.
+
+    Every `ping` call waits `window` seconds for other calls, so all ping-only
+    hosts of one sweep are pinged at once.
+    """
+
+    def __init__(self, window: float = 0.05, concurrent_tasks: int = 500):
+        self.window = window
+        self.concurrent_tasks = concurrent_tasks
+        self._batch: dict[str, asyncio.Future] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def ping(self, ip_address: str) -> icmplib.Host:
+        """Returns ping result of `ip_address` (from nearest batch)."""
+        future = self._batch.get(ip_address)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._batch[ip_address] = loop.create_future()
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        batch, self._batch = self._batch, {}
+        self._flush_handle = None
+        task = asyncio.ensure_future(network.async_multiping(
+            list(batch), self.concurrent_tasks
+        ))
+        task.add_done_callback(lambda done: self._resolve(batch, done))
+
+    @staticmethod
+    def _resolve(batch: dict[str, asyncio.Future], task: asyncio.Task):
+        for ip_address, future in batch.items():
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result()[ip_address])
+
+
+async def _maybe(task: asyncio.Task | None):
+    """Returns result of task or None if there is no task."""
+    return None if task is None else await task
+
+
+class Engine:
+    """Runs availability checks concurrently.
+
+    Two limits are applied:
+        1) global limit - maximum number of probes running at the same time.
+        2) per ip limit - maximum number of probes to one destination ip.
+           Without it, host with many ports will be flooded with connections.
+
+    If `combined` is True, every ip/port pair is checked by
+    `network.async_probe`: port state, RTT, certificate and (if `http` is
+    True) HTTP in one connection. Otherwise port and certificate are checked
+    by separate connections, like `network.check` does.
+
+    Every resolved ip address of host is probed. If `first_success` is True
+    (and neither `combined` nor `http` is), port is checked once per host by
+    `network.async_first_connect`: addresses are tried like RFC 8305 "happy
+    eyeballs" and result is given for the first reachable one.
+
+    If `scanner` is given, ports (without `combined` and `http`) are checked
+    by SYN packets instead of connect(). Addresses it can't check (IPv6) are
+    checked by connect().
+
+    If `http_pool` is given, HTTP checks (`http` without `combined`) are sent
+    through its kept-alive connections.
+
+    If `circuit_breaker` is given, ports of dead targets are probed rarely and
+    with short timeout, and timeouts of alive ones are based on their RTT.
+
+    If `dedupe` is True, `sweep` checks targets by `planner.ProbePlan`: every
+    endpoint requested by several targets is probed once.
+
+    """
+
+    def __init__(self, concurrency: int = 500, per_ip_limit: int = 10,
+                 timeout: float = 15,
+                 host_resolver: resolver.Resolver | None = None,
+                 combined: bool = False, http: bool = False,
+                 cert_cache: certcache.CertCache | None = None,
+                 hosts_window: int | None = None,
+                 first_success: bool = False,
+                 scanner: synscan.SynScanner | None = None,
+                 http_pool: httppool.HttpPool | None = None,
+                 circuit_breaker: breaker.CircuitBreaker | None = None,
+                 dedupe: bool = False):
+        self.concurrency = concurrency
+        self.per_ip_limit = per_ip_limit
+        self.timeout = timeout
+        self.resolver = host_resolver if host_resolver is not None else \
+            resolver.Resolver()
+        self.combined = combined
+        self.http = http
+        self.pinger = PingBatcher(concurrent_tasks=concurrency)
+        self.cert_cache = cert_cache if cert_cache is not None else \
+            certcache.CertCache()
+        self.hosts_window = hosts_window or concurrency
+        self.first_success = first_success
+        self.scanner = scanner
+        self.http_pool = http_pool
+        self.breaker = circuit_breaker
+        self.dedupe = dedupe
+        self._global_limit: asyncio.Semaphore | None = None
+        # ip -> [semaphore, number of users]. Removed when nobody uses it.
+        self._ip_limits: dict[str, list] = {}
+
+    def close(self):
+        """Closes sockets of scanner and kept-alive HTTP connections.
+
+        Must be called in event loop of checks (before it's closed).
+        """
+        if self.scanner is not None:
+            self.scanner.close()
+        if self.http_pool is not None:
+            self.http_pool.close()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, ip: str | None = None):
+        """Takes place in global limit and in limit of destination `ip`."""
+        if self._global_limit is None:
+            self._global_limit = asyncio.Semaphore(self.concurrency)
+        if ip is None:
+            async with self._global_limit:
+                yield
+            return
+        limit = self._ip_limits.setdefault(
+            ip, [asyncio.Semaphore(self.per_ip_limit), 0]
+        )
+        limit[1] += 1
+        try:
+            async with limit[0]:
+                async with self._global_limit:
+                    yield
+        finally:
+            limit[1] -= 1
+            if not limit[1]:
+                del self._ip_limits[ip]
+
+    def _circuit(self, ip_address: str,
+                 port: int) -> tuple[str | None, float]:
+        """Returns circuit state and timeout of next probe of ip/port."""
+        if self.breaker is None:
+            return None, self.timeout
+        key = (ip_address, port)
+        return self.breaker.state(key), \
+            self.breaker.timeout(key, self.timeout)
+
+    @staticmethod
+    def _down_result(host: str, ip_address: str, port: int,
+                     ssl_cert: tuple[bool, str]) -> network.Result:
+        """Result for target which isn't probed because circuit is open."""
+        return network.Result(host, ip_address, 0, port, 0, ssl_cert,
+                              circuit=breaker.OPEN)
+
+    async def _port_result(self, host: str, ip_address: str, port: int,
+                           cert_task: asyncio.Task | None) -> \
+            network.Result:
+        circuit, timeout = self._circuit(ip_address, port)
+        if circuit == breaker.OPEN:
+            return self._down_result(host, ip_address, port,
+                                     await _maybe(cert_task))
+        probe = network.async_http_is_opened if self.http else \
+            network.async_port_is_opened
+        phase = 'http_first_byte' if self.http else 'connect'
+        async with self.slot(ip_address):
+            with metrics.stage_timer('probe'):
+                res = timings = None
+                if self.scanner is not None and not self.http:
+                    res = await self.scanner.probe(ip_address, port, timeout)
+                elif self.http_pool is not None and self.http:
+                    *res, timings = await self.http_pool.check(
+                        host, ip_address, port, timeout
+                    )
+                opened, rtt = res or await probe(ip_address, port, timeout)
+        if self.breaker is not None:
+            self.breaker.record((ip_address, port), opened, rtt)
+        if timings is None:
+            timings = {phase: int(rtt * 1e6)} if opened else {}
+        return network.Result(host, ip_address, rtt, port, int(opened),
+                              await _maybe(cert_task), timings, circuit)
+
+    async def _first_success_result(self, host: str,
+                                    ip_addresses: list[str], port: int,
+                                    cert_task: asyncio.Task | None) -> \
+            network.Result:
+        # Attempts to different ips, so only global limit is taken.
+        async with self.slot():
+            with metrics.stage_timer('probe'):
+                ip_address, rtt = await network.async_first_connect(
+                    ip_addresses, port, self.timeout
+                )
+        return network.Result(
+            # Closed port is reported for first address.
+            host, ip_address or ip_addresses[0], rtt, port,
+            int(ip_address is not None), await _maybe(cert_task),
+            {'connect': int(rtt * 1e6)} if ip_address else {}
+        )
+
+    async def _probe_result(self, host: str, ip_address: str,
+                            port: int) -> network.Result:
+        circuit, timeout = self._circuit(ip_address, port)
+        if circuit == breaker.OPEN:
+            return self._down_result(host, ip_address, port,
+                                     (False, network.NO_CERT_CHECK_STRING))
+        async with self.slot(ip_address):
+            with metrics.stage_timer('probe'):
+                result = await network.async_probe(
+                    host, ip_address, port, self.http, timeout,
+                    self.cert_cache
+                )
+        if self.breaker is not None:
+            self.breaker.record((ip_address, port), bool(result.status),
+                                result.rtt)
+        result.circuit = circuit
+        return result
+
+    async def _ping_result(self, host: str, ip_address: str,
+                           cert_task: asyncio.Task | None) -> \
+            network.Result:
+        # Pings are batched by `pinger`, so no slot is taken here.
+        ping_result = await self.pinger.ping(ip_address)
+        return network.Result(host, ip_address, ping_result.avg_rtt, None,
+                              None if ping_result.is_alive else 0,
+                              await _maybe(cert_task))
+
+    async def _cert(self, host: str, ip_address: str,
+                    port: int) -> tuple[bool, str]:
+        # Same plug as in `network.check_ssl_certificate`.
+        if port != 443:
+            return False, network.NO_CERT_CHECK_STRING
+        circuit, timeout = self._circuit(ip_address, port)
+        if circuit == breaker.OPEN:
+            return False, network.NO_CERT_CHECK_STRING
+        async with self.slot(ip_address):
+            with metrics.stage_timer('probe'):
+                return await self.cert_cache.check(
+                    host, port, ip_address, timeout
+                )
+
+    async def check(self, host: str, ports: list[int], **_) -> \
+            typing.AsyncGenerator[network.Result, None]:
+        """Async version of `network.check`.
+
+        Same results, but all ip/port pairs of host are checked at once.
+        Results are yielded in order they are ready. Every result has
+        `timings` of its probe phases (including dns).
+        """
+        start = time.perf_counter_ns()
+        ip_addresses = await self.resolver.resolve(host)
+        dns = time.perf_counter_ns() - start
+        metrics.stage('resolve', dns)
+        if not ip_addresses:
+            for port in ports:
+                yield self._finish(self._unresolved_result(host, port), dns)
+            return
+        if ports and self.combined:
+            probes = [self._probe_result(host, ip_address, port)
+                      for ip_address in ip_addresses for port in ports]
+            for probe in asyncio.as_completed(probes):
+                yield self._finish(await probe, dns)
+            return
+        cert_task = asyncio.ensure_future(
+            self._cert(host, ip_addresses[0],
+                       443 if ports and 443 in ports else 80)
+        )
+        if ports and self.first_success and not self.http:
+            probes = [self._first_success_result(host, ip_addresses, port,
+                                                 cert_task)
+                      for port in ports]
+        elif ports:
+            probes = [self._port_result(host, ip_address, port, cert_task)
+                      for ip_address in ip_addresses for port in ports]
+        else:
+            probes = [self._ping_result(host, ip_address, cert_task)
+                      for ip_address in ip_addresses]
+        try:
+            for probe in asyncio.as_completed(probes):
+                yield self._finish(await probe, dns)
+        finally:
+            cert_task.cancel()
+
+    @staticmethod
+    def _unresolved_result(host: str, port: int) -> network.Result:
+        return network.Result(host, None, 0, port, 0)
+
+    @staticmethod
+    def _finish(result: network.Result, dns: int) -> network.Result:
+        """Adds dns timing to result and counts it in metrics."""
+        if result.timings is None:
+            result.timings = {}
+        result.timings['dns'] = dns
+        metrics.probe('port' if result.port else 'ping', result.status,
+                      result.timings)
+        return result
+
+    async def sweep(self, targets: typing.Iterable[dict]) -> \
+            typing.AsyncGenerator[network.Result, None]:
+        """Checks all `targets` at once.
+
+        `targets` are taken lazily: no more than `hosts_window` hosts are
+        checked at the same time, so `targets` may be a generator reading
+        huge input file.
+
+        Args:
+            targets: host settings, same as accepted by `network.check`.
+
+        Yields:
+            Result: results of all targets, in order they are ready.
+        """
+        if self.dedupe:
+            async for result in planner.sweep(self, targets):
+                yield result
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def worker(host_settings: dict):
+            try:
+                async for result in self.check(**host_settings):
+                    await queue.put(result)
+            except Exception as exc:
+                await queue.put(exc)
+            finally:
+                await queue.put(done)
+
+        targets = metrics.timed_iter(targets, 'read')
+        tasks: set[asyncio.Task] = set()
+        running = 0
+        try:
+            while True:
+                while running < self.hosts_window:
+                    host_settings = next(targets, None)
+                    if host_settings is None:
+                        break
+                    task = asyncio.ensure_future(worker(host_settings))
+                    task.add_done_callback(tasks.discard)
+                    tasks.add(task)
+                    running += 1
+                if not running:
+                    break
+                result = await queue.get()
+                if result is done:
+                    running -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            for task in list(tasks):
+                task.cancel()
@@ -0,0 +1,258 @@
+"""HTTP/1.1 liveness checks over kept-alive connections.
+
+`http_is_opened` opens new connection for every check, so its RTT is mostly
+handshake time and every check leaves TIME_WAIT entry. HttpPool keeps
+connections to (ip, port) and sends next checks through them:
+    1) at most `max_connections` connections per endpoint;
+    2) connection is reused only if it's healthy (not closed by server and
+       not idle for more than `idle_timeout` seconds);
+    3) connection is retired after `max_requests` requests.
+
+Check may assert response status code and body prefix. On TLS_PORTS requests
+are sent over TLS (certificate isn't verified here, it's checked separately).
+"""
+import asyncio
+import collections
+import time
+
+import network
+
+
+class HttpCheckError(Exception):
+    """Response can't be read or parsed."""
+
+
+class Connection:
+    """Kept-alive connection."""
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+        self.last_used = time.monotonic()
+
+    def healthy(self, idle_timeout: float) -> bool:
+        """Checks that connection may be used for next request."""
+        return (not self.writer.is_closing() and not self.reader.at_eof()
+                and time.monotonic() - self.last_used < idle_timeout)
+
+    def close(self):
+        self.writer.close()
+
+
+class HttpPool:
+    """Pool of kept-alive connections per endpoint.
+
+    Args:
+        max_connections (int): max connections per endpoint. Extra checks
+          wait for free connection.
+        idle_timeout (float): seconds to keep unused connection.
+        max_requests (int): requests per connection before it's closed.
+        path (str): path to request.
+        expect_status (set[int] | None): allowed status codes. None - any.
+        expect_body (bytes): required body prefix.
+
+    """
+
+    def __init__(self, max_connections: int = 2, idle_timeout: float = 30,
+                 max_requests: int = 1000, path: str = '/',
+                 expect_status: set[int] | None = None,
+                 expect_body: bytes = b''):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.path = path
+        self.expect_status = expect_status
+        self.expect_body = expect_body
+        # endpoint -> idle connections, last used is the last.
+        self._idle: dict[tuple, collections.deque[Connection]] = {}
+        # endpoint -> [semaphore, number of users].
+        self._limits: dict[tuple, list] = {}
+        self._pruned = time.monotonic()
+
+    def __len__(self):
+        """Number of idle connections."""
+        return sum(map(len, self._idle.values()))
+
+    def prune(self):
+        """Closes idle connections which can't be reused."""
+        for endpoint, idle in list(self._idle.items()):
+            for conn in list(idle):
+                if not conn.healthy(self.idle_timeout):
+                    idle.remove(conn)
+                    conn.close()
+            if not idle:
+                del self._idle[endpoint]
+        self._pruned = time.monotonic()
+
+    def close(self):
+        """Closes all idle connections."""
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+
+    def _take(self, endpoint: tuple) -> Connection | None:
+        """Returns healthy idle connection of endpoint or None."""
+        idle = self._idle.get(endpoint)
+        while idle:
+            conn = idle.pop()
+            if conn.healthy(self.idle_timeout):
+                return conn
+            conn.close()
+        return None
+
+    def _give_back(self, endpoint: tuple, conn: Connection):
+        conn.last_used = time.monotonic()
+        if conn.requests >= self.max_requests:
+            conn.close()
+            return
+        self._idle.setdefault(endpoint, collections.deque()).append(conn)
+
+    async def check(self, host: str, ip_address: str, port: int,
+                    timeout: float = 15) -> tuple[bool, float, dict]:
+        """Sends HTTP request to `ip_address` and checks response.
+
+        Args:
+            host (str): hostname for Host header and TLS SNI.
+            ip_address (str): ip address to connect to.
+            port (int): port to check.
+            timeout (float): seconds to wait for connect and response.
+
+        Returns:
+            tuple: (is alive, RTT in ms, timings in ns). RTT is time between
+              request sent and first byte of response received.
+        """
+        if time.monotonic() - self._pruned > self.idle_timeout:
+            self.prune()
+        tls = port in network.TLS_PORTS
+        endpoint = (ip_address, port, host if tls else None)
+        limit = self._limits.setdefault(
+            endpoint, [asyncio.Semaphore(self.max_connections), 0]
+        )
+        limit[1] += 1
+        try:
+            async with limit[0]:
+                return await self._check(endpoint, host, timeout)
+        finally:
+            limit[1] -= 1
+            if not limit[1]:
+                del self._limits[endpoint]
+
+    async def _check(self, endpoint: tuple, host: str,
+                     timeout: float) -> tuple[bool, float, dict]:
+        timings = {}
+        conn = self._take(endpoint)
+        # Server may close idle connection at any moment, so request through
+        # reused connection is repeated once through new one.
+        for reused in (conn is not None, False):
+            if conn is None:
+                conn = await self._connect(endpoint, host, timeout, timings)
+                if conn is None:
+                    return False, 0, timings
+            try:
+                status, body, keep_alive, first_byte = await asyncio.wait_for(
+                    self._request(conn, host), timeout
+                )
+            except asyncio.CancelledError:
+                conn.close()
+                raise
+            except (asyncio.TimeoutError, OSError, ValueError, HttpCheckError,
+                    asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                conn.close()
+                conn = None
+                if reused:
+                    continue
+                return False, 0, timings
+            break
+        timings['http_first_byte'] = first_byte
+        if keep_alive:
+            self._give_back(endpoint, conn)
+        else:
+            conn.close()
+        alive = ((self.expect_status is None or status in self.expect_status)
+                 and body.startswith(self.expect_body))
+        return alive, first_byte / 1e6, timings
+
+    @staticmethod
+    async def _connect(endpoint: tuple, host: str, timeout: float,
+                       timings: dict) -> Connection | None:
+        ip_address, port, tls_host = endpoint
+        t1 = time.perf_counter_ns()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    ip_address, port,
+                    ssl=network.unverified_context if tls_host else None,
+                    server_hostname=host if tls_host else None
+                ),
+                timeout
+            )
+        except (asyncio.TimeoutError, OverflowError, OSError):
+            return None
+        timings['connect'] = time.perf_counter_ns() - t1
+        return Connection(reader, writer)
+
+    async def _request(self, conn: Connection,
+                       host: str) -> tuple[int, bytes, bool, int]:
+        """Sends request and reads whole response.
+
+        Returns:
+            tuple: status code, body prefix, can connection be reused and
+              time to first byte in ns.
+        """
+        conn.requests += 1
+        request = (f'GET {self.path} HTTP/1.1\r\n'
+                   f'Host: {host.encode("idna").decode()}\r\n'
+                   f'User-Agent: avasite\r\n'
+                   f'Connection: keep-alive\r\n\r\n')
+        t1 = time.perf_counter_ns()
+        conn.writer.write(request.encode())
+        await conn.writer.drain()
+        first = await conn.reader.readexactly(1)
+        first_byte = time.perf_counter_ns() - t1
+        head = first + await conn.reader.readuntil(b'\r\n\r\n')
+        status_line, *lines = head.decode('latin-1').split('\r\n')
+        try:
+            version, status = status_line.split(' ', 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise HttpCheckError(f'Bad status line: {status_line!r}')
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+        keep_alive = version == 'HTTP/1.1' and \
+            headers.get('connection') != 'close'
+        body = b''
+        prefix = len(self.expect_body)
+        if status in (204, 304) or 100 <= status < 200:
+            pass
+        elif headers.get('transfer-encoding', '').endswith('chunked'):
+            while True:
+                size = int((await conn.reader.readuntil(b'\r\n'))
+                           .split(b';')[0], 16)
+                if not size:
+                    break
+                chunk = await conn.reader.readexactly(size + 2)  # With CRLF.
+                body += chunk[:min(size, max(prefix - len(body), 0))]
+            while await conn.reader.readuntil(b'\r\n') != b'\r\n':
+                pass  # Trailers.
+        elif 'content-length' in headers:
+            left = int(headers['content-length'])
+            while left:
+                chunk = await conn.reader.read(min(left, 65536))
+                if not chunk:
+                    raise HttpCheckError('Connection closed in body.')
+                left -= len(chunk)
+                body += chunk[:max(prefix - len(body), 0)]
+        else:
+            # Body ends with connection.
+            keep_alive = False
+            while len(body) < prefix:
+                chunk = await conn.reader.read(65536)
+                if not chunk:
+                    break
+                body += chunk
+        return status, body[:prefix], keep_alive, first_byte
@@ -0,0 +1,248 @@
+"""Instrumentation of checker itself.
+
+Counters and histograms of probe phases (dns, connect, tls, http first byte)
+and sweep stages (read, resolve, probe, write). All times are measured by
+monotonic clock with nanosecond resolution (time.perf_counter_ns).
+
+Instrumentation is disabled until `enable` is called, then every metric
+function is no-op. Metrics may be rendered in Prometheus text format
+(`render`), written to file (`dump`) or served on /metrics (`serve`).
+Metrics of other processes (workers, agents) are added by `take`/`merge`.
+"""
+import asyncio
+import bisect
+import contextlib
+import os
+import time
+import typing
+
+# Upper bounds of histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+
+class Counter:
+    """Monotonically increasing value per labels."""
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + value
+
+    def add(self, key: tuple, value: float):
+        """Adds value of other process (see `merge`)."""
+        self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> typing.Generator[str, None, None]:
+        for key, value in self.values.items():
+            yield f'{self.name}{_labels(key)} {value}'
+
+
+class Histogram:
+    """Distribution of values (seconds) per labels in fixed buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [0] * (len(self.buckets) + 2)
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def add(self, key: tuple, data: list[float]):
+        """Adds bucket counts and sum of other process (see `merge`)."""
+        values = self.values.get(key)
+        if values is None:
+            self.values[key] = list(data)
+        else:
+            self.values[key] = [a + b for a, b in zip(values, data)]
+
+    def render(self) -> typing.Generator[str, None, None]:
+        for key, data in self.values.items():
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), data[:-1]):
+                total += count
+                bucket_key = (*key, ('le', str(bound)))
+                yield f'{self.name}_bucket{_labels(bucket_key)} {total}'
+            yield f'{self.name}_sum{_labels(key)} {data[-1]}'
+            yield f'{self.name}_count{_labels(key)} {total}'
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ''
+    labels = ','.join(
+        f'{name}="{_escape(str(value))}"' for name, value in key
+    )
+    return '{' + labels + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+PROBES = Counter('avasite_probes_total', 'Probe results by kind and status.')
+PROBE_PHASE = Histogram('avasite_probe_phase_seconds',
+                        'Duration of probe phases.')
+SWEEP_STAGE = Counter('avasite_sweep_stage_seconds_total',
+                      'Total time spent in sweep stages.')
+SWEEP = Histogram('avasite_sweep_seconds', 'Duration of full sweeps.',
+                  buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+PLANNED = Counter('avasite_planned_probes_total',
+                  'Probes requested by targets and made after '
+                  'deduplication.')
+METRICS = (PROBES, PROBE_PHASE, SWEEP_STAGE, SWEEP, PLANNED)
+
+enabled = False
+
+
+def enable():
+    """Turns instrumentation on."""
+    global enabled
+    enabled = True
+
+
+def probe(kind: str, status: int | None,
+          timings: dict[str, int] | None = None):
+    """Counts probe result and observes its phase timings (nanoseconds)."""
+    if not enabled:
+        return
+    PROBES.inc(kind=kind, status=status)
+    for phase, duration in (timings or {}).items():
+        PROBE_PHASE.observe(duration / 1e9, phase=phase)
+
+
+def stage(name: str, duration: int):
+    """Adds `duration` (nanoseconds) to time of sweep stage."""
+    if enabled:
+        SWEEP_STAGE.inc(duration / 1e9, stage=name)
+
+
+@contextlib.contextmanager
+def stage_timer(name: str):
+    """Measures time of code block as sweep stage."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        stage(name, time.perf_counter_ns() - start)
+
+
+def timed_iter(iterable: typing.Iterable, name: str) -> typing.Iterator:
+    """Iterates `iterable`, measuring time of getting items as sweep stage."""
+    if not enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter_ns()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stage(name, time.perf_counter_ns() - start)
+            return
+        stage(name, time.perf_counter_ns() - start)
+        yield item
+
+
+def sweep(duration: int):
+    """Observes duration (nanoseconds) of full sweep."""
+    if enabled:
+        SWEEP.observe(duration / 1e9)
+
+
+def planned(requested: int, unique: int):
+    """Counts probes of probe plan."""
+    if enabled:
+        PLANNED.inc(requested, kind='requested')
+        PLANNED.inc(unique, kind='unique')
+
+
+def take() -> dict[str, list]:
+    """Returns values collected since previous call and resets them.
+
+    Worker processes and cluster agents send these deltas with their results,
+    and parent process (or coordinator) adds them to its metrics by `merge`.
+    Values may be pickled or encoded to JSON.
+    """
+    delta = {}
+    if not enabled:
+        return delta
+    for metric in METRICS:
+        if metric.values:
+            delta[metric.name] = [[[list(label) for label in key], value]
+                                  for key, value in metric.values.items()]
+            metric.values = {}
+    return delta
+
+
+def merge(delta: dict[str, list]):
+    """Adds values returned by `take` in other process."""
+    if not enabled:
+        return
+    for metric in METRICS:
+        for key, value in delta.get(metric.name, ()):
+            metric.add(tuple(tuple(label) for label in key), value)
+
+
+def render() -> str:
+    """Returns all metrics in Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path: str):
+    """Writes metrics to file (atomically, through temporary file)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write(render())
+    os.replace(tmp_path, path)
+
+
+async def serve(host: str = '127.0.0.1', port: int = 9100) -> \
+        asyncio.AbstractServer:
+    """Serves metrics on http://host:port/metrics."""
+
+    async def handle(reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            if request.split(b' ', 2)[1:2] == [b'/metrics']:
+                body = render().encode()
+                head = 'HTTP/1.0 200 OK\r\nContent-Type: text/plain; ' \
+                       'version=0.0.4\r\n'
+            else:
+                body = b'Not found\n'
+                head = 'HTTP/1.0 404 Not Found\r\n'
+            writer.write(f'{head}Content-Length: {len(body)}\r\n\r\n'.encode()
+                         + body)
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
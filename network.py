@@ -1,6 +1,9 @@
 """All network functions."""
+import asyncio
+import collections.abc
 import datetime
 import ssl
+import sys
 import time
 import socket
 import typing
@@ -10,12 +13,26 @@ import icmplib
 from contextlib import closing
 
 context = ssl.create_default_context()
+# Used only to compare certificate with already verified one.
+unverified_context = ssl.create_default_context()
+unverified_context.check_hostname = False
+unverified_context.verify_mode = ssl.CERT_NONE
 
 VALID_CERT_STRING = 'valid cert'
 INVALID_CERT_STRING = 'INVALID cert'
+NO_CERT_CHECK_STRING = 'certificate check don\'t needed'
 
+# Certificate check result codes.
+CERT_NOT_CHECKED = 0
+CERT_VALID = 1
+CERT_INVALID = 2
 
-def check_ssl_certificate(host: str, port: int) -> tuple[bool, str]:
+# Ports where TLS is spoken from the first byte.
+TLS_PORTS = frozenset({443, 465, 636, 853, 993, 995, 8443})
+
+
+def check_ssl_certificate(host: str, port: int,
+                          timeout: float = 15) -> tuple[bool, str]:
     """Checks if certificate is valid
 
     Certificate valid only if:
@@ -31,6 +48,7 @@ def check_ssl_certificate(host: str, port: int) -> tuple[bool, str]:
     Args:
         host (str): hostname to check. no protocol needed. e.g. ya.ru
         port (int): hostname to check. no protocol needed. e.g. 443
+        timeout (float): seconds to wait for connection.
 
     Returns:
         tuple: first argument - is certificate is valid, second - message string
@@ -38,12 +56,12 @@ def check_ssl_certificate(host: str, port: int) -> tuple[bool, str]:
 
     # TODO: TEMPORARY, REMOVE 2 LINES BELOW OR REMOVE THIS COMMENT :)
     if port != 443:
-        return False, 'certificate check don\'t needed'
+        return False, NO_CERT_CHECK_STRING
 
     try:
         with socket.create_connection(
                 (host, port),
-                timeout=15
+                timeout=timeout
         ) as sock:  # type: socket.socket
             with context.wrap_socket(sock, server_hostname=host) as ssock:
                 version = ssock.version()
@@ -56,20 +74,51 @@ def check_ssl_certificate(host: str, port: int) -> tuple[bool, str]:
         return False, 'cert INVALID, unable connect to server'
 
 
-def port_is_opened(host: str, port: int):
+def address_family(ip_address: str) -> socket.AddressFamily:
+    """Returns socket family of ip address (AF_INET6 or AF_INET)."""
+    return socket.AF_INET6 if ':' in ip_address else socket.AF_INET
+
+
+def interleave_families(ip_addresses: list[str]) -> list[str]:
+    """Orders addresses like RFC 8305 recommends.
+
+    IPv6 and IPv4 addresses alternate, starting with family of first address,
+    so if one family is broken, the other one is tried soon.
+    """
+    families = ([], [])
+    for ip_address in ip_addresses:
+        families[address_family(ip_address) == socket.AF_INET].append(
+            ip_address
+        )
+    first, second = families
+    if ip_addresses and address_family(ip_addresses[0]) == socket.AF_INET:
+        first, second = second, first
+    res = []
+    for idx in range(max(len(first), len(second))):
+        res.extend(family[idx] for family in (first, second)
+                   if idx < len(family))
+    return res
+
+
+def port_is_opened(host: str, port: int, timeout: float = 15):
     """Checks if port is opened
 
-    Port considered to be opened if it's responded in 15 seconds, otherwise it's
-    considered to be closed.
+    Port considered to be opened if it's responded in `timeout` seconds,
+    otherwise it's considered to be closed.
+
+    Args:
+        host (str): ip address (IPv4 or IPv6) or hostname to connect to.
+        port (int): port to check.
+        timeout (float): seconds to wait for connection.
     """
     with closing(socket.socket(
-            socket.AF_INET, socket.SOCK_STREAM)) as sock:  # type: socket.socket
+            address_family(host), socket.SOCK_STREAM)) as sock:
         try:
-            sock.settimeout(15)
-            t1 = time.time() * 1000
+            sock.settimeout(timeout)
+            t1 = time.perf_counter_ns()
             sock.connect((host, port))
-            t2 = time.time() * 1000
-            return True, t2 - t1
+            t2 = time.perf_counter_ns()
+            return True, (t2 - t1) / 1e6
         except (
                 TimeoutError,
                 socket.gaierror,
@@ -80,11 +129,11 @@ def port_is_opened(host: str, port: int):
             return False, 0
 
 
-def http_is_opened(host: str, port: int):
+def http_is_opened(host: str, port: int, timeout: float = 15):
     """Checks if port is opened and accepts HTTP requests.
 
-    Port considered to be opened if it's responded in 15 seconds, otherwise it's
-    considered to be closed.
+    Port considered to be opened if it's responded in `timeout` seconds,
+    otherwise it's considered to be closed.
     This function send VERY SIMPLE Http Request header. If we don't send it,
     most of HTTP and HTTPS servers will not respond.
     (but will accept connection)
@@ -96,16 +145,16 @@ def http_is_opened(host: str, port: int):
     """
 
     with closing(socket.socket(
-            socket.AF_INET, socket.SOCK_STREAM)) as sock:  # type: socket.socket
+            address_family(host), socket.SOCK_STREAM)) as sock:
         try:
-            sock.settimeout(15)
+            sock.settimeout(timeout)
             sock.connect((host, port))
             res = b'GET / HTTP/1.0 \r\n\r\n'
-            t1 = time.time() * 1000
+            t1 = time.perf_counter_ns()
             sock.sendall(res)
             sock.recv(1)
-            t2 = time.time() * 1000
-            return True, t2 - t1
+            t2 = time.perf_counter_ns()
+            return True, (t2 - t1) / 1e6
         except (
                 TimeoutError,
                 socket.gaierror,
@@ -116,24 +165,180 @@ def http_is_opened(host: str, port: int):
             return False, 0
 
 
+async def async_get_certificate(host: str, ip_address: str, port: int,
+                                verify: bool = True,
+                                timeout: float = 15) -> tuple[bytes, dict]:
+    """Makes TLS handshake with `ip_address` and returns its certificate.
+
+    Args:
+        host (str): hostname for SNI (and for verification).
+        ip_address (str): ip address to connect to.
+        port (int): port to connect to.
+        verify (bool): verify certificate chain and hostname. If False,
+          handshake is cheaper, but only binary certificate is returned.
+        timeout (float): seconds to wait for connection and handshake.
+
+    Returns:
+        tuple: certificate in DER form and parsed certificate
+          (parsed is empty if `verify` is False).
+
+    Raises:
+        ssl.SSLCertVerificationError: certificate is not valid.
+        ssl.SSLError, OSError, asyncio.TimeoutError: unable to connect.
+    """
+    _, writer = await asyncio.wait_for(
+        asyncio.open_connection(
+            ip_address, port,
+            ssl=context if verify else unverified_context,
+            server_hostname=host
+        ),
+        timeout
+    )
+    ssl_object: ssl.SSLObject = writer.get_extra_info('ssl_object')
+    try:
+        return ssl_object.getpeercert(True), ssl_object.getpeercert()
+    finally:
+        await _close_writer(writer)
+
+
+async def async_port_is_opened(host: str, port: int, timeout: float = 15):
+    """Async version of `port_is_opened`.
+
+    Port considered to be opened if it's responded in `timeout` seconds,
+    otherwise it's considered to be closed.
+    """
+    try:
+        t1 = time.perf_counter_ns()
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout
+        )
+        t2 = time.perf_counter_ns()
+    except (asyncio.TimeoutError, OverflowError, OSError):
+        return False, 0
+    await _close_writer(writer)
+    return True, (t2 - t1) / 1e6
+
+
+async def async_first_connect(ip_addresses: list[str], port: int,
+                              timeout: float = 15, delay: float = 0.25) -> \
+        tuple[str | None, float]:
+    """Connects to first reachable address ("happy eyeballs", RFC 8305).
+
+    Attempts are started one by one every `delay` seconds (or right after
+    previous attempt failed) and work in parallel. First successful attempt
+    wins, others are cancelled.
+
+    Args:
+        ip_addresses (list[str]): addresses in order to try them.
+        port (int): port to connect to.
+        timeout (float): timeout of every attempt.
+        delay (float): delay between attempts start.
+
+    Returns:
+        tuple: winner ip address and its connect RTT. (None, 0) if no address
+          is reachable.
+    """
+
+    async def attempt(ip_address: str):
+        opened, rtt = await async_port_is_opened(ip_address, port, timeout)
+        return ip_address if opened else None, rtt
+
+    pending = set()
+    try:
+        for ip_address in ip_addresses:
+            pending.add(asyncio.ensure_future(attempt(ip_address)))
+            done, pending = await asyncio.wait(
+                pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.result()[0] is not None:
+                    return task.result()
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.result()[0] is not None:
+                    return task.result()
+        return None, 0
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def async_http_is_opened(host: str, port: int, timeout: float = 15):
+    """Async version of `http_is_opened`.
+
+    RTT is calculated like time between first byte sent and first byte
+    received, same as in sync version.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout
+        )
+    except (asyncio.TimeoutError, OverflowError, OSError):
+        return False, 0
+    try:
+        t1 = time.perf_counter_ns()
+        writer.write(b'GET / HTTP/1.0 \r\n\r\n')
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(1), timeout)
+        t2 = time.perf_counter_ns()
+    except (asyncio.TimeoutError, OSError):
+        return False, 0
+    finally:
+        await _close_writer(writer)
+    if not data:
+        return False, 0
+    return True, (t2 - t1) / 1e6
+
+
+async def async_multiping(ip_addresses: list[str],
+                          concurrent_tasks: int = 500) -> \
+        dict[str, icmplib.Host]:
+    """Pings all `ip_addresses` at once.
+
+    Every address is pinged by 3 packets, all addresses together, so
+    thousands of addresses take few seconds, not few seconds each.
+
+    Returns:
+        dict: ip address -> ping result.
+    """
+    hosts = await icmplib.async_multiping(
+        ip_addresses, count=3, concurrent_tasks=concurrent_tasks
+    )
+    return dict(zip(ip_addresses, hosts))
+
+
+async def _close_writer(writer: asyncio.StreamWriter):
+    """Closes stream writer, ignoring errors of already broken connections."""
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+
+
 def get_ips_from_hostname(hostname: str):
-    """Returns ip addresses of hostname.
+    """Returns ip addresses (IPv4 and IPv6) of hostname.
 
-    Can resolve only IPv4 addresses, but it's all we need
+    Addresses are ordered by `interleave_families`.
 
     Args:
         hostname (str): hostname to check. no protocol needed. e.g. ya.ru
     """
     try:
-        # in some cases (127.0.0.1 for example) may be returned twice.
-        # fixed it by list/set/list trick
-        return list(set(socket.gethostbyname_ex(hostname)[-1]))
-    except socket.gaierror:
+        infos = socket.getaddrinfo(hostname, None, socket.AF_UNSPEC,
+                                   socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
         return []
+    # in some cases (127.0.0.1 for example) may be returned twice.
+    return interleave_families(
+        list(dict.fromkeys(info[4][0] for info in infos))
+    )
 
 
-class CheckResult(typing.TypedDict):
-    """Type definition for `check` function result. (for IDE code completion)"""
+class _RequiredCheckResult(typing.TypedDict):
     time: datetime.datetime
     host: str
     ip: str | None
@@ -143,8 +348,272 @@ class CheckResult(typing.TypedDict):
     ssl_cert: list[bool, str] | None
 
 
+class CheckResult(_RequiredCheckResult, total=False):
+    """Type definition for `check` function result. (for IDE code completion)
+
+    Checks return compact `Result`, which is a mapping of this type.
+
+    `timings` - optional durations of probe phases in nanoseconds
+    (dns, connect, tls, http_first_byte), measured by monotonic clock.
+    `circuit` - 'open' if target is down and wasn't probed, 'recheck' if it
+    was down and was probed with short timeout (see `breaker`).
+    """
+    timings: dict[str, int]
+    circuit: str
+
+
+def cert_code(ssl_cert: tuple[bool, str] | None) -> int | None:
+    """Converts `CheckResult` ssl_cert to CERT_* code (None if no cert)."""
+    if ssl_cert is None:
+        return None
+    if not ssl_cert or ssl_cert[1] == NO_CERT_CHECK_STRING:
+        return CERT_NOT_CHECKED
+    return CERT_VALID if ssl_cert[0] else CERT_INVALID
+
+
+class Result(collections.abc.MutableMapping):
+    """Compact check result.
+
+    Results are made for every probe, so instead of dict with datetime and
+    certificate tuple it keeps only slots: time in epoch nanoseconds,
+    interned host and ip, status and CERT_* code. Certificate message is one
+    of constant strings in most cases, so it isn't copied too.
+
+    It's also a mapping with same keys as `CheckResult` (`time` is datetime,
+    `ssl_cert` is (valid, message) tuple), so code which works with dicts
+    works with it. `timings` and `circuit` are in it only if they are set.
+    """
+    __slots__ = ('time_ns', 'host', 'ip', 'rtt', 'port', 'status', 'cert',
+                 'cert_message', 'timings', 'circuit')
+    KEYS = ('time', 'host', 'ip', 'rtt', 'port', 'status', 'ssl_cert',
+            'timings', 'circuit')
+    OPTIONAL = frozenset({'timings', 'circuit'})
+
+    def __init__(self, host: str, ip: str | None, rtt: float,
+                 port: int | None, status: int | None,
+                 ssl_cert: tuple[bool, str] | None = None,
+                 timings: dict[str, int] | None = None,
+                 circuit: str | None = None, time_ns: int | None = None):
+        self.time_ns = time.time_ns() if time_ns is None else time_ns
+        self.host = sys.intern(host)
+        self.ip = ip if ip is None else sys.intern(ip)
+        self.rtt = rtt
+        self.port = port
+        self.status = status
+        self.ssl_cert = ssl_cert
+        self.timings = timings
+        self.circuit = circuit
+
+    @classmethod
+    def from_dict(cls, result: CheckResult) -> 'Result':
+        """Makes compact result of `CheckResult` dict."""
+        if isinstance(result, cls):
+            return result
+        moment = result.get('time')
+        return cls(
+            result['host'], result.get('ip'), result.get('rtt') or 0,
+            result.get('port'), result.get('status'),
+            result.get('ssl_cert'), result.get('timings'),
+            result.get('circuit'),
+            None if moment is None else
+            int(moment.timestamp()) * 10 ** 9 + moment.microsecond * 1000
+        )
+
+    def copy(self, **changes) -> 'Result':
+        """Returns copy of result with `changes` of slots applied."""
+        res = Result.__new__(Result)
+        for name in self.__slots__:
+            setattr(res, name, getattr(self, name))
+        for name, value in changes.items():
+            setattr(res, name, value)
+        return res
+
+    @property
+    def time(self) -> datetime.datetime:
+        """Time of result as local naive datetime (like `datetime.now()`)."""
+        seconds, nanoseconds = divmod(self.time_ns, 10 ** 9)
+        return datetime.datetime.fromtimestamp(seconds).replace(
+            microsecond=nanoseconds // 1000
+        )
+
+    @time.setter
+    def time(self, moment: datetime.datetime):
+        self.time_ns = int(moment.timestamp()) * 10 ** 9 + \
+            moment.microsecond * 1000
+
+    @property
+    def ssl_cert(self) -> tuple[bool, str] | None:
+        if self.cert is None:
+            return None
+        return self.cert == CERT_VALID, self.cert_message
+
+    @ssl_cert.setter
+    def ssl_cert(self, ssl_cert: tuple[bool, str] | None):
+        self.cert = cert_code(ssl_cert)
+        self.cert_message = ssl_cert[1] if ssl_cert else None
+
+    def __getitem__(self, key: str):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None and key in self.OPTIONAL:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default=None):
+        if key not in self.KEYS:
+            return default
+        value = getattr(self, key)
+        return default if value is None and key in self.OPTIONAL else value
+
+    def __setitem__(self, key: str, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        if key not in self.OPTIONAL or getattr(self, key) is None:
+            raise KeyError(key)
+        setattr(self, key, None)
+
+    def __iter__(self):
+        return (key for key in self.KEYS
+                if key not in self.OPTIONAL or getattr(self, key) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_tuple(self) -> tuple:
+        """Returns values of slots (compact form to send result)."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, values: typing.Sequence) -> 'Result':
+        """Makes result of `to_tuple` values."""
+        res = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(res, name, value)
+        res.host = sys.intern(res.host)
+        if res.ip is not None:
+            res.ip = sys.intern(res.ip)
+        return res
+
+    def __reduce__(self):
+        # Compact pickle for results sent between processes.
+        return Result.from_tuple, (self.to_tuple(),)
+
+    def __repr__(self):
+        return f'Result({dict(self)!r})'
+
+
+async def async_probe(host: str, ip_address: str, port: int,
+                      http: bool = False, timeout: float = 15,
+                      cert_cache=None) -> Result:
+    """Checks port, certificate and (optionally) HTTP in one connection.
+
+    `check` uses one connection for certificate and one more for every port
+    (and `http_is_opened` would open one more). This probe makes only one
+    TCP handshake:
+        1) connects to `ip_address` and measures connect RTT;
+        2) if `port` is one of TLS_PORTS, makes TLS handshake in the same
+           connection and checks certificate of `host`;
+        3) if `http` is True, sends simple HTTP request and waits for first
+           byte of response. Port considered closed if server doesn't respond.
+
+    Args:
+        host (str): hostname, used for certificate check and HTTP request.
+        ip_address (str): ip address to connect to.
+        port (int): port to check.
+        http (bool): check that port accepts HTTP requests.
+        timeout (float): seconds to wait for every step.
+        cert_cache (certcache.CertCache): if provided and certificate was
+          already verified, handshake is made without verification and
+          certificate is only compared with cached one.
+
+    Returns:
+        Result: result with all fields filled.
+    """
+    result = Result(host, ip_address, 0, port, 0,
+                    (False, NO_CERT_CHECK_STRING), {})
+    timings = result.timings
+    loop = asyncio.get_running_loop()
+    try:
+        sock = socket.socket(address_family(ip_address), socket.SOCK_STREAM)
+    except OSError:
+        return result
+    sock.setblocking(False)
+    try:
+        t1 = time.perf_counter_ns()
+        await asyncio.wait_for(loop.sock_connect(sock, (ip_address, port)),
+                               timeout)
+        t2 = time.perf_counter_ns()
+    except (asyncio.TimeoutError, OverflowError, OSError):
+        sock.close()
+        return result
+    timings['connect'] = t2 - t1
+    result.rtt = (t2 - t1) / 1e6
+    result.status = 1
+    tls = port in TLS_PORTS
+    cached = (tls and cert_cache is not None and
+              cert_cache.lookup(host, port, ip_address) is not None)
+    ssl_context = unverified_context if cached else context
+    try:
+        t1 = time.perf_counter_ns()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                sock=sock,
+                ssl=ssl_context if tls else None,
+                server_hostname=host if tls else None
+            ),
+            timeout
+        )
+        if tls:
+            timings['tls'] = time.perf_counter_ns() - t1
+    except ssl.SSLCertVerificationError as exc:
+        sock.close()
+        result.ssl_cert = (False, exc.verify_message or INVALID_CERT_STRING)
+        return result
+    except (asyncio.TimeoutError, ssl.SSLError, OSError):
+        sock.close()
+        if tls:
+            result.ssl_cert = (False, INVALID_CERT_STRING)
+        return result
+    try:
+        if tls:
+            ssl_object: ssl.SSLObject = writer.get_extra_info('ssl_object')
+            der = ssl_object.getpeercert(True)
+            if cached:
+                verified = cert_cache.confirm(host, port, ip_address, der)
+                if verified is None:  # Certificate changed, check it fully.
+                    verified = await cert_cache.check(
+                        host, port, ip_address, timeout
+                    )
+                result.ssl_cert = verified
+            else:
+                if cert_cache is not None:
+                    cert_cache.store(
+                        host, port, ip_address, der, ssl_object.getpeercert()
+                    )
+                result.ssl_cert = (True, VALID_CERT_STRING)
+        if http:
+            t1 = time.perf_counter_ns()
+            writer.write(
+                b'GET / HTTP/1.0\r\nHost: ' + host.encode('idna') +
+                b'\r\n\r\n'
+            )
+            await writer.drain()
+            if not await asyncio.wait_for(reader.read(1), timeout):
+                result.status = 0
+            timings['http_first_byte'] = time.perf_counter_ns() - t1
+    except (asyncio.TimeoutError, ssl.SSLError, OSError, UnicodeError):
+        result.status = 0
+    finally:
+        await _close_writer(writer)
+    return result
+
+
 def check(host: str, ports: list[int], **_) -> \
-        typing.Generator[CheckResult, None, None]:
+        typing.Generator[Result, None, None]:
     """Main check for host availability
 
     Checks all resolved ips. This function works like generator, for app not
@@ -163,48 +632,26 @@ def check(host: str, ports: list[int], **_) -> \
         ports (list[int]): list of ports to check on provided host.
 
     Yields:
-        CheckResult: list of check results for
+        Result: list of check results for
           all resolved ip/port pairs
 
     """
     ip_addresses = get_ips_from_hostname(host)
     if not ip_addresses:
         for port in ports:
-            yield {
-                'time': datetime.datetime.now(),
-                'host': host,
-                'ip': None,
-                'rtt': 0,
-                'port': port,
-                'status': 0,
-                'ssl_cert': None
-            }
+            yield Result(host, None, 0, port, 0)
             return
     cert_info = check_ssl_certificate(host, 443 if ports and 443 in ports else 80)
     for ip_address in ip_addresses:
         if not ports:
             ping_result = icmplib.ping(ip_address, count=3)
-            yield {
-                'time': datetime.datetime.now(),
-                'host': host,
-                'ip': ip_address,
-                'rtt': ping_result.avg_rtt,
-                'port': None,
-                'status': None if ping_result.is_alive else 0,
-                'ssl_cert': cert_info
-            }
+            yield Result(host, ip_address, ping_result.avg_rtt, None,
+                         None if ping_result.is_alive else 0, cert_info)
             continue
         for port in ports:
-            opened, rtt = port_is_opened(host, port)
-            yield {
-                'time': datetime.datetime.now(),
-                'host': host,
-                'ip': ip_address,
-                'rtt': rtt,
-                'port': port,
-                'status': int(opened),
-                'ssl_cert': cert_info
-            }
+            opened, rtt = port_is_opened(ip_address, port)
+            yield Result(host, ip_address, rtt, port, int(opened),
+                         cert_info)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+"""Probe plan: every endpoint is probed once per iteration.
+
+Inventories often have same host several times, or different hostnames
+behind same ips (CDNs, load balancers) with overlapping ports. Without plan
+every (host, ip, port) is probed separately. Plan resolves all targets first
+and indexes them by probe they need:
+    port probe   - (ip, port). With `http` or `combined` response depends on
+                   hostname (Host header, SNI), so hostname is part of key;
+    ping         - ip;
+    first success - (all ips of host, port).
+Every probe is made once and its result is copied to every target which asked
+for it, so results are the same as without plan.
+"""
+import asyncio
+import time
+import typing
+
+import metrics
+import network
+
+
+class ProbePlan:
+    """Unique probes of iteration and targets which requested them.
+
+    Attributes:
+        probes (dict): probe key -> [(host, certificate key)] of targets
+          which requested it. Certificate key is None if probe checks
+          certificate itself (`combined`).
+        unresolved (list): (host, port) of targets without ip addresses.
+        requested (int): number of probes before deduplication.
+
+    """
+
+    def __init__(self):
+        self.probes: dict[tuple, list[tuple[str, tuple | None]]] = {}
+        self.unresolved: list[tuple[str, int]] = []
+        self.requested = 0
+
+    def __len__(self):
+        return len(self.probes)
+
+    def _add(self, key: tuple, host: str, cert_key: tuple | None):
+        self.requested += 1
+        self.probes.setdefault(key, []).append((host, cert_key))
+
+    @classmethod
+    def build(cls, targets: typing.Iterable[dict],
+              answers: dict[str, list[str]], check_engine) -> 'ProbePlan':
+        """Makes plan of targets.
+
+        Args:
+            targets: host settings, same as accepted by `Engine.check`.
+            answers: ip addresses of every host.
+            check_engine (engine.Engine): engine, which makes probes.
+        """
+        plan = cls()
+        by_host = check_engine.http or check_engine.combined
+        first_success = check_engine.first_success and not check_engine.http
+        for target in targets:
+            host, ports = target['host'], target['ports']
+            ip_addresses = answers.get(host) or []
+            if not ip_addresses:
+                plan.unresolved.extend((host, port) for port in ports)
+                continue
+            # Same certificate check as `Engine.check` makes.
+            cert_key = None if ports and check_engine.combined else \
+                (host, ip_addresses[0], 443 if 443 in ports else 80)
+            if not ports:
+                for ip_address in ip_addresses:
+                    plan._add(('ping', ip_address), host, cert_key)
+            elif first_success:
+                for port in ports:
+                    plan._add(('first', tuple(ip_addresses), port), host,
+                              cert_key)
+            else:
+                for ip_address in ip_addresses:
+                    for port in ports:
+                        plan._add(('port', ip_address, port,
+                                   host if by_host else None),
+                                  host, cert_key)
+        return plan
+
+
+async def _probe(check_engine, key: tuple,
+                 host: str) -> network.Result:
+    """Makes probe of plan. `host` is one of hosts which requested it."""
+    match key:
+        case ('ping', ip_address):
+            return await check_engine._ping_result(host, ip_address, None)
+        case ('first', ip_addresses, port):
+            return await check_engine._first_success_result(
+                host, list(ip_addresses), port, None
+            )
+        case (_, ip_address, port, _) if check_engine.combined:
+            return await check_engine._probe_result(host, ip_address, port)
+        case (_, ip_address, port, _):
+            return await check_engine._port_result(host, ip_address, port,
+                                                   None)
+
+
+async def sweep(check_engine, targets: typing.Iterable[dict]) -> \
+        typing.AsyncGenerator[network.Result, None]:
+    """Same as `Engine.sweep`, but by probe plan.
+
+    All targets are read and resolved before probes are started. No more
+    than `hosts_window` probes are made at the same time.
+    """
+    targets = list(metrics.timed_iter(targets, 'read'))
+    start = time.perf_counter_ns()
+    answers = await check_engine.resolver.resolve_many(
+        target['host'] for target in targets
+    )
+    dns = time.perf_counter_ns() - start
+    metrics.stage('resolve', dns)
+    plan = ProbePlan.build(targets, answers, check_engine)
+    metrics.planned(plan.requested, len(plan))
+    del targets, answers
+    for host, port in plan.unresolved:
+        yield check_engine._finish(
+            check_engine._unresolved_result(host, port), dns
+        )
+    certs: dict[tuple, asyncio.Task] = {}
+
+    def start_probe(key: tuple, requesters: list) -> asyncio.Task:
+        for host, cert_key in requesters:
+            if cert_key is not None and cert_key not in certs:
+                certs[cert_key] = asyncio.ensure_future(
+                    check_engine._cert(*cert_key)
+                )
+        return asyncio.ensure_future(_probe(check_engine, key,
+                                            requesters[0][0]))
+
+    probes = iter(plan.probes.items())
+    running: dict[asyncio.Task, list] = {}
+    try:
+        while True:
+            while len(running) < check_engine.hosts_window:
+                item = next(probes, None)
+                if item is None:
+                    break
+                running[start_probe(*item)] = item[1]
+            if not running:
+                break
+            done, _ = await asyncio.wait(running,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                requesters = running.pop(task)
+                result = task.result()
+                for host, cert_key in requesters:
+                    copy = result.copy(host=host,
+                                       timings=dict(result.timings or {}))
+                    if cert_key is not None:
+                        copy.ssl_cert = await certs[cert_key]
+                    yield check_engine._finish(copy, dns)
+    finally:
+        for task in [*running, *certs.values()]:
+            task.cancel()
@@ -0,0 +1,151 @@
+"""Hostname resolution with cache.
+
+Names almost never change, but without cache every iteration resolves every
+host again. Resolver keeps answers for their TTL, keeps failed answers for
+shorter time and runs many lookups in parallel without blocking event loop.
+
+If `dnspython` is installed, real record TTLs are used. Otherwise (or if DNS
+doesn't know the name) system resolver (getaddrinfo) is used. It doesn't tell
+TTL, so `ttl` is used as is.
+
+Both A and AAAA records are resolved. Addresses are ordered by
+`network.interleave_families`.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import ipaddress
+import socket
+import time
+
+import network
+
+try:
+    import dns.asyncresolver
+    import dns.exception
+except ImportError:  # dnspython is optional.
+    dns = None
+
+
+class Resolver:
+    """Async resolver with TTL-honoring LRU cache.
+
+    Args:
+        ttl (float): max seconds to keep answer. Used as is if record TTL
+          is unknown.
+        negative_ttl (float): seconds to keep "not resolved" answer.
+        max_entries (int): max cached hostnames. Least recently used
+          hostnames are evicted first.
+        workers (int): max parallel lookups in system resolver.
+
+    """
+
+    def __init__(self, ttl: float = 300, negative_ttl: float = 30,
+                 max_entries: int = 10000, workers: int = 64):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._workers = workers
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+        # hostname -> (expiration time, list of ips)
+        self._cache: collections.OrderedDict[str, tuple[float, list[str]]] = \
+            collections.OrderedDict()
+        # hostname -> lookup in progress. Same name is resolved only once.
+        self._pending: dict[str, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get_cached(self, hostname: str) -> list[str] | None:
+        """Returns cached not expired answer or None."""
+        cached = self._cache.get(hostname)
+        if cached is None:
+            return None
+        if cached[0] < time.monotonic():
+            del self._cache[hostname]
+            return None
+        self._cache.move_to_end(hostname)
+        return cached[1]
+
+    def put(self, hostname: str, ips: list[str], ttl: float | None = None):
+        """Puts answer in cache. Empty answer is kept for `negative_ttl`."""
+        if not ips:
+            ttl = self.negative_ttl
+        elif ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        self._cache[hostname] = (time.monotonic() + ttl, ips)
+        self._cache.move_to_end(hostname)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def resolve(self, hostname: str) -> list[str]:
+        """Returns ip addresses of hostname, same as
+        `network.get_ips_from_hostname`, but from cache if possible."""
+        try:
+            # Ip address doesn't need resolving (and caching).
+            return [str(ipaddress.ip_address(hostname))]
+        except ValueError:
+            pass
+        cached = self.get_cached(hostname)
+        if cached is not None:
+            return cached
+        future = self._pending.get(hostname)
+        if future is None:
+            future = asyncio.ensure_future(self._lookup(hostname))
+            self._pending[hostname] = future
+            future.add_done_callback(
+                lambda done: self._lookup_done(hostname, done)
+            )
+        ips, _ = await asyncio.shield(future)
+        return ips
+
+    def _lookup_done(self, hostname: str, future: asyncio.Future):
+        self._pending.pop(hostname, None)
+        if not future.cancelled() and future.exception() is None:
+            self.put(hostname, *future.result())
+
+    async def resolve_many(self, hostnames) -> dict[str, list[str]]:
+        """Resolves all `hostnames` in parallel."""
+        hostnames = list(dict.fromkeys(hostnames))
+        answers = await asyncio.gather(
+            *(self.resolve(hostname) for hostname in hostnames)
+        )
+        return dict(zip(hostnames, answers))
+
+    async def _lookup(self, hostname: str) -> tuple[list[str], float | None]:
+        """Makes real lookup. Returns ips and TTL (None if unknown)."""
+        if dns is not None:
+            answers = await asyncio.gather(
+                *(dns.asyncresolver.resolve(hostname, record_type)
+                  for record_type in ('AAAA', 'A')),
+                return_exceptions=True
+            )
+            ips, ttls = [], []
+            for answer in answers:
+                if isinstance(answer, dns.exception.DNSException):
+                    continue  # No records of this type.
+                if isinstance(answer, BaseException):
+                    raise answer
+                ips.extend(record.address for record in answer)
+                ttls.append(answer.rrset.ttl)
+            if ips:
+                return network.interleave_families(
+                    list(dict.fromkeys(ips))
+                ), min(ttls)
+            # Maybe name is known only locally (/etc/hosts for example).
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._workers, thread_name_prefix='resolver'
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.run_in_executor(
+                self._executor, socket.getaddrinfo,
+                hostname, None, socket.AF_UNSPEC, socket.SOCK_STREAM
+            )
+        except (socket.gaierror, UnicodeError):
+            return [], None
+        # in some cases (127.0.0.1 for example) may be returned twice.
+        return network.interleave_families(
+            list(dict.fromkeys(info[4][0] for info in infos))
+        ), None
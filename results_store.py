@@ -0,0 +1,250 @@
+"""Compact binary storage of check results history.
+
+Results are appended by batches (one or more per iteration). Every batch is
+stored by columns of fixed-width values:
+
+    time     int64    epoch nanoseconds
+    host     uint32   id of host in hosts file (`<path>.hosts`, line number)
+    ip       uint32   packed IPv4 address (0 if not resolved or not IPv4)
+    port     uint16   0 if no port
+    status   int8     STATUS_* code
+    cert     int8     CERT_* code
+    circuit  int8     CIRCUIT_* code (state of circuit breaker)
+    rtt      float32  ms
+
+So one result takes 25 bytes. Batch header keeps min and max time, so range
+scans skip batches without reading them. File is read through mmap.
+"""
+import array
+import bisect
+import ipaddress
+import itertools
+import mmap
+import os
+import struct
+import sys
+import typing
+
+import breaker
+import network
+
+MAGIC = b'AVRS0002'
+BATCH_MAGIC = b'BTCH'
+BATCH_HEADER = struct.Struct('<4sIqq')  # magic, count, min time, max time.
+# (name, array typecode) in order they are stored.
+COLUMNS = (
+    ('time', 'q'),
+    ('host', 'I'),
+    ('ip', 'I'),
+    ('port', 'H'),
+    ('status', 'b'),
+    ('cert', 'b'),
+    ('circuit', 'b'),
+    ('rtt', 'f'),
+)
+RECORD_SIZE = sum(array.array(code).itemsize for _, code in COLUMNS)
+
+STATUS_CLOSED = 0
+STATUS_OPENED = 1
+STATUS_PINGABLE = 2
+
+CERT_NOT_CHECKED = network.CERT_NOT_CHECKED
+CERT_VALID = network.CERT_VALID
+CERT_INVALID = network.CERT_INVALID
+
+CIRCUIT_CLOSED = 0
+CIRCUIT_OPEN = 1
+CIRCUIT_RECHECK = 2
+CIRCUITS = {None: CIRCUIT_CLOSED, breaker.OPEN: CIRCUIT_OPEN,
+            breaker.RECHECK: CIRCUIT_RECHECK}
+
+
+def status_code(status: int | None) -> int:
+    """Converts `CheckResult` status to STATUS_* code."""
+    return STATUS_PINGABLE if status is None else int(status)
+
+
+def circuit_code(circuit: str | None) -> int:
+    """Converts `CheckResult` circuit to CIRCUIT_* code."""
+    return CIRCUITS.get(circuit, CIRCUIT_CLOSED)
+
+
+def pack_ip(ip: str | None) -> int:
+    """Returns IPv4 address as int. 0 for None and not IPv4 addresses."""
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except ValueError:
+        return 0
+
+
+class ResultStore:
+    """Append-only columnar store of check results.
+
+    Results may be appended by `append` (one batch) or by `add`, which
+    collects results and appends them by batches of `batch_size` (and on
+    `flush`).
+
+    Args:
+        path (str): data file path. Hosts are stored in `<path>.hosts`.
+        batch_size (int): max results in batch collected by `add`.
+
+    """
+
+    def __init__(self, path: str, batch_size: int = 65536):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: list[network.CheckResult] = []
+        self.hosts_path = path + '.hosts'
+        self._hosts: list[str] = []
+        self._host_ids: dict[str, int] = {}
+        # (offset, count, min time, max time) of every batch.
+        self._batches: list[tuple[int, int, int, int]] = []
+        if os.path.exists(self.hosts_path):
+            with open(self.hosts_path, encoding='utf-8') as file:
+                for line in file:
+                    self._intern(line.rstrip('\n'))
+        if not os.path.exists(path) or not os.path.getsize(path):
+            with open(path, 'wb') as file:
+                file.write(MAGIC)
+        self._load_index()
+
+    def _intern(self, host: str) -> int:
+        host_id = self._host_ids.get(host)
+        if host_id is None:
+            host_id = self._host_ids[host] = len(self._hosts)
+            self._hosts.append(host)
+        return host_id
+
+    def _load_index(self):
+        """Reads batch headers of data file."""
+        with open(self.path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{self.path} is not results store file.')
+            offset = len(MAGIC)
+            while offset + BATCH_HEADER.size <= len(data):
+                magic, count, min_time, max_time = \
+                    BATCH_HEADER.unpack_from(data, offset)
+                end = offset + BATCH_HEADER.size + count * RECORD_SIZE
+                if magic != BATCH_MAGIC or end > len(data):
+                    break  # Not completely written batch.
+                self._batches.append((offset, count, min_time, max_time))
+                offset = end
+
+    def append(self, results: typing.Iterable[network.CheckResult]):
+        """Appends results as one batch."""
+        columns = {name: array.array(code) for name, code in COLUMNS}
+        new_hosts = []
+        for result in map(network.Result.from_dict, results):
+            host = result.host or ''
+            if host not in self._host_ids:
+                new_hosts.append(host)
+            columns['time'].append(result.time_ns)
+            columns['host'].append(self._intern(host))
+            columns['ip'].append(pack_ip(result.ip))
+            port = result.port or 0
+            columns['port'].append(port if 0 <= port <= 65535 else 0)
+            columns['status'].append(status_code(result.status))
+            columns['cert'].append(result.cert or CERT_NOT_CHECKED)
+            columns['circuit'].append(circuit_code(result.circuit))
+            columns['rtt'].append(result.rtt or 0)
+        count = len(columns['time'])
+        if not count:
+            return
+        if new_hosts:
+            with open(self.hosts_path, 'a', encoding='utf-8') as file:
+                file.writelines(host + '\n' for host in new_hosts)
+        header = BATCH_HEADER.pack(BATCH_MAGIC, count, min(columns['time']),
+                                   max(columns['time']))
+        with open(self.path, 'ab') as file:
+            offset = file.tell()
+            file.write(header)
+            for name, _ in COLUMNS:
+                if sys.byteorder == 'big':
+                    columns[name].byteswap()
+                file.write(columns[name].tobytes())
+        self._batches.append((offset, count, min(columns['time']),
+                              max(columns['time'])))
+
+    def add(self, result: network.CheckResult):
+        """Adds result to current batch."""
+        self._pending.append(result)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Appends current batch."""
+        pending, self._pending = self._pending, []
+        self.append(pending)
+
+    def scan(self, start: int = 0, end: int | None = None,
+             host: str | None = None) -> typing.Generator[dict, None, None]:
+        """Yields stored results with start <= time < end.
+
+        Args:
+            start (int): epoch nanoseconds.
+            end (int | None): epoch nanoseconds. None means no limit.
+            host (str | None): return only results of this host.
+
+        Yields:
+            dict: record with `time` (epoch ns), `host`, `ip`, `port`,
+              `status`, `cert`, `circuit` and `rtt`.
+        """
+        end = sys.maxsize if end is None else end
+        host_id = self._host_ids.get(host, -1) if host is not None else None
+        # Batches are mostly appended by time, but results of workers and
+        # agents may come late or with skewed clock. Batches before the
+        # first one with running max time >= start are old anyway.
+        first = bisect.bisect_left(
+            list(itertools.accumulate((batch[3] for batch in self._batches),
+                                      max)),
+            start
+        )
+        with open(self.path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, count, min_time, max_time in self._batches[first:]:
+                if max_time < start or min_time >= end:
+                    continue
+                columns = self._read_columns(data, offset, count)
+                for idx in range(count):
+                    stamp = columns['time'][idx]
+                    if not start <= stamp < end:
+                        continue
+                    if host_id is not None and \
+                            columns['host'][idx] != host_id:
+                        continue
+                    ip = columns['ip'][idx]
+                    yield {
+                        'time': stamp,
+                        'host': self._hosts[columns['host'][idx]],
+                        'ip': str(ipaddress.IPv4Address(ip)) if ip else None,
+                        'port': columns['port'][idx] or None,
+                        'status': columns['status'][idx],
+                        'cert': columns['cert'][idx],
+                        'circuit': columns['circuit'][idx],
+                        'rtt': columns['rtt'][idx],
+                    }
+
+    @staticmethod
+    def _read_columns(data: mmap.mmap, offset: int,
+                      count: int) -> dict[str, array.array]:
+        columns = {}
+        offset += BATCH_HEADER.size
+        for name, code in COLUMNS:
+            column = array.array(code)
+            size = column.itemsize * count
+            column.frombytes(data[offset:offset + size])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns[name] = column
+            offset += size
+        return columns
+
+    def __len__(self):
+        return sum(batch[1] for batch in self._batches)
+
+
+if __name__ == '__main__':
+    # Dumps store file: python results_store.py results.bin
+    for record in ResultStore(sys.argv[1]).scan():
+        print(record)
@@ -0,0 +1,187 @@
+"""Adaptive per-host check scheduler.
+
+Instead of checking all hosts and sleeping --period, every host has its own
+interval (from input or --period) and is checked on fixed schedule (slow check
+doesn't shift next checks). Start times are spread over interval to avoid
+checking everything at the same moment.
+
+Interval adapts to host state:
+    1) after failure host is checked more often (`failure_factor`);
+    2) while host state doesn't change, interval grows (`stable_factor`)
+       up to `max_factor` of its base interval;
+    3) any change returns interval to base one.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import random
+import time
+import typing
+
+import network
+
+
+def target_key(target: dict) -> tuple:
+    """Returns key to identify target in scheduler."""
+    return target['host'], tuple(target['ports'])
+
+
+class ScheduledTarget:
+    """State of target in scheduler."""
+
+    def __init__(self, target: dict, base_interval: float):
+        self.target = target
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.due = 0.0
+        self.seq = 0  # Increased on every push. Old heap entries are ignored.
+        self.signature = None  # State of last check.
+
+
+class Scheduler:
+    """Priority queue of targets ordered by next check time.
+
+    Args:
+        default_interval (float): interval of targets without own interval.
+        min_interval (float): interval never becomes less than this.
+        failure_factor (float): interval multiplier after failure.
+        stable_factor (float): interval multiplier after check without
+          changes.
+        max_factor (float): interval never becomes more than base interval
+          multiplied by this.
+
+    """
+
+    def __init__(self, default_interval: float, min_interval: float = 1,
+                 failure_factor: float = 0.25, stable_factor: float = 1.5,
+                 max_factor: float = 4):
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.failure_factor = failure_factor
+        self.stable_factor = stable_factor
+        self.max_factor = max_factor
+        self._targets: dict[tuple, ScheduledTarget] = {}
+        self._heap: list[tuple[float, int, tuple]] = []
+        self._counter = itertools.count()
+        self._changed: asyncio.Event | None = None
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __contains__(self, key: tuple):
+        return key in self._targets
+
+    def _push(self, key: tuple, entry: ScheduledTarget, due: float):
+        entry.due = due
+        entry.seq = next(self._counter)
+        heapq.heappush(self._heap, (due, entry.seq, key))
+        if self._changed is not None:
+            self._changed.set()
+
+    def add(self, target: dict):
+        """Adds target. First check is at random moment of its interval."""
+        key = target_key(target)
+        interval = max(target.get('interval') or self.default_interval,
+                       self.min_interval)
+        entry = self._targets.get(key)
+        if entry is not None:
+            # Same target again: only settings are updated.
+            entry.target = target
+            entry.base_interval = entry.interval = interval
+            return
+        entry = self._targets[key] = ScheduledTarget(target, interval)
+        self._push(key, entry, time.monotonic() + random.uniform(0, interval))
+
+    def remove(self, key: tuple):
+        """Removes target. Its heap entries are ignored later."""
+        self._targets.pop(key, None)
+
+    def next_due(self) -> float | None:
+        """Returns time of nearest check (time.monotonic()) or None."""
+        while self._heap:
+            due, seq, key = self._heap[0]
+            entry = self._targets.get(key)
+            if entry is not None and entry.seq == seq:
+                return due
+            heapq.heappop(self._heap)  # Outdated entry.
+        return None
+
+    def pop_due(self, now: float) -> list[ScheduledTarget]:
+        """Removes from queue and returns all targets to check at `now`."""
+        res = []
+        while (due := self.next_due()) is not None and due <= now:
+            _, _, key = heapq.heappop(self._heap)
+            res.append(self._targets[key])
+        return res
+
+    def done(self, entry: ScheduledTarget, failed: bool, signature):
+        """Reschedules target after check.
+
+        Args:
+            entry (ScheduledTarget): checked target.
+            failed (bool): is any of check results failed.
+            signature: anything comparable, describing state of target.
+              Target is stable, if it's same as previous one.
+        """
+        key = target_key(entry.target)
+        if self._targets.get(key) is not entry:
+            return  # Removed while was checked.
+        if failed:
+            entry.interval = entry.base_interval * self.failure_factor
+        elif signature == entry.signature:
+            entry.interval = min(entry.interval * self.stable_factor,
+                                 entry.base_interval * self.max_factor)
+        else:
+            entry.interval = entry.base_interval
+        entry.interval = max(entry.interval, self.min_interval)
+        entry.signature = signature
+        # Fixed schedule: next check doesn't depend on check duration.
+        self._push(key, entry, max(entry.due + entry.interval,
+                                   time.monotonic()))
+
+    async def run(self, check_engine,
+                  on_result: typing.Callable[[network.CheckResult], None]):
+        """Checks targets by schedule forever.
+
+        Args:
+            check_engine (engine.Engine): engine to check targets by.
+            on_result: called with every check result. If it returns
+              awaitable, it's awaited.
+        """
+        self._changed = asyncio.Event()
+        running: set[asyncio.Task] = set()
+        try:
+            while True:
+                for entry in self.pop_due(time.monotonic()):
+                    task = asyncio.ensure_future(
+                        self._check(check_engine, entry, on_result)
+                    )
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                self._changed.clear()
+                due = self.next_due()
+                timeout = None if due is None else \
+                    max(due - time.monotonic(), 0)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(running):
+                task.cancel()
+
+    async def _check(self, check_engine, entry: ScheduledTarget,
+                     on_result: typing.Callable):
+        failed = False
+        signature = []
+        try:
+            async for result in check_engine.check(**entry.target):
+                res = on_result(result)
+                if inspect.isawaitable(res):
+                    await res
+                failed = failed or result.get('status') == 0
+                signature.append((result.get('ip'), result.get('port'),
+                                  result.get('status')))
+        finally:
+            self.done(entry, failed, sorted(signature, key=repr))
@@ -0,0 +1,205 @@
+"""Half-open (SYN) port scanner.
+
+Full connect costs socket, ephemeral port and TIME_WAIT entry per probe.
+SynScanner sends SYN packets from one raw socket and waits for answer:
+    SYN-ACK - port is opened (kernel answers it by RST, connection is never
+              established);
+    RST     - port is closed;
+    nothing - port is closed (filtered).
+All probes use the same source port (reserved by bound TCP socket, so
+nobody else gets it), so number of used descriptors doesn't depend on number
+of probes.
+
+Raw sockets need root or CAP_NET_RAW and only IPv4 is supported. When scanner
+can't be used, `probe` returns None and caller must use connect().
+"""
+import asyncio
+import random
+import socket
+import struct
+import time
+
+TCP_HEADER = struct.Struct('!HHIIBBHHH')
+SYN = 0x02
+RST = 0x04
+ACK = 0x10
+
+
+def checksum(data: bytes) -> int:
+    """Internet checksum (RFC 1071)."""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def syn_packet(src_ip: str, dst_ip: str, src_port: int, dst_port: int,
+               seq: int) -> bytes:
+    """Returns TCP header of SYN packet (IP header is added by kernel)."""
+    header = TCP_HEADER.pack(src_port, dst_port, seq, 0, 5 << 4, SYN,
+                             65535, 0, 0)
+    pseudo_header = socket.inet_aton(src_ip) + socket.inet_aton(dst_ip) + \
+        struct.pack('!BBH', 0, socket.IPPROTO_TCP, len(header))
+    return header[:16] + struct.pack('!H', checksum(pseudo_header + header)) \
+        + header[18:]
+
+
+class SynScanner:
+    """Checks ports by SYN packets from one raw socket.
+
+    Args:
+        retries (int): number of SYN resends if there is no answer.
+        receive_buffer (int): receive buffer size of raw socket in bytes.
+
+    """
+
+    def __init__(self, retries: int = 1, receive_buffer: int = 2 ** 24):
+        self.retries = retries
+        self.receive_buffer = receive_buffer
+        self.failed = False  # Raw socket can't be used, don't try again.
+        self._raw: socket.socket | None = None
+        self._reserved: socket.socket | None = None
+        self._port = 0
+        # Source addresses by destination. Routes don't change often.
+        self._sources: dict[str, str] = {}
+        # (ip, port) -> (seq, send time, future). One probe per pair.
+        self._probes: dict[tuple[str, int], tuple[int, int, asyncio.Future]] \
+            = {}
+
+    @staticmethod
+    def available() -> bool:
+        """Checks if raw socket may be opened."""
+        try:
+            socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                          socket.IPPROTO_TCP).close()
+        except OSError:
+            return False
+        return True
+
+    def _open(self) -> bool:
+        if self._raw is not None:
+            return True
+        if self.failed:
+            return False
+        try:
+            self._reserved = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._reserved.bind(('0.0.0.0', 0))
+            self._port = self._reserved.getsockname()[1]
+            self._raw = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                      socket.IPPROTO_TCP)
+            self._raw.setblocking(False)
+            # Raw socket gets every TCP packet of host, answers must not be
+            # dropped because of small buffer.
+            self._raw.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 self.receive_buffer)
+        except OSError:
+            self.failed = True
+            self.close()
+            return False
+        asyncio.get_running_loop().add_reader(self._raw.fileno(),
+                                              self._on_readable)
+        return True
+
+    def close(self):
+        """Closes sockets. Unfinished probes are considered closed."""
+        if self._raw is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._raw.fileno())
+            except RuntimeError:
+                pass  # Loop is already closed.
+            self._raw.close()
+            self._raw = None
+        if self._reserved is not None:
+            self._reserved.close()
+            self._reserved = None
+        for _, _, future in self._probes.values():
+            if not future.done():
+                future.set_result((False, 0))
+        self._probes.clear()
+
+    def _source(self, ip_address: str) -> str:
+        """Returns local address used to reach `ip_address`."""
+        source = self._sources.get(ip_address)
+        if source is None:
+            # Connecting UDP socket sends nothing, only chooses route.
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.connect((ip_address, 9))
+                source = self._sources[ip_address] = sock.getsockname()[0]
+        return source
+
+    def _send(self, ip_address: str, port: int, seq: int):
+        self._raw.sendto(
+            syn_packet(self._source(ip_address), ip_address, self._port,
+                       port, seq),
+            (ip_address, 0)
+        )
+
+    def _on_readable(self):
+        while True:
+            try:
+                packet = self._raw.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received = time.perf_counter_ns()
+            ihl = (packet[0] & 0x0f) * 4
+            if len(packet) < ihl + TCP_HEADER.size:
+                continue
+            src_port, dst_port, _, ack, _, flags, _, _, _ = \
+                TCP_HEADER.unpack_from(packet, ihl)
+            if dst_port != self._port or not flags & (RST | ACK):
+                continue
+            key = (socket.inet_ntoa(packet[12:16]), src_port)
+            probe = self._probes.get(key)
+            if probe is None or ack != (probe[0] + 1) & 0xffffffff:
+                continue  # Not our probe or answer to old one.
+            seq, sent, future = probe
+            if not future.done():
+                opened = bool(flags & SYN and flags & ACK)
+                future.set_result(
+                    (opened, (received - sent) / 1e6 if opened else 0)
+                )
+
+    async def probe(self, ip_address: str, port: int,
+                    timeout: float = 15) -> tuple[bool, float] | None:
+        """Checks port by SYN packet.
+
+        Returns:
+            tuple: (is opened, RTT in ms) like `network.async_port_is_opened`.
+              None if scanner can't check this address (not IPv4, no raw
+              socket or packet can't be sent).
+        """
+        if ':' in ip_address or not self._open():
+            return None
+        key = (ip_address, port)
+        probe = self._probes.get(key)
+        if probe is not None:
+            # Same pair is already being checked: wait for its answer.
+            return await asyncio.shield(probe[2])
+        future = asyncio.get_running_loop().create_future()
+        seq = random.getrandbits(32)
+        result = None  # Also answer of waiters if probe is cancelled.
+        try:
+            for _ in range(self.retries + 1):
+                self._probes[key] = (seq, time.perf_counter_ns(), future)
+                try:
+                    self._send(ip_address, port, seq)
+                except OSError:
+                    return None
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(future), timeout / (self.retries + 1)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            result = False, 0
+            return result
+        finally:
+            if not future.done():
+                # Nobody answered: waiters of same pair get the same result.
+                future.set_result(result)
+            if self._probes.get(key, (None, None, future))[2] is future:
+                self._probes.pop(key, None)
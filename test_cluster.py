@@ -0,0 +1,228 @@
+"""Tests of coordinator and agents on localhost (fake check engine)."""
+import asyncio
+import json
+import socket
+
+import cluster
+import metrics
+import network
+
+TARGETS = [{'host': f'host{idx}.example', 'ports': [80]} for idx in range(40)]
+HOSTS = sorted(target['host'] for target in TARGETS)
+
+
+class FakeEngine:
+    """Reports every port opened after `delay` seconds."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.closed = False
+
+    async def sweep(self, targets):
+        for target in targets:
+            await asyncio.sleep(self.delay)
+            metrics.probe('port', 1)
+            yield network.Result(target['host'], '127.0.0.1', 1.0,
+                                 target['ports'][0], 1)
+
+    def close(self):
+        self.closed = True
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_agents(coordinator: cluster.Coordinator, count: int):
+    while len(coordinator.agents) < count:
+        await asyncio.sleep(0.01)
+
+
+async def collect(coordinator: cluster.Coordinator) -> list[str]:
+    return sorted([result.host async for result in coordinator.sweep()])
+
+
+def start_agent(port: int, name: str, delay: float = 0, heartbeat: float = 2,
+                token: str | None = None) -> asyncio.Task:
+    agent = cluster.Agent('127.0.0.1', port, lambda: FakeEngine(delay), name,
+                          heartbeat=heartbeat, batch_size=4,
+                          batch_delay=0.01, reconnect=0.1, token=token)
+    return asyncio.ensure_future(agent.run())
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 30))
+
+
+def test_parse_address():
+    assert cluster.parse_address('7300') == ('127.0.0.1', 7300)
+    assert cluster.parse_address('0.0.0.0:7300') == ('0.0.0.0', 7300)
+    assert cluster.parse_address('10.0.0.1:7300') == ('10.0.0.1', 7300)
+    assert cluster.parse_address('[::1]:7300') == ('::1', 7300)
+
+
+def test_shards_are_split_between_agents():
+    async def scenario():
+        port = free_port()
+        async with cluster.Coordinator(TARGETS, '127.0.0.1', port,
+                                       shards=8) as coordinator:
+            agents = [start_agent(port, 'a'), start_agent(port, 'b')]
+            await wait_agents(coordinator, 2)
+            first = await collect(coordinator)
+            owners = {agent.name: set(agent.shards)
+                      for agent in coordinator.agents}
+            second = await collect(coordinator)
+            owners_after = {agent.name: set(agent.shards)
+                            for agent in coordinator.agents}
+            for task in agents:
+                task.cancel()
+        return first, second, owners, owners_after, set(coordinator.shards)
+
+    first, second, owners, owners_after, shards = run(scenario())
+    assert first == HOSTS and second == HOSTS
+    assert [len(owned) for owned in owners.values()] == [4, 4]
+    assert owners['a'] | owners['b'] == shards
+    assert not owners['a'] & owners['b']
+    assert owners_after == owners  # Shards stay with their agents.
+
+
+def test_agents_without_token_are_rejected():
+    async def scenario():
+        port = free_port()
+        async with cluster.Coordinator(TARGETS, '127.0.0.1', port, shards=8,
+                                       token='secret') as coordinator:
+            agents = [start_agent(port, 'no-token'),
+                      start_agent(port, 'wrong', token='guess'),
+                      start_agent(port, 'good', token='secret')]
+            await wait_agents(coordinator, 1)
+            await asyncio.sleep(0.3)  # Rejected agents try to reconnect.
+            hosts = await collect(coordinator)
+            names = [agent.name for agent in coordinator.agents]
+            for task in agents:
+                task.cancel()
+        return hosts, names
+
+    hosts, names = run(scenario())
+    assert hosts == HOSTS
+    assert names == ['good']
+
+
+def test_metrics_of_agents_are_merged(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    monkeypatch.setattr(metrics.PROBES, 'values', {})
+    monkeypatch.setattr(metrics, 'enable',
+                        lambda: setattr(metrics, 'enabled', True))
+
+    async def scenario():
+        port = free_port()
+        async with cluster.Coordinator(TARGETS, '127.0.0.1', port,
+                                       shards=8) as coordinator:
+            agents = [start_agent(port, 'a'), start_agent(port, 'b')]
+            await wait_agents(coordinator, 2)
+            await collect(coordinator)  # Agents don't collect metrics.
+            metrics.PROBES.values.clear()
+            metrics.enabled = True
+            await collect(coordinator)
+            for task in agents:
+                task.cancel()
+
+    run(scenario())
+    # Agents run in this process: everything they took must be merged back.
+    assert metrics.PROBES.values == {(('kind', 'port'), ('status', 1)): 40}
+
+
+def test_shards_of_disconnected_agent_are_moved():
+    async def scenario():
+        port = free_port()
+        async with cluster.Coordinator(TARGETS, '127.0.0.1', port,
+                                       shards=8) as coordinator:
+            stays = start_agent(port, 'stays', delay=0.01)
+            leaves = start_agent(port, 'leaves', delay=0.01)
+            await wait_agents(coordinator, 2)
+            first = []
+            async for result in coordinator.sweep():
+                first.append(result.host)
+                if len(first) == 5:
+                    leaves.cancel()
+            owners = {agent.name: len(agent.shards)
+                      for agent in coordinator.agents}
+            second = await collect(coordinator)
+            stays.cancel()
+        return first, owners, second
+
+    first, owners, second = run(scenario())
+    # Unfinished shards are checked again, so results may be repeated.
+    assert sorted(set(first)) == HOSTS
+    assert owners == {'stays': 8}
+    assert second == HOSTS
+
+
+def test_shards_of_silent_agent_are_moved():
+    async def scenario():
+        port = free_port()
+        async with cluster.Coordinator(TARGETS, '127.0.0.1', port, shards=8,
+                                       lease_timeout=0.5) as coordinator:
+            # Connected, but never answers.
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'{"type": "hello", "agent": "silent"}\n')
+            await wait_agents(coordinator, 1)
+            agent = start_agent(port, 'alive', heartbeat=0.1)
+            await wait_agents(coordinator, 2)
+            hosts = await collect(coordinator)
+            names = [agent.name for agent in coordinator.agents]
+            agent.cancel()
+            writer.close()
+        return hosts, names
+
+    hosts, names = run(scenario())
+    assert hosts == HOSTS
+    assert names == ['alive']
+
+
+def test_late_results_are_dropped():
+    def result(host: str) -> list:
+        return list(network.Result(host, '127.0.0.1', 1.0, 80, 1).to_tuple())
+
+    async def agent(port: int):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+        def send(message: dict):
+            writer.write(json.dumps(message).encode() + b'\n')
+
+        send({'type': 'hello', 'agent': 'raw'})
+        shards = {}
+        while True:
+            message = json.loads(await reader.readline())
+            if message['type'] == 'lease':
+                shards[message['shard']] = message['targets']
+            elif message['type'] == 'sweep':
+                break
+        iteration = message['iteration']
+        shard_id = message['shards'][0]
+        # Result of previous iteration and of shard which isn't leased.
+        send({'type': 'results', 'iteration': iteration - 1,
+              'shard': shard_id, 'results': [result('stale.example')]})
+        send({'type': 'results', 'iteration': iteration, 'shard': -1,
+              'results': [result('moved.example')]})
+        for shard_id in message['shards']:
+            send({'type': 'results', 'iteration': iteration,
+                  'shard': shard_id,
+                  'results': [result(target['host'])
+                              for target in shards[shard_id]]})
+            send({'type': 'done', 'iteration': iteration,
+                  'shard': shard_id})
+        await reader.read()
+        writer.close()
+
+    async def scenario():
+        port = free_port()
+        async with cluster.Coordinator(TARGETS, '127.0.0.1', port,
+                                       shards=4) as coordinator:
+            task = asyncio.ensure_future(agent(port))
+            hosts = await collect(coordinator)
+        await task
+        return hosts
+
+    assert run(scenario()) == HOSTS
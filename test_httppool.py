@@ -0,0 +1,57 @@
+"""Tests of kept-alive HTTP checks against loopback server."""
+import asyncio
+
+import httppool
+
+CHUNKED = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+           b'5\r\nHello\r\n6;ext=1\r\n World\r\n0\r\nX-Trailer: 1\r\n\r\n')
+CONTENT_LENGTH = (b'HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\n'
+                  b'Hello World')
+
+
+def check(response: bytes, expect_body: bytes,
+          requests: int = 2) -> tuple[list[bool], int]:
+    """Checks loopback server answering `response` `requests` times.
+
+    Returns:
+        tuple: results of checks and number of accepted connections.
+    """
+    connections = 0
+
+    async def handle(reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        nonlocal connections
+        connections += 1
+        try:
+            while await reader.readuntil(b'\r\n\r\n'):
+                writer.write(response)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass  # Client closed connection.
+        finally:
+            writer.close()
+
+    async def scenario():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = httppool.HttpPool(expect_body=expect_body)
+        try:
+            return [(await pool.check('localhost', '127.0.0.1', port, 2))[0]
+                    for _ in range(requests)]
+        finally:
+            pool.close()
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(scenario()), connections
+
+
+def test_chunked_body():
+    assert check(CHUNKED, b'Hello World') == ([True, True], 1)
+    assert check(CHUNKED, b'Hello\r\n', requests=1)[0] == [False]
+
+
+def test_content_length_body():
+    assert check(CONTENT_LENGTH, b'Hello World') == ([True, True], 1)
+    assert check(CONTENT_LENGTH, b'Hello') == ([True, True], 1)
+    assert check(CONTENT_LENGTH, b'Bye', requests=1)[0] == [False]
@@ -0,0 +1,29 @@
+"""Tests of metrics sent between processes."""
+import json
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Enabled metrics with empty values, restored after test."""
+    monkeypatch.setattr(metrics, 'enabled', True)
+    for metric in metrics.METRICS:
+        monkeypatch.setattr(metric, 'values', {})
+
+
+def test_take_and_merge(registry):
+    metrics.probe('port', 1, {'connect': 2_000_000})
+    metrics.probe('port', 1, {'connect': 30_000_000})
+    metrics.stage('probe', 500_000_000)
+    expected = metrics.render()
+    delta = json.loads(json.dumps(metrics.take()))  # As sent by agent.
+    assert all(not metric.values for metric in metrics.METRICS)
+    assert metrics.take() == {}
+    metrics.merge(delta)
+    assert metrics.render() == expected
+    metrics.merge(delta)
+    assert metrics.PROBES.values == {(('kind', 'port'), ('status', 1)): 4}
+    assert metrics.SWEEP_STAGE.values == {(('stage', 'probe'),): 1.0}
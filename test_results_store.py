@@ -0,0 +1,36 @@
+"""Tests of columnar results store."""
+import network
+import results_store
+
+
+def batch(*times: int) -> list[network.Result]:
+    return [network.Result('example.com', '127.0.0.1', 1.5, 443, 1,
+                           time_ns=stamp) for stamp in times]
+
+
+def test_scan_batches_out_of_time_order(tmp_path):
+    path = str(tmp_path / 'results.bin')
+    store = results_store.ResultStore(path)
+    # Late batch of worker or agent with skewed clock.
+    for times in ((100, 200), (50, 60), (300,)):
+        store.append(batch(*times))
+    for store in (store, results_store.ResultStore(path)):  # Reopened too.
+        assert [item['time'] for item in store.scan(150)] == [200, 300]
+        assert [item['time'] for item in store.scan(55, 250)] == \
+            [100, 200, 60]
+        assert [item['time'] for item in store.scan(301)] == []
+
+
+def test_scan_values(tmp_path):
+    store = results_store.ResultStore(str(tmp_path / 'results.bin'))
+    store.append(batch(100))
+    store.append([network.Result('other.example', None, 0, None, None,
+                                 time_ns=200)])
+    assert list(store.scan(host='example.com')) == [{
+        'time': 100, 'host': 'example.com', 'ip': '127.0.0.1', 'port': 443,
+        'status': results_store.STATUS_OPENED,
+        'cert': results_store.CERT_NOT_CHECKED,
+        'circuit': results_store.CIRCUIT_CLOSED, 'rtt': 1.5,
+    }]
+    assert [item['status'] for item in store.scan(150)] == \
+        [results_store.STATUS_PINGABLE]
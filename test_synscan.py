@@ -0,0 +1,88 @@
+"""Tests of SYN scanner against loopback listeners (need raw sockets)."""
+import asyncio
+import socket
+
+import pytest
+
+import engine
+import synscan
+
+needs_raw = pytest.mark.skipif(not synscan.SynScanner.available(),
+                               reason='raw sockets are not permitted')
+
+
+def test_syn_packet_checksum():
+    packet = synscan.syn_packet('127.0.0.1', '127.0.0.2', 40000, 443, 12345)
+    pseudo_header = socket.inet_aton('127.0.0.1') + \
+        socket.inet_aton('127.0.0.2') + bytes([0, socket.IPPROTO_TCP, 0, 20])
+    assert len(packet) == 20
+    assert synscan.checksum(pseudo_header + packet) == 0
+
+
+def free_port() -> int:
+    """Returns port nobody listens on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@needs_raw
+def test_probe_loopback():
+    async def probe():
+        scanner = synscan.SynScanner()
+        try:
+            return (await scanner.probe('127.0.0.1', opened, 2),
+                    await scanner.probe('127.0.0.1', closed, 2),
+                    await scanner.probe('::1', opened, 2))
+        finally:
+            scanner.close()
+
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        opened = listener.getsockname()[1]
+        closed = free_port()
+        (is_opened, rtt), (is_closed_opened, _), ipv6 = asyncio.run(probe())
+    assert is_opened and rtt > 0
+    assert not is_closed_opened
+    assert ipv6 is None  # Not supported, caller uses connect().
+
+
+@needs_raw
+def test_engine_close_closes_scanner():
+    async def check():
+        check_engine = engine.Engine(scanner=synscan.SynScanner(),
+                                     timeout=2)
+        results = [result async for result in
+                   check_engine.check('127.0.0.1', [port])]
+        raw = check_engine.scanner._raw
+        check_engine.close()
+        return results, raw
+
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        results, raw = asyncio.run(check())
+    assert [result.status for result in results] == [1]
+    assert raw is not None and raw.fileno() == -1
+
+
+def test_waiters_of_unanswered_probe_get_result(monkeypatch):
+    def fail(*_):
+        raise OSError('no route')
+
+    async def probe(send):
+        scanner = synscan.SynScanner(retries=0)
+        monkeypatch.setattr(scanner, '_open', lambda: True)
+        monkeypatch.setattr(scanner, '_send', send)
+        return await asyncio.wait_for(
+            asyncio.gather(scanner.probe('192.0.2.1', 80, 0.2),
+                           scanner.probe('192.0.2.1', 80, 0.2)), 2)
+
+    sent = []
+    # Filtered port: second probe waits for the first one and its timeout.
+    assert asyncio.run(probe(lambda *args: sent.append(args))) == \
+        [(False, 0), (False, 0)]
+    assert len(sent) == 1
+    assert asyncio.run(probe(fail)) == [None, None]
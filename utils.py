@@ -1,22 +1,93 @@
 """Some useful functions"""
+import ipaddress
 import re
+import typing
+
+# Whole hostname: labels of letters, digits and hyphens (not at label edges)
+# separated by dots, optional trailing dot.
+_HOSTNAME = re.compile(
+    r'(?:(?!-)[A-Z\d-]{1,63}(?<!-)\.)*(?!-)[A-Z\d-]{1,63}(?<!-)\.?',
+    re.IGNORECASE
+)
 
 
 def is_hostname(hostname: str):
     """Is provided string is hostname"""
     if len(hostname) > 255 or not len(hostname):
         return False
-    if hostname[-1] == ".":
-        hostname = hostname[:-1]
-    allowed = re.compile(r'(?!-)[A-Z\d-]{1,63}(?<!-)$', re.IGNORECASE)
-    return all(allowed.match(x) for x in hostname.split("."))
+    return _HOSTNAME.fullmatch(hostname) is not None
 
 
 def is_ip(ip: str):
-    """Is provided string is ip"""
-    return bool(re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$').match(ip))
+    """Is provided string is ip (IPv4 or IPv6)"""
+    if not isinstance(ip, str):
+        return False
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return True
 
 
 def check_host(host: str):
     """Checks if provided `host` is valid hostname or ip address"""
     return isinstance(host, str) and (is_hostname(host) or is_ip(host))
+
+
+def parse_ports(ports: str) -> list[int]:
+    """Parses comma separated ports. Raises ValueError if it's invalid."""
+    return [int(port.strip()) for port in ports.strip().split(',')]
+
+
+class BulkValidator:
+    """Validates hosts and port lists by batches.
+
+    Inventories repeat same hostnames and port lists many times, so every
+    distinct value is validated once and answer is taken from cache later.
+
+    Args:
+        max_cache (int): max cached values of every kind. When cache is full,
+          new values are validated, but not cached.
+
+    """
+
+    def __init__(self, max_cache: int = 1000000):
+        self.max_cache = max_cache
+        self._hosts: dict[str, bool] = {}
+        self._ports: dict[str, tuple[int, ...] | None] = {}
+
+    def hosts(self, hosts: typing.Iterable) -> list[bool]:
+        """Returns `check_host` result for every host."""
+        res = []
+        cache = self._hosts
+        for host in hosts:
+            if not isinstance(host, str):
+                res.append(False)
+                continue
+            valid = cache.get(host)
+            if valid is None:
+                valid = check_host(host)
+                if len(cache) < self.max_cache:
+                    cache[host] = valid
+            res.append(valid)
+        return res
+
+    def ports(self, values: typing.Iterable[str]) -> list[list[int] | None]:
+        """Returns `parse_ports` result (None if invalid) for every value.
+
+        Empty value means no ports.
+        """
+        res = []
+        cache = self._ports
+        for value in values:
+            if value in cache:
+                ports = cache[value]
+            else:
+                try:
+                    ports = tuple(parse_ports(value)) if value != '' else ()
+                except ValueError:
+                    ports = None
+                if len(cache) < self.max_cache:
+                    cache[value] = ports
+            res.append(None if ports is None else list(ports))
+        return res
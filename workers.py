@@ -0,0 +1,176 @@
+"""Multi-process execution for very large target lists.
+
+One process is limited by GIL (results formatting, TLS verification) and by
+file descriptors. WorkerPool splits targets between worker processes, every
+worker runs its own `engine.Engine`, and results are merged back into one
+stream in parent process.
+
+Targets are split by hash of host, so same host is always checked by the same
+worker and worker's DNS and TLS caches stay warm.
+"""
+import asyncio
+import multiprocessing
+import queue
+import time
+import typing
+import zlib
+
+import metrics
+import network
+
+
+def shard_of(host: str, shards: int) -> int:
+    """Returns shard index of `host`. Same for every run and every process."""
+    return zlib.crc32(host.lower().encode('utf-8', 'replace')) % shards
+
+
+def split(targets: typing.Iterable[dict], shards: int) -> list[list[dict]]:
+    """Splits host settings into `shards` lists by host."""
+    res = [[] for _ in range(shards)]
+    for host_settings in targets:
+        res[shard_of(host_settings['host'], shards)].append(host_settings)
+    return res
+
+
+def _worker_main(targets: list[dict], engine_factory: typing.Callable,
+                 commands: multiprocessing.Queue,
+                 results: multiprocessing.Queue,
+                 batch_size: int, batch_delay: float, instrument: bool):
+    """Worker process: runs sweep on every command and sends results back.
+
+    Metrics collected since previous message are sent with every message.
+    """
+    if instrument:
+        metrics.enable()
+
+    async def sweep(check_engine):
+        batch = []
+        sent = time.monotonic()
+        async for result in check_engine.sweep(targets):
+            batch.append(result)
+            if (len(batch) >= batch_size or
+                    time.monotonic() - sent >= batch_delay):
+                results.put(('results', (batch, metrics.take())))
+                batch = []
+                sent = time.monotonic()
+        if batch:
+            results.put(('results', (batch, metrics.take())))
+
+    async def serve():
+        check_engine = engine_factory()
+        loop = asyncio.get_running_loop()
+        try:
+            while await loop.run_in_executor(None, commands.get):
+                try:
+                    await sweep(check_engine)
+                except Exception as exc:
+                    results.put(('error', repr(exc)))
+                results.put(('done', metrics.take()))
+        finally:
+            check_engine.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+    """Pool of worker processes, every one checks its own part of targets.
+
+    Args:
+        targets: valid host settings, same as accepted by `network.check`.
+        workers (int): number of processes.
+        engine_factory: picklable callable without arguments, which returns
+          `engine.Engine`. Called once in every worker.
+        batch_size (int): max results sent from worker at once.
+        batch_delay (float): max seconds result may wait in worker's batch.
+
+    Usage:
+        with WorkerPool(targets, 4, factory) as pool:
+            async for result in pool.sweep():
+                ...
+
+    """
+
+    def __init__(self, targets: typing.Iterable[dict], workers: int,
+                 engine_factory: typing.Callable, batch_size: int = 256,
+                 batch_delay: float = 0.2):
+        self.shards = [shard for shard in split(targets, workers) if shard]
+        self.engine_factory = engine_factory
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._processes: list[multiprocessing.Process] = []
+        self._commands: list[multiprocessing.Queue] = []
+        self._results: multiprocessing.Queue | None = None
+
+    def start(self):
+        """Starts worker processes."""
+        self._results = multiprocessing.Queue()
+        for shard in self.shards:
+            commands = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(shard, self.engine_factory, commands, self._results,
+                      self.batch_size, self.batch_delay, metrics.enabled),
+                daemon=True
+            )
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+
+    def stop(self):
+        """Stops worker processes."""
+        for commands in self._commands:
+            commands.put(False)
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+        self._commands.clear()
+
+    def _receive(self) -> tuple[str, typing.Any] | None:
+        """Waits for message of any worker (None if there is none for 1 s)."""
+        try:
+            return self._results.get(timeout=1)
+        except queue.Empty:
+            if not all(process.is_alive() for process in self._processes):
+                raise RuntimeError('Worker process died unexpectedly.')
+            return None
+
+    async def sweep(self) -> typing.AsyncGenerator[network.CheckResult, None]:
+        """Runs one sweep in all workers.
+
+        Metrics of workers are added to metrics of this process.
+
+        Yields:
+            CheckResult: results of all workers, in order they are received.
+        """
+        loop = asyncio.get_running_loop()
+        for commands in self._commands:
+            commands.put(True)
+        running = len(self._commands)
+        while running:
+            message = await loop.run_in_executor(None, self._receive)
+            if message is None:
+                continue
+            kind, payload = message
+            match kind:
+                case 'results':
+                    batch, delta = payload
+                    metrics.merge(delta)
+                    for result in batch:
+                        yield result
+                case 'done':
+                    metrics.merge(payload)
+                    running -= 1
+                case 'error':
+                    raise RuntimeError(f'Worker failed: {payload}')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()